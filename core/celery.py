@@ -1,8 +1,23 @@
 import os
 from celery import Celery
+from kombu import Queue
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 app = Celery("core")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+# Notification priority lanes (NOTIFY_PRIORITY_QUEUES). Send tasks are published
+# to their lane by notifications.routing; give each lane its own workers, e.g.
+#   celery -A core worker -Q notify.critical -c 4
+#   celery -A core worker -Q notify.default,notify.bulk
+# The dispatcher feeds every lane, so it rides the critical queue; the other
+# periodic notifications tasks use the default lane.
+from notifications.conf import PRIORITY_QUEUES  # noqa: E402  (needs DJANGO_SETTINGS_MODULE)
+
+app.conf.task_queues = [Queue("celery")] + [Queue(name) for name in PRIORITY_QUEUES.values()]
+app.conf.task_routes = {
+    "notifications.tasks.dispatch_due_notifications": {"queue": PRIORITY_QUEUES["critical"]},
+    "notifications.tasks.*": {"queue": PRIORITY_QUEUES["default"]},
+}
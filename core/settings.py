@@ -144,3 +144,23 @@ CELERY_ENABLE_UTC = True
 NOTIFY_DEFAULT_SEND_TIME = "09:00"
 NOTIFY_ALLOW_DATE_ONLY = True
 NOTIFY_ICS_DEFAULT_DURATION_MIN = 60
+
+# Future notifications wait in the DB; beat runs the dispatcher that enqueues them when due
+NOTIFY_DB_DISPATCHER = True
+NOTIFY_DISPATCH_WINDOW_SECONDS = 60
+NOTIFY_DISPATCH_INTERVAL_SECONDS = 15
+CELERY_BEAT_SCHEDULE = {
+    "notifications-dispatch-due": {
+        "task": "notifications.tasks.dispatch_due_notifications",
+        "schedule": NOTIFY_DISPATCH_INTERVAL_SECONDS,
+    },
+    "notifications-recover-stale-leases": {
+        "task": "notifications.tasks.recover_stale_leases",
+        "schedule": 60,
+    },
+    # deletes nothing until NOTIFY_LOG_RETENTION_DAYS / NOTIFY_NOTIFICATION_RETENTION_DAYS are set
+    "notifications-retention": {
+        "task": "notifications.tasks.purge_old_notifications",
+        "schedule": 60 * 60,
+    },
+}
@@ -16,6 +16,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from notifications import views as notification_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('notifications/metrics/', notification_views.metrics, name='notification-metrics'),
 ]
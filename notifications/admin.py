@@ -1,28 +1,72 @@
 from django.contrib import admin, messages
-from .models import NotificationTemplate, ScheduledNotification, NotificationLog
-from .services import cancel_notification, compute_schedule
+from .campaigns import recount
+from .circuit_breaker import CLOSED, smtp_breaker
+from .models import Campaign, NotificationTemplate, ScheduledNotification, NotificationLog, Suppression
+from .leveling import spread_send_at
+from .services import cancel_many, compute_schedule
+from .suppression import suppression_list
+
+class BreakerWarningMixin:
+    """Warn on the changelist while the SMTP circuit breaker is not closed."""
+
+    def changelist_view(self, request, extra_context=None):
+        breaker = smtp_breaker.snapshot()
+        if breaker["state"] != CLOSED:
+            self.message_user(
+                request,
+                f"SMTP circuit breaker is {breaker['state'].replace('_', '-')} after {breaker['failures']} "
+                f"connection failures; sends are deferred (next probe in {breaker['retry_in_seconds']:.0f}s).",
+                level=messages.WARNING,
+            )
+        return super().changelist_view(request, extra_context)
 
 @admin.register(NotificationTemplate)
 class NotificationTemplateAdmin(admin.ModelAdmin):
-    list_display = ("subject", "key", "updated_at")
+    list_display = ("subject", "key", "priority", "digest_compatible", "updated_at")
+    list_filter = ("priority", "digest_compatible")
     search_fields = ("subject", "key")
     ordering = ("subject",)
 
+@admin.register(Campaign)
+class CampaignAdmin(BreakerWarningMixin, admin.ModelAdmin):
+    list_display = ("name", "scheduled_count", "sent_count", "failed_count", "canceled_count", "pending_count", "progress_display", "created_at")
+    search_fields = ("name",)
+    ordering = ("-created_at",)
+    readonly_fields = ("scheduled_count", "sent_count", "failed_count", "canceled_count", "created_at", "updated_at")
+    actions = ["cancel_campaign", "recount_selected"]
+
+    @admin.display(description="Progress")
+    def progress_display(self, obj):
+        return f"{obj.progress:.0%}"
+
+    def cancel_campaign(self, request, queryset):
+        counts = cancel_many({"campaign__in": queryset}, revoke=True)
+        self.message_user(request, f"{counts['canceled']} notifications successfully canceled.", level=messages.SUCCESS)
+    cancel_campaign.short_description = "Cancel all pending notifications in selected campaigns"
+
+    def recount_selected(self, request, queryset):
+        for campaign in queryset:
+            recount(campaign)
+        self.message_user(request, f"Recounted {queryset.count()} campaigns.", level=messages.SUCCESS)
+    recount_selected.short_description = "Rebuild progress counters from notifications"
+
 @admin.register(ScheduledNotification)
-class ScheduledNotificationAdmin(admin.ModelAdmin):
-    list_display = ("template", "to_email", "state", "scheduling_mode", "effective_send_at", "attempts", "attach_ics")
-    list_filter = ("state", "scheduling_mode", "attach_ics")
+class ScheduledNotificationAdmin(BreakerWarningMixin, admin.ModelAdmin):
+    list_display = ("template", "to_email", "state", "scheduling_mode", "effective_send_at", "attempts", "priority", "attach_ics")
+    list_filter = ("state", "scheduling_mode", "priority", "attach_ics", "campaign")
+    raw_id_fields = ("campaign",)
     search_fields = ("to_email", "provider_message_id")
     ordering = ("-effective_send_at",)
-    readonly_fields = ("state","attempts", "last_error", "provider_message_id", "created_at", "updated_at")
+    readonly_fields = ("state","attempts", "last_error", "provider_message_id", "lease_owner", "lease_expires_at", "created_at", "updated_at")
     actions = ["cancel_selected"]
 
     def cancel_selected(self, request, queryset):
-        count = 0
-        for notif in queryset:
-            if cancel_notification(notif):
-                count += 1
-        self.message_user(request, f"{count} notifications successfully canceled.", level=messages.SUCCESS)
+        counts = cancel_many(queryset, revoke=True)
+        skipped = counts["matched"] - counts["canceled"]
+        message = f"{counts['canceled']} notifications successfully canceled."
+        if skipped:
+            message += f" {skipped} were already sent, failed or canceled."
+        self.message_user(request, message, level=messages.SUCCESS)
     cancel_selected.short_description = "Cancel selected notifications"
         
     def save_model(self, request, obj, form, change):
@@ -34,6 +78,9 @@ class ScheduledNotificationAdmin(admin.ModelAdmin):
         obj.scheduling_mode = mode
         obj.effective_send_at = send_at_utc
         obj.user_timezone = resolved_tz
+        if change:
+            # new rows are spread by the pre_save signal once their key exists
+            obj.effective_send_at = spread_send_at(mode, send_at_utc, obj.idempotency_key)
         super().save_model(request, obj, form, change)
 
   
@@ -71,6 +118,29 @@ class ScheduledNotificationAdmin(admin.ModelAdmin):
 @admin.register(NotificationLog)
 class NotificationLogAdmin(admin.ModelAdmin):
     list_display = ("notification", "attempt_no", "status", "to_email", "subject_snapshot", "started_at", "finished_at")
-    list_filter = ("status",)
+    list_filter = ("status", "error_class")
     search_fields = ("to_email", "provider_message_id", "subject_snapshot")
-    ordering = ("-started_at",)   
\ No newline at end of file
+    ordering = ("-started_at",)
+    # __str__ of the notification column reads its template; avoid one query per row
+    list_select_related = ("notification__template",)
+    # skip the unfiltered COUNT(*) over the whole table on every page
+    show_full_result_count = False   
+
+@admin.register(Suppression)
+class SuppressionAdmin(admin.ModelAdmin):
+    list_display = ("email", "reason", "created_at")
+    list_filter = ("reason",)
+    search_fields = ("email",)
+    ordering = ("-created_at",)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        suppression_list.refresh(full=True)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        suppression_list.refresh(full=True)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        suppression_list.refresh(full=True)
@@ -0,0 +1,431 @@
+"""
+Asyncio delivery engine: one process, many concurrent SMTP sessions.
+
+An alternative to Celery workers for bulk volume (`manage.py run_async_sender`).
+Each round it claims due rows like the DB dispatcher, builds messages with the
+same code as send_notification_batch, pushes them through up to
+NOTIFY_ASYNC_CONCURRENCY SMTP sessions at once and records the outcomes with
+the same state transitions and NotificationLog rows. Retryable failures go
+to RETRYING and are picked up again by a later round once their backoff
+(notifications.retry) has passed. While the SMTP circuit breaker
+(notifications.circuit_breaker) is open no rounds are claimed; if it opens
+mid-round, the unsent rest of the round is released and retried once it
+half-opens. Rate limiter and breaker calls (possibly a Redis round-trip each)
+run in the default executor, off the event loop. Each round keeps its lease
+alive while it sends (tasks._BatchLease) and skips rows canceled or recovered
+meanwhile.
+
+SMTP is spoken directly over asyncio streams to EMAIL_HOST / EMAIL_PORT
+(EMAIL_USE_TLS / EMAIL_USE_SSL, EMAIL_HOST_USER / EMAIL_HOST_PASSWORD,
+EMAIL_TIMEOUT); EMAIL_BACKEND is not used.
+"""
+import asyncio
+import base64
+import heapq
+import re
+import ssl
+import time
+import uuid
+from collections import deque
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .conf import (
+    ASYNC_BATCH_SIZE,
+    ASYNC_CONCURRENCY,
+    DISPATCH_INTERVAL_SECONDS,
+    RETRY_MAX_SECONDS,
+    SMTP_POOL_MAX_MESSAGES,
+)
+from .circuit_breaker import HALF_OPEN, smtp_breaker
+from .dispatch import claim_due_notifications
+from .metrics import increment, timing
+from .models import ScheduledNotification
+from .rate_limit import rate_limiter
+from .retry import CONNECTION, MessageBuildError, classify
+from .tasks import _BatchLease, _prepare_batch, _record_batch
+
+_LEADING_DOT = re.compile(rb"^\.", re.MULTILINE)
+
+
+class SMTPResponseError(Exception):
+    """The server answered with an unexpected reply code."""
+
+    def __init__(self, code: int, message: str):
+        self.code = code
+        self.message = message
+        super().__init__(f"{code} {message}")
+
+
+class AsyncSMTPConnection:
+    """
+    Minimal SMTP client on asyncio streams: EHLO, STARTTLS or implicit TLS,
+    AUTH PLAIN, and MAIL/RCPT/DATA per message (sent as one write when the
+    server offers PIPELINING). One message at a time per connection;
+    concurrency comes from running many connections.
+    """
+
+    def __init__(
+        self,
+        host: str = None,
+        port: int = None,
+        *,
+        username: str = None,
+        password: str = None,
+        use_tls: bool = None,
+        use_ssl: bool = None,
+        timeout: float = None,
+    ):
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_tls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = timeout or settings.EMAIL_TIMEOUT or 30
+        self.messages_sent = 0
+        self.pipelining = False
+        self._reader = None
+        self._writer = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _reply(self):
+        lines = []
+        while True:
+            raw = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            if not raw:
+                raise ConnectionError("SMTP server closed the connection")
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            lines.append(line[4:])
+            # "250-..." continues a multi-line reply, "250 ..." ends it
+            if len(line) < 4 or line[3] != "-":
+                return int(line[:3]), "\n".join(lines)
+
+    async def command(self, line: str, expect=(250,)):
+        self._writer.write(line.encode("utf-8") + b"\r\n")
+        await self._writer.drain()
+        code, message = await self._reply()
+        if code not in expect:
+            raise SMTPResponseError(code, message)
+        return code, message
+
+    async def open(self):
+        context = ssl.create_default_context() if (self.use_tls or self.use_ssl) else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context if self.use_ssl else None),
+            self.timeout,
+        )
+        try:
+            code, message = await self._reply()
+            if code != 220:
+                raise SMTPResponseError(code, message)
+            _, features = await self.command(f"EHLO {DNS_NAME}")
+            if self.use_tls:
+                await self.command("STARTTLS", expect=(220,))
+                await self._writer.start_tls(context, server_hostname=self.host)
+                _, features = await self.command(f"EHLO {DNS_NAME}")
+            self.pipelining = "PIPELINING" in features.upper().split("\n")
+            if self.username:
+                token = base64.b64encode(f"\0{self.username}\0{self.password}".encode("utf-8")).decode("ascii")
+                await self.command(f"AUTH PLAIN {token}", expect=(235,))
+        except BaseException:
+            # never hand out a half-negotiated (e.g. unauthenticated) session
+            await self.close()
+            raise
+
+    async def send_message(self, email):
+        """Send one django EmailMessage."""
+        await self.send_raw(*envelope(email))
+
+    async def send_raw(self, from_email: str, recipients, data: bytes):
+        """Send pre-serialized message bytes (see `envelope()`)."""
+        try:
+            if self.pipelining:
+                await self._pipelined_envelope(from_email, recipients)
+            else:
+                await self.command(f"MAIL FROM:<{from_email}>")
+                for recipient in recipients:
+                    await self.command(f"RCPT TO:<{recipient}>", expect=(250, 251))
+                await self.command("DATA", expect=(354,))
+            # dot-stuffing: a line starting with "." gets a second one
+            data = _LEADING_DOT.sub(b"..", data)
+            if not data.endswith(b"\r\n"):
+                data += b"\r\n"
+            self._writer.write(data + b".\r\n")
+            await self._writer.drain()
+            code, message = await self._reply()
+            if code != 250:
+                raise SMTPResponseError(code, message)
+        except SMTPResponseError:
+            # the session is still usable; reset the half-done transaction
+            try:
+                await self.command("RSET")
+            except Exception:
+                await self.close()
+            raise
+        self.messages_sent += 1
+
+    async def _pipelined_envelope(self, from_email: str, recipients):
+        """MAIL + RCPTs + DATA in one round-trip (RFC 2920); replies are checked in order."""
+        lines = [f"MAIL FROM:<{from_email}>", *(f"RCPT TO:<{r}>" for r in recipients), "DATA"]
+        self._writer.write("".join(f"{line}\r\n" for line in lines).encode("utf-8"))
+        await self._writer.drain()
+        replies = [await self._reply() for _ in lines]
+        expected = [(250,)] + [(250, 251)] * len(recipients) + [(354,)]
+        error = next(
+            (SMTPResponseError(code, message) for (code, message), ok in zip(replies, expected) if code not in ok),
+            None,
+        )
+        if error is None:
+            return
+        if replies[-1][0] == 354:
+            # the server still went into DATA mode; end it with an empty message before RSET
+            self._writer.write(b".\r\n")
+            await self._writer.drain()
+            await self._reply()
+        raise error
+
+    async def close(self):
+        if self._writer is None:
+            return
+        try:
+            if not self._writer.is_closing():
+                await asyncio.wait_for(self.command("QUIT", expect=(221,)), 5)
+        except Exception:
+            # closing a dead socket can raise; we are throwing it away anyway
+            pass
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception:
+            pass
+        self._writer = None
+
+
+def envelope(email):
+    """
+    (from, recipients, bytes) for a django EmailMessage, the same way Django's
+    SMTP backend builds them. Serializing is CPU work, so rounds do it off the event loop.
+    """
+    encoding = email.encoding or settings.DEFAULT_CHARSET
+    from_email = sanitize_address(email.from_email, encoding)
+    recipients = [sanitize_address(addr, encoding) for addr in email.recipients()]
+    return from_email, recipients, email.message().as_bytes(linesep="\r\n")
+
+
+def _due_ids(limit: int, retry_ids=()):
+    """
+    Pick up to `limit` rows for one round: this sender's retries whose backoff
+    passed, due PENDING/SCHEDULED rows (moved to QUEUED like the dispatcher
+    does), then RETRYING rows nobody has touched for RETRY_MAX_SECONDS (e.g. left
+    behind by a restart).
+    """
+    close_old_connections()
+    now = timezone.now()
+    ids = list(retry_ids)
+    if len(ids) < limit:
+        ids.extend(pk for pk, _, _ in claim_due_notifications(window_seconds=0, limit=limit - len(ids), now=now))
+    if len(ids) < limit:
+        ids.extend(
+            ScheduledNotification.objects.filter(
+                state=ScheduledNotification.Status.RETRYING,
+                canceled=False,
+                lease_owner__isnull=True,
+                updated_at__lte=now - timedelta(seconds=RETRY_MAX_SECONDS),
+            )
+            .order_by()
+            .values_list("pk", flat=True)[: limit - len(ids)]
+        )
+    return ids
+
+
+def _prepare_round(limit: int, retry_ids=()):
+    ids = _due_ids(limit, retry_ids)
+    if not ids:
+        return None
+    started_at = timezone.now()
+    owner = uuid.uuid4().hex
+    notifications, results, outgoing = _prepare_batch(ids, owner, started_at)
+    ready = []
+    for sn, email, subject, message_id in outgoing:
+        try:
+            ready.append((sn, envelope(email), subject, message_id))
+        except Exception as e:
+            results[sn.pk] = (subject, "", MessageBuildError(e))
+    return started_at, notifications, results, ready, _BatchLease(owner, notifications, started_at)
+
+
+class AsyncSender:
+    """
+    Runs rounds of claim -> build -> concurrent send -> bulk record.
+
+    The next round is claimed and built while the current one is on the wire,
+    and SMTP sessions stay open across rounds (recycled after
+    NOTIFY_SMTP_POOL_MAX_MESSAGES).
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = ASYNC_CONCURRENCY,
+        batch_size: int = ASYNC_BATCH_SIZE,
+        smtp_options: dict = None,
+    ):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.smtp_options = smtp_options or {}
+        self._idle = []  # open AsyncSMTPConnection objects between rounds
+        self._retries = []  # heap of (monotonic due time, pk) for rows this sender will retry
+        # every DB call goes through one thread, in order
+        self._prepare_sync = sync_to_async(_prepare_round, thread_sensitive=True)
+        self._record = sync_to_async(_record_batch, thread_sensitive=True)
+        self._renew = sync_to_async(_BatchLease.renew, thread_sensitive=True)
+        # rate limiter / breaker calls can wait on a Redis round-trip: they run in the
+        # default executor so a slow reply stalls one session, not the whole event loop
+        self._acquire = sync_to_async(rate_limiter.acquire, thread_sensitive=False)
+        self._allow = sync_to_async(smtp_breaker.allow, thread_sensitive=False)
+        self._record_success = sync_to_async(smtp_breaker.record_success, thread_sensitive=False)
+        self._record_failure = sync_to_async(smtp_breaker.record_failure, thread_sensitive=False)
+
+    async def _prepare(self, limit: int):
+        # SMTP server known to be down: claim nothing (run() idles and asks again)
+        if smtp_breaker.enabled and await self._allow():
+            return None
+        now = time.monotonic()
+        retry_ids = []
+        while self._retries and self._retries[0][0] <= now and len(retry_ids) < limit:
+            retry_ids.append(heapq.heappop(self._retries)[1])
+        return await self._prepare_sync(limit, retry_ids)
+
+    async def _send_all(self, outgoing, results, lease) -> dict:
+        """
+        Send `outgoing`, filling `results`; rows `lease` no longer holds are skipped.
+        Returns {pk: seconds} for the rows left unsent because the circuit breaker opened.
+        """
+        queue = deque(outgoing)
+        breaker_wait = 0.0
+
+        async def session(max_messages=None):
+            nonlocal breaker_wait
+            connection = self._idle.pop() if self._idle else None
+            try:
+                while queue and not breaker_wait and max_messages != 0:
+                    if max_messages:
+                        max_messages -= 1
+                    sn, message, subject, message_id = queue.popleft()
+                    if lease.due():
+                        await self._renew(lease)
+                    if sn.pk not in lease.held:
+                        continue  # canceled or recovered since the claim
+                    if rate_limiter.enabled:
+                        # waiting is cheap here: only this session pauses, not the process
+                        while wait := await self._acquire(sn.to_email):
+                            await asyncio.sleep(wait)
+                    try:
+                        if connection is not None and connection.messages_sent >= SMTP_POOL_MAX_MESSAGES:
+                            await connection.close()
+                            connection = None
+                        if connection is None or not connection.is_open:
+                            connection = AsyncSMTPConnection(**self.smtp_options)
+                            await connection.open()
+                        await connection.send_raw(*message)
+                        results[sn.pk] = (subject, message_id, None)
+                        await self._record_success()
+                    except Exception as e:
+                        results[sn.pk] = (subject, "", e)
+                        if connection is not None and not isinstance(e, SMTPResponseError):
+                            # broken socket: reconnect for the next message
+                            await connection.close()
+                            connection = None
+                        if classify(e) == CONNECTION and await self._record_failure():
+                            # stops every session; what is left in the queue waits for the half-open
+                            breaker_wait = breaker_wait or await self._allow() or smtp_breaker.open_seconds
+            finally:
+                if connection is not None and connection.is_open:
+                    self._idle.append(connection)
+
+        if smtp_breaker.state == HALF_OPEN:
+            # this round holds the probe: one message decides whether the rest go out
+            await session(max_messages=1)
+        await asyncio.gather(*(session() for _ in range(min(self.concurrency, len(queue)))))
+        return {sn.pk: breaker_wait for sn, _, _, _ in queue}
+
+    async def _deliver(self, prepared) -> dict:
+        started_at, notifications, results, outgoing, lease = prepared
+        t0 = time.perf_counter()
+        deferred = await self._send_all(outgoing, results, lease)
+        retries, lost = await self._record(notifications, results, started_at, lease.owner, deferred)
+        now = time.monotonic()
+        for pk, countdown in [*retries, *deferred.items()]:
+            if pk not in lost:
+                heapq.heappush(self._retries, (now + countdown, pk))
+
+        failed = sum(1 for pk, (_, _, error) in results.items() if error is not None and pk not in lost)
+        counts = {
+            "sent": sum(1 for pk, (_, _, error) in results.items() if error is None and pk not in lost),
+            "failed": failed,
+        }
+        timing("async.round", (time.perf_counter() - t0) * 1000.0)
+        increment("async.sent", counts["sent"])
+        increment("async.failed", counts["failed"])
+        return counts
+
+    async def run_once(self) -> dict:
+        """One round; returns {"sent", "failed"} (both 0 when nothing was due)."""
+        prepared = await self._prepare(self.batch_size)
+        if prepared is None:
+            return {"sent": 0, "failed": 0}
+        return await self._deliver(prepared)
+
+    async def run(
+        self,
+        *,
+        interval: float = DISPATCH_INTERVAL_SECONDS,
+        stop: asyncio.Event = None,
+        until_idle: bool = False,
+    ):
+        """
+        Loop until `stop` is set (or, with until_idle, until a round finds nothing due),
+        sleeping `interval` seconds whenever nothing is due.
+        """
+        stop = stop or asyncio.Event()
+        next_round = asyncio.ensure_future(self._prepare(self.batch_size))
+        try:
+            while True:
+                prepared, next_round = await next_round, None
+                if prepared is None:
+                    if until_idle:
+                        break
+                    try:
+                        await asyncio.wait_for(stop.wait(), interval)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    # claim + build the next round while this one is being sent
+                    if not stop.is_set():
+                        next_round = asyncio.ensure_future(self._prepare(self.batch_size))
+                    await self._deliver(prepared)
+                if stop.is_set():
+                    break
+                if next_round is None:
+                    next_round = asyncio.ensure_future(self._prepare(self.batch_size))
+        finally:
+            if next_round is not None:
+                prepared = await next_round
+                if prepared is not None:
+                    # already claimed and leased; send it rather than leave it to lease expiry
+                    await self._deliver(prepared)
+            await self.close()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(connection.close() for connection in idle))
@@ -0,0 +1,798 @@
+"""
+Benchmarks for the notification pipeline.
+
+Scenarios run against a throwaway test database (emptied between runs), the locmem email
+backend and an in-memory Celery broker (eager execution unless the scenario
+only measures publishing), so it is safe to run next to a real deployment:
+
+    python manage.py benchmark_notifications                      # all scenarios, 1k rows
+    python manage.py benchmark_notifications send batch --count 1000 10000
+"""
+import asyncio
+import queue
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, time as dtime, timedelta
+from unittest.mock import patch
+
+from celery.signals import before_task_publish
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from .async_sender import AsyncSender
+from .conf import BATCH_SIZE, ICS_DEFAULT_DURATION_MIN
+from .ics import build_ics, build_ics_icalendar, ics_cache
+from .leveling import load_profile, simulate
+from .models import NotificationLog, NotificationTemplate, Priority, ScheduledNotification, Suppression
+from .routing import queue_for
+from .services import (
+    bulk_schedule,
+    compute_idempotency_key,
+    compute_idempotency_keys,
+    compute_schedule,
+    compute_schedule_many,
+    enqueue_for_delivery,
+)
+from .smtp_pool import get_pool
+from .tasks import (
+    _build_email,
+    _render,
+    dispatch_due_notifications,
+    send_digest_batch,
+    send_notification,
+    send_notification_batch,
+)
+from .suppression import suppression_list
+from .template_cache import template_cache
+
+TIMEZONES = ["UTC", "Asia/Karachi", "Europe/London", "America/New_York", "Australia/Sydney", "Not/AZone"]
+
+
+@contextmanager
+def in_memory_celery():
+    """
+    Eager Celery with an in-memory broker and result backend; restored afterwards.
+    Producers already pooled for the configured broker are dropped both ways.
+    """
+    app = send_notification.app
+    saved = {
+        key: app.conf[key]
+        for key in ("task_always_eager", "task_eager_propagates", "broker_url", "result_backend")
+    }
+    app.conf.update(
+        task_always_eager=True,
+        task_eager_propagates=False,
+        broker_url="memory://",
+        result_backend="cache+memory://",
+    )
+    app.amqp._producer_pool = None
+    try:
+        yield
+    finally:
+        app.conf.update(saved)
+        app.amqp._producer_pool = None
+
+
+@contextmanager
+def isolated_environment():
+    """
+    Throwaway test DB + locmem email backend + in-memory eager Celery; restored afterwards.
+    """
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with in_memory_celery():
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def reset_database():
+    """Empty every table between scenarios so runs never see each other's rows."""
+    call_command("flush", interactive=False, verbosity=0)
+    template_cache.clear()
+    ics_cache.clear()
+    suppression_list.refresh(full=True)
+
+
+@contextmanager
+def publish_only():
+    """Publish tasks to the in-memory broker instead of running them eagerly."""
+    app = send_notification.app
+    app.conf.task_always_eager = False
+    try:
+        yield
+    finally:
+        app.conf.task_always_eager = True
+
+
+@contextmanager
+def propagating(task):
+    """
+    Run `task` through .apply().get() when it is published, so a crash in it fails the
+    scenario instead of being swallowed by eager execution (task_eager_propagates=False).
+    """
+    def run(args=None, kwargs=None, **options):
+        return task.apply(args=args, kwargs=kwargs).get()
+
+    with patch.object(task, "apply_async", side_effect=run):
+        yield
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(name: str, count: int, elapsed: float, latencies=None, queries: int = None) -> dict:
+    """Common result shape for every scenario."""
+    latencies = latencies or []
+    result = {
+        "scenario": name,
+        "count": count,
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 1) if elapsed else 0.0,
+    }
+    if latencies:
+        result["p50_ms"] = round(percentile(latencies, 50) * 1000, 3)
+        result["p99_ms"] = round(percentile(latencies, 99) * 1000, 3)
+        result["mean_ms"] = round(statistics.fmean(latencies) * 1000, 3)
+    if queries is not None:
+        result["queries"] = queries
+        result["queries_per_item"] = round(queries / count, 2) if count else 0.0
+    return result
+
+
+class QueryCounter:
+    """
+    Counts DB queries via an execute wrapper (CaptureQueriesContext keeps only
+    the last 9000 queries, which is too few for the larger runs).
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return self.count
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def timed(fn, items):
+    """Call fn(item) for every item; return (elapsed, per-call latencies, queries)."""
+    latencies = []
+    with count_queries() as ctx:
+        started = time.perf_counter()
+        for item in items:
+            t0 = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, len(ctx)
+
+
+def make_template(key: str = "bench", **overrides) -> NotificationTemplate:
+    fields = {
+        "key": key,
+        "subject": "Reminder for {{ name }}",
+        "body": "Hello {{ name }},\n\nThis is your reminder about {{ topic }}.\n",
+    }
+    fields.update(overrides)
+    return NotificationTemplate.objects.create(**fields)
+
+
+def make_inputs(count: int):
+    """Varied scheduling inputs: every mode, a handful of timezones (one invalid)."""
+    today = date.today()
+    shapes = [
+        (None, None),
+        (today + timedelta(days=3), None),
+        (None, dtime(18, 30)),
+        (today + timedelta(days=1), dtime(7, 45)),
+    ]
+    inputs = []
+    for i in range(count):
+        sd, st = shapes[i % len(shapes)]
+        inputs.append(
+            {
+                "to_email": f"user{i}@example.com",
+                "context": {"name": f"User {i}", "topic": "benchmarks"},
+                "scheduled_date": sd,
+                "scheduled_time": st,
+                "user_timezone": TIMEZONES[i % len(TIMEZONES)],
+            }
+        )
+    return inputs
+
+
+def make_pending_rows(template, count: int, *, attach_ics: bool = False, prefix: str = "bench"):
+    """
+    Insert `count` PENDING rows directly (no signals, nothing enqueued) and return their pks.
+    """
+    now = timezone.now()
+    ScheduledNotification.objects.bulk_create(
+        [
+            ScheduledNotification(
+                template=template,
+                to_email=f"{prefix}{i}@example.com",
+                context={"name": f"User {i}", "topic": "benchmarks"},
+                attach_ics=attach_ics,
+                scheduling_mode="IMMEDIATE",
+                effective_send_at=now,
+                state=ScheduledNotification.Status.PENDING,
+            )
+            for i in range(count)
+        ],
+        batch_size=1000,
+    )
+    return list(
+        ScheduledNotification.objects.filter(to_email__startswith=prefix)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+
+
+async def _smtp_sink(reader, writer, latency: float = 0.0):
+    """
+    Stand-in SMTP server: accepts everything, optionally waiting `latency`
+    seconds before acknowledging each message (a remote server's round-trip).
+    """
+    writer.write(b"220 sink ESMTP\r\n")
+    in_data = False
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        if in_data:
+            if line == b".\r\n":
+                in_data = False
+                if latency:
+                    await asyncio.sleep(latency)
+                writer.write(b"250 OK queued\r\n")
+                await writer.drain()
+            continue
+        verb = line[:4].upper()
+        if verb == b"EHLO":
+            writer.write(b"250-sink\r\n250-PIPELINING\r\n250 8BITMIME\r\n")
+        elif verb == b"DATA":
+            writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+            in_data = True
+        elif verb == b"QUIT":
+            writer.write(b"221 Bye\r\n")
+            await writer.drain()
+            break
+        else:
+            writer.write(b"250 OK\r\n")
+        await writer.drain()
+    writer.close()
+
+
+# ---- scenarios --------------------------------------------------------------
+
+def bench_schedule(count: int = 1000) -> dict:
+    """compute_schedule for every mode across several timezones."""
+    now_utc = timezone.now()
+    elapsed, latencies, queries = timed(
+        lambda row: compute_schedule(
+            scheduled_date=row["scheduled_date"],
+            scheduled_time=row["scheduled_time"],
+            user_timezone=row["user_timezone"],
+            now_utc=now_utc,
+        ),
+        make_inputs(count),
+    )
+    result = summarize("schedule", count, elapsed, latencies, queries)
+    result["per_row_us"] = round(elapsed / count * 1e6, 3) if count else 0.0
+    return result
+
+
+def bench_schedule_many(count: int = 1000) -> dict:
+    """compute_schedule_many over the same inputs as `schedule` (latency is per row, amortized)."""
+    now_utc = timezone.now()
+    rows = make_inputs(count)
+    with count_queries() as ctx:
+        started = time.perf_counter()
+        compute_schedule_many(rows, now_utc=now_utc)
+        elapsed = time.perf_counter() - started
+    result = summarize("schedule_many", count, elapsed, queries=len(ctx))
+    result["per_row_us"] = round(elapsed / count * 1e6, 3) if count else 0.0
+    return result
+
+
+def bench_idempotency(count: int = 1000) -> dict:
+    """compute_idempotency_key per row."""
+    now_utc = timezone.now()
+    elapsed, latencies, queries = timed(
+        lambda row: compute_idempotency_key(
+            template_key="bench",
+            to_email=row["to_email"],
+            effective_send_at=now_utc,
+            context=row["context"],
+        ),
+        make_inputs(count),
+    )
+    result = summarize("idempotency", count, elapsed, latencies, queries)
+    result["per_row_us"] = round(elapsed / count * 1e6, 3) if count else 0.0
+    return result
+
+
+def bench_idempotency_many(count: int = 1000) -> dict:
+    """compute_idempotency_keys over the same rows, one shared campaign context."""
+    now_utc = timezone.now()
+    context = {"name": "Campaign", "topic": "benchmarks"}
+    rows = [
+        {"template_id": 1, "to_email": row["to_email"], "effective_send_at": now_utc, "context": context}
+        for row in make_inputs(count)
+    ]
+    results = {}
+    for algorithm in ("sha256", "blake2b"):
+        started = time.perf_counter()
+        compute_idempotency_keys(rows, template_keys={1: "bench"}, algorithm=algorithm)
+        results[algorithm] = time.perf_counter() - started
+    result = summarize("idempotency_many", count, results["sha256"])
+    result["per_row_us"] = round(results["sha256"] / count * 1e6, 3) if count else 0.0
+    result["blake2b_per_row_us"] = round(results["blake2b"] / count * 1e6, 3) if count else 0.0
+    return result
+
+
+def bench_signals(count: int = 1000) -> dict:
+    """ScheduledNotification.objects.create() through pre/post_save (enqueue stubbed out)."""
+    template = make_template()
+    now_utc = timezone.now()
+    with patch("notifications.signals.enqueue_for_delivery"):
+        elapsed, latencies, queries = timed(
+            lambda row: ScheduledNotification.objects.create(
+                template_id=template.pk,
+                to_email=row["to_email"],
+                context=row["context"],
+                scheduling_mode="IMMEDIATE",
+                effective_send_at=now_utc,
+            ),
+            make_inputs(count),
+        )
+    return summarize("signals", count, elapsed, latencies, queries)
+
+
+def bench_enqueue(count: int = 1000) -> dict:
+    """enqueue_for_delivery publishing to the in-memory broker."""
+    template = make_template()
+    ids = make_pending_rows(template, count)
+    rows = list(ScheduledNotification.objects.filter(pk__in=ids))
+    with publish_only():
+        elapsed, latencies, queries = timed(enqueue_for_delivery, rows)
+    return summarize("enqueue", count, elapsed, latencies, queries)
+
+
+def send_per_row(pk: int):
+    """
+    The attempt lifecycle send_notification used to have, kept as the `send` baseline:
+    load, mark the attempt, create the log, fill in its subject, send, then update the
+    row and the log separately - six queries per successful send.
+    """
+    sn = ScheduledNotification.objects.select_related("template").get(pk=pk)
+    sn.attempts += 1
+    sn.state = ScheduledNotification.Status.QUEUED
+    sn.save(update_fields=["attempts", "state", "updated_at"])
+    log = NotificationLog.objects.create(
+        notification=sn, attempt_no=sn.attempts, status="STARTED", to_email=sn.to_email, subject_snapshot=""
+    )
+    subject, body = _render(sn)
+    log.subject_snapshot = subject
+    log.save(update_fields=["subject_snapshot"])
+    email = _build_email(sn, subject, body)
+    message_id = email.message().get("Message-ID") or ""
+    with get_pool().lease() as lease:
+        email.connection = lease.connection
+        email.send(fail_silently=False)
+        lease.record()
+    sn.state = ScheduledNotification.Status.SENT
+    sn.last_error = ""
+    sn.provider_message_id = message_id
+    sn.save(update_fields=["state", "last_error", "provider_message_id", "updated_at"])
+    log.status = "SENT"
+    log.provider_message_id = message_id
+    log.finished_at = timezone.now()
+    log.save(update_fields=["status", "provider_message_id", "finished_at"])
+
+
+def bench_send(count: int = 1000, attach_ics: bool = False) -> dict:
+    """
+    send_notification one row at a time: latency and DB queries per send, next to the
+    per-row write path it replaced (baseline_* keys).
+    """
+    template = make_template()
+    ids = make_pending_rows(template, count, attach_ics=attach_ics)
+    elapsed, _, queries = timed(send_per_row, ids)
+    baseline = summarize("baseline", count, elapsed, queries=queries)
+    ScheduledNotification.objects.all().delete()
+    ids = make_pending_rows(template, count, attach_ics=attach_ics)
+    elapsed, latencies, queries = timed(lambda pk: send_notification.apply(args=[pk]), ids)
+    result = summarize("send", count, elapsed, latencies, queries)
+    for key in ("seconds", "queries_per_item"):
+        result[f"baseline_{key}"] = baseline[key]
+    return result
+
+
+def bench_send_ics(count: int = 1000) -> dict:
+    """send_notification with attach_ics=True: the same .ics event for every recipient."""
+    template = make_template(subject="Team meeting", body="Agenda: quarterly review.\n")
+    ids = make_pending_rows(template, count, attach_ics=True)
+    elapsed, latencies, queries = timed(lambda pk: send_notification.apply(args=[pk]), ids)
+    result = summarize("send_ics", count, elapsed, latencies, queries)
+    result["ics_cache_hits"] = ics_cache.stats()["hits"]
+    return result
+
+
+def bench_ics(count: int = 1000) -> dict:
+    """
+    Building the .ics attachment: icalendar object model vs the direct serializer
+    vs the cache, for `count` events of which one in ten is distinct.
+    """
+    start = timezone.now().replace(microsecond=0)
+    events = [
+        (f"Reminder #{i % 10}", start + timedelta(hours=i % 10), ICS_DEFAULT_DURATION_MIN,
+         "Hello,\n\nThis is your reminder about benchmarks.\n", "Room 4, Main building")
+        for i in range(count)
+    ]
+    results = {}
+    for name, build in (("icalendar", build_ics_icalendar), ("direct", build_ics), ("cached", ics_cache.get)):
+        ics_cache.clear()
+        started = time.perf_counter()
+        for event in events:
+            build(*event)
+        results[name] = time.perf_counter() - started
+    result = summarize("ics", count, results["cached"])
+    for name, elapsed in results.items():
+        result[f"{name}_us"] = round(elapsed / count * 1e6, 3) if count else 0.0
+    return result
+
+
+def bench_send_large(count: int = 1000) -> dict:
+    """send_notification with a ~20 KB body and an .ics attachment (MIME-heavy path)."""
+    template = make_template(body="Hello {{ name }},\n\n" + "Lorem ipsum dolor sit amet. " * 700)
+    ids = make_pending_rows(template, count, attach_ics=True)
+    elapsed, latencies, queries = timed(lambda pk: send_notification.apply(args=[pk]), ids)
+    return summarize("send_large", count, elapsed, latencies, queries)
+
+
+def bench_batch(count: int = 1000) -> dict:
+    """send_notification_batch in NOTIFY_BATCH_SIZE chunks (latency is per chunk)."""
+    template = make_template()
+    ids = make_pending_rows(template, count)
+    chunks = [ids[i:i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+    elapsed, latencies, queries = timed(lambda chunk: send_notification_batch.apply(args=[chunk]), chunks)
+    return summarize("batch", count, elapsed, latencies, queries)
+
+
+def bench_pipeline(count: int = 1000) -> dict:
+    """End to end: bulk_schedule -> dispatcher -> batch send, for rows due now."""
+    template = make_template()
+    recipients = [{"to_email": row["to_email"], "context": row["context"]} for row in make_inputs(count)]
+    with count_queries() as ctx:
+        started = time.perf_counter()
+        bulk_schedule(template=template, recipients=recipients)
+        while dispatch_due_notifications():
+            pass
+        elapsed = time.perf_counter() - started
+    sent = ScheduledNotification.objects.filter(state=ScheduledNotification.Status.SENT).count()
+    result = summarize("pipeline", count, elapsed, queries=len(ctx))
+    result["sent"] = sent
+    return result
+
+
+def bench_digest(count: int = 1000, per_recipient: int = 5) -> dict:
+    """
+    Dispatcher + send for rows of a digest-compatible template, `per_recipient` rows per
+    recipient: emails / queries with one email per row vs. digest coalescing.
+    """
+    template = make_template(digest_compatible=True)
+    result = {}
+    for label, digest in (("separate", False), ("digest", True)):
+        ScheduledNotification.objects.all().delete()
+        make_pending_rows(template, count)
+        ScheduledNotification.objects.update(to_email=Concat(Value("user"), F("pk") % max(1, count // per_recipient), Value("@example.com")))
+        mail.outbox = []
+        with count_queries() as ctx, propagating(send_digest_batch):
+            started = time.perf_counter()
+            while dispatch_due_notifications(digest=digest):
+                pass
+            elapsed = time.perf_counter() - started
+        sent = ScheduledNotification.objects.filter(state=ScheduledNotification.Status.SENT).count()
+        if sent != count:
+            raise RuntimeError(f"digest={digest}: {sent} of {count} rows sent")
+        result[f"{label}_seconds"] = round(elapsed, 3)
+        result[f"{label}_emails"] = len(mail.outbox)
+        result[f"{label}_queries"] = len(ctx)
+    result.update(summarize("digest", count, elapsed, queries=len(ctx)))
+    result["sent"] = ScheduledNotification.objects.filter(state=ScheduledNotification.Status.SENT).count()
+    return result
+
+
+def bench_async_send(count: int = 1000, latency_ms: float = 20.0, concurrency: int = 200) -> dict:
+    """
+    AsyncSender against a local stand-in SMTP server that takes `latency_ms` per
+    message, i.e. what one prefork worker would spend blocked per send.
+    """
+    template = make_template()
+    make_pending_rows(template, count)
+
+    async def run():
+        server = await asyncio.start_server(
+            lambda r, w: _smtp_sink(r, w, latency_ms / 1000.0), "127.0.0.1", 0
+        )
+        port = server.sockets[0].getsockname()[1]
+        sender = AsyncSender(
+            concurrency=concurrency,
+            smtp_options={"host": "127.0.0.1", "port": port, "username": "", "use_tls": False, "use_ssl": False},
+        )
+        try:
+            await sender.run(until_idle=True)
+        finally:
+            server.close()
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    result = summarize("async_send", count, elapsed)
+    result["sent"] = ScheduledNotification.objects.filter(state=ScheduledNotification.Status.SENT).count()
+    result["concurrency"] = concurrency
+    result["smtp_latency_ms"] = latency_ms
+    # a single blocking worker would need at least count * latency
+    result["serial_floor_seconds"] = round(count * latency_ms / 1000.0, 3)
+    return result
+
+
+def bench_leveling(count: int = 1000, rate: float = None) -> dict:
+    """
+    Date-only campaign across TIMEZONES (one 09:00 spike per zone): simulated peak
+    per minute as scheduled / hash-spread / planned at `rate` sends per second
+    (default: everything within an hour), then bulk_schedule(spread=True,
+    send_rate=rate) for real and the peak of what it stored.
+    """
+    rate = rate or max(count / 3600.0, 0.1)
+    template = make_template()
+    day = date.today() + timedelta(days=2)
+    recipients = [
+        {"to_email": f"user{i}@example.com", "context": {"name": f"User {i}"}, "scheduled_date": day,
+         "user_timezone": TIMEZONES[i % len(TIMEZONES)]}
+        for i in range(count)
+    ]
+    schedules = compute_schedule_many(recipients)
+    keys = compute_idempotency_keys(
+        {"template_key": template.key, "to_email": row["to_email"], "effective_send_at": send_at,
+         "context": row["context"], "attach_ics": False}
+        for row, (_, send_at, _) in zip(recipients, schedules)
+    )
+    result = simulate([send_at for _, send_at, _ in schedules], rate, spread_keys=keys)
+
+    started = time.perf_counter()
+    with patch("notifications.services.enqueue_many_for_delivery"):
+        bulk_schedule(template=template, recipients=recipients, spread=True, send_rate=rate)
+    elapsed = time.perf_counter() - started
+    stored = load_profile(list(ScheduledNotification.objects.values_list("effective_send_at", flat=True)))
+    return {
+        **summarize("leveling", count, elapsed),
+        "rate_per_second": round(rate, 3),
+        **result,
+        "stored_peak_per_minute": max(stored.values(), default=0),
+    }
+
+
+def bench_suppression(count: int = 1000, lookups: int = None) -> dict:
+    """
+    Suppression list with `count` addresses: full load, an incremental refresh after 1%
+    more rows, and `lookups` (default `count`) in-memory membership checks (half hits, no queries).
+    """
+    lookups = lookups or count
+    Suppression.objects.bulk_create(
+        [Suppression(email=f"bounced{i}@example.com", reason="bounce") for i in range(count)], batch_size=5000
+    )
+    started = time.perf_counter()
+    suppression_list.refresh(force=True)
+    load = time.perf_counter() - started
+
+    extra = max(1, count // 100)
+    Suppression.objects.bulk_create(
+        [Suppression(email=f"late{i}@example.com", reason="unsubscribe") for i in range(extra)], batch_size=5000
+    )
+    started = time.perf_counter()
+    suppression_list.refresh(force=True)
+    incremental = time.perf_counter() - started
+
+    emails = [f"{'bounced' if i % 2 else 'fine'}{i % count}@example.com" for i in range(lookups)]
+    with count_queries() as ctx:
+        started = time.perf_counter()
+        hits = sum(1 for email in emails if email in suppression_list)
+        elapsed = time.perf_counter() - started
+    result = summarize("suppression", lookups, elapsed, queries=len(ctx))
+    result.update(
+        suppressed=count + extra,
+        hits=hits,
+        lookup_us=round(elapsed / lookups * 1e6, 3),
+        load_seconds=round(load, 3),
+        incremental_refresh_ms=round(incremental * 1000, 3),
+        **{f"list_{key}": value for key, value in suppression_list.stats().items()},
+    )
+    return result
+
+
+def _lanes_workload(count: int, critical: int, batch_size: int):
+    """
+    Fresh DB with a `count`-row bulk campaign (bulk_schedule + dispatcher, `batch_size`
+    rows per task) and `critical` one-off sends of a critical template, published to
+    the in-memory broker. Returns
+    the published send tasks as (bulk, critical) lists of (task name, args).
+    """
+    reset_database()
+    bulk_template = make_template("bench-bulk", priority=Priority.BULK)
+    critical_template = make_template(
+        "bench-critical", subject="Password reset for {{ name }}", priority=Priority.CRITICAL
+    )
+
+    published = []  # (task name, args, queue)
+
+    def record(sender=None, body=None, routing_key=None, **kwargs):
+        if sender in (send_notification.name, send_notification_batch.name):
+            published.append((sender, body[0], routing_key))
+
+    before_task_publish.connect(record, weak=False)
+    try:
+        with publish_only():
+            bulk_schedule(
+                template=bulk_template,
+                recipients=[{"to_email": f"bulk{i}@example.com", "context": {"name": f"User {i}"}} for i in range(count)],
+            )
+            while dispatch_due_notifications(batch_size=batch_size):
+                pass
+            for i in range(critical):
+                ScheduledNotification.objects.create(
+                    template=critical_template,
+                    to_email=f"reset{i}@example.com",
+                    context={"name": f"User {i}"},
+                    scheduling_mode="IMMEDIATE",
+                    effective_send_at=timezone.now(),
+                )
+    finally:
+        before_task_publish.disconnect(record)
+
+    critical_queue = queue_for(Priority.CRITICAL)
+    return (
+        [(name, args) for name, args, queue in published if queue != critical_queue],
+        [(name, args) for name, args, queue in published if queue == critical_queue],
+    )
+
+
+def _drain(bulk, critical, *, lanes: bool, spread: float, latency: float):
+    """
+    Run published tasks on two real worker threads, either both on one shared FIFO queue
+    or one per lane (critical / everything else). The bulk backlog is queued up front,
+    the critical sends arrive evenly over `spread` seconds, and every message spends
+    `latency` seconds "on the wire".
+
+    The DB is SQLite, so only one thread runs task code at a time; a worker lets go of
+    it while its message is on the wire, like a prefork worker blocked on SMTP.
+    Returns (critical queue-to-sent latencies, seconds until everything was sent).
+    """
+    tasks = send_notification.app.tasks
+    db = threading.Lock()
+    deliver = LocmemBackend.send_messages
+
+    def send_messages(backend, messages):
+        db.release()
+        try:
+            time.sleep(latency * len(messages))
+        finally:
+            db.acquire()
+        return deliver(backend, messages)
+
+    shared = queue.Queue()
+    critical_queue, bulk_queue = (queue.Queue(), queue.Queue()) if lanes else (shared, shared)
+    latencies = []
+
+    def work(lane):
+        try:
+            while (item := lane.get()) is not None:
+                name, args, enqueued = item
+                with db:
+                    tasks[name].apply(args=args)
+                if enqueued is not None:
+                    latencies.append(time.perf_counter() - enqueued)
+        finally:
+            connection.close()
+
+    with patch.object(LocmemBackend, "send_messages", send_messages):
+        started = time.perf_counter()
+        for name, args in bulk:
+            bulk_queue.put((name, args, None))
+        workers = [threading.Thread(target=work, args=(lane,)) for lane in (critical_queue, bulk_queue)]
+        for worker in workers:
+            worker.start()
+        for i, (name, args) in enumerate(critical):
+            time.sleep(max(0.0, started + i * spread / max(1, len(critical)) - time.perf_counter()))
+            critical_queue.put((name, args, time.perf_counter()))
+        for lane in (critical_queue, bulk_queue):
+            lane.put(None)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+def bench_priority_lanes(count: int = 1000, critical: int = 50, latency_ms: float = 5.0) -> dict:
+    """
+    Critical-lane latency while a bulk campaign drains, measured on real queues.
+
+    Publishes a `count`-row bulk campaign (dispatcher batches, at least 10 of them so
+    both workers have a backlog) and up to `critical` one-off sends of a critical template
+    (one per 10 bulk rows), then drains them with two worker threads, each message taking
+    `latency_ms` on a stand-in SMTP server: once with both workers on one shared FIFO
+    queue, once with one worker per lane (critical / everything else). Critical sends
+    arrive evenly over the time the campaign takes to drain; their latency is from
+    entering the queue to being sent.
+    """
+    latency = latency_ms / 1000.0
+    spread = count * latency / 2  # two workers draining the campaign
+    batch_size = min(BATCH_SIZE, max(1, count // 10))
+    critical = max(1, min(critical, count // 10))
+
+    bulk, urgent = _lanes_workload(count, critical, batch_size)
+    shared_latency, shared_seconds = _drain(bulk, urgent, lanes=False, spread=spread, latency=latency)
+    bulk, urgent = _lanes_workload(count, critical, batch_size)
+    lanes_latency, lanes_seconds = _drain(bulk, urgent, lanes=True, spread=spread, latency=latency)
+
+    result = summarize("priority_lanes", count, shared_seconds + lanes_seconds)
+    result["bulk_tasks"] = len(bulk)
+    result["critical_tasks"] = len(urgent)
+    result["critical_queue"] = queue_for(Priority.CRITICAL)
+    result["smtp_latency_ms"] = latency_ms
+    result["shared_critical_p50_ms"] = round(percentile(shared_latency, 50) * 1000, 3)
+    result["shared_critical_p99_ms"] = round(percentile(shared_latency, 99) * 1000, 3)
+    result["lanes_critical_p50_ms"] = round(percentile(lanes_latency, 50) * 1000, 3)
+    result["lanes_critical_p99_ms"] = round(percentile(lanes_latency, 99) * 1000, 3)
+    result["shared_drain_seconds"] = round(shared_seconds, 3)
+    result["lanes_drain_seconds"] = round(lanes_seconds, 3)
+    result["sent"] = ScheduledNotification.objects.filter(state=ScheduledNotification.Status.SENT).count()
+    return result
+
+
+SCENARIOS = {
+    "schedule": bench_schedule,
+    "schedule_many": bench_schedule_many,
+    "idempotency": bench_idempotency,
+    "idempotency_many": bench_idempotency_many,
+    "signals": bench_signals,
+    "enqueue": bench_enqueue,
+    "send": bench_send,
+    "send_ics": bench_send_ics,
+    "ics": bench_ics,
+    "send_large": bench_send_large,
+    "batch": bench_batch,
+    "pipeline": bench_pipeline,
+    "digest": bench_digest,
+    "async_send": bench_async_send,
+    "priority_lanes": bench_priority_lanes,
+    "leveling": bench_leveling,
+    "suppression": bench_suppression,
+}
@@ -0,0 +1,61 @@
+"""
+Campaign progress counters.
+
+Every counter is a plain integer column on Campaign, bumped with
+`UPDATE ... SET x = x + n` so concurrent workers never lose increments.
+"""
+from typing import Dict, Optional, Tuple
+
+from django.db.models import Count, F, Q
+
+from .models import Campaign, ScheduledNotification
+
+# event -> Campaign column
+COUNTER_FIELDS = {
+    "scheduled": "scheduled_count",
+    "sent": "sent_count",
+    "failed": "failed_count",
+    "canceled": "canceled_count",
+}
+
+
+def increment(campaign_id: Optional[int], event: str, by: int = 1) -> None:
+    """Bump one counter of one campaign (no-op for rows without a campaign)."""
+    if campaign_id is None or not by:
+        return
+    field = COUNTER_FIELDS[event]
+    Campaign.objects.filter(pk=campaign_id).update(**{field: F(field) + by})
+
+
+def increment_many(counts: Dict[Tuple[Optional[int], str], int]) -> None:
+    """
+    Apply {(campaign_id, event): n} with one UPDATE per campaign.
+    Used by the batch paths so a 200-row chunk costs one UPDATE, not 200.
+    """
+    per_campaign = {}
+    for (campaign_id, event), by in counts.items():
+        if campaign_id is None or not by:
+            continue
+        per_campaign.setdefault(campaign_id, {})[COUNTER_FIELDS[event]] = by
+    for campaign_id, fields in per_campaign.items():
+        Campaign.objects.filter(pk=campaign_id).update(
+            **{field: F(field) + by for field, by in fields.items()}
+        )
+
+
+def recount(campaign: Campaign) -> Campaign:
+    """
+    Rebuild a campaign's counters from its rows (one aggregate query).
+    The slow path; for repairing drift, e.g. after rows were deleted.
+    """
+    Status = ScheduledNotification.Status
+    totals = ScheduledNotification.objects.filter(campaign=campaign).aggregate(
+        scheduled=Count("pk"),
+        sent=Count("pk", filter=Q(state=Status.SENT)),
+        failed=Count("pk", filter=Q(state=Status.FAILED)),
+        canceled=Count("pk", filter=Q(state=Status.CANCELED)),
+    )
+    for event, field in COUNTER_FIELDS.items():
+        setattr(campaign, field, totals[event])
+    campaign.save(update_fields=[*COUNTER_FIELDS.values(), "updated_at"])
+    return campaign
@@ -0,0 +1,197 @@
+"""
+Circuit breaker around the SMTP server, shared by every worker.
+
+- closed:    sends go through; consecutive connection failures are counted.
+- open:      after NOTIFY_BREAKER_FAILURE_THRESHOLD of them, `allow()` tells callers
+             to defer for the rest of NOTIFY_BREAKER_OPEN_SECONDS (no DB writes, no
+             connection attempts).
+- half_open: once that passes, the next `allow()` gets a single probe; its success
+             closes the breaker, its failure opens it again. If the probe never
+             reports back, another one is handed out after NOTIFY_BREAKER_OPEN_SECONDS.
+
+Only "connection" errors (notifications.retry) count: a refused recipient says
+nothing about the server's health. State lives in Redis (one Lua script call)
+with an in-process fallback, like notifications.rate_limit. Each process reuses
+a closed / open answer from `allow()` for NOTIFY_BREAKER_CACHE_SECONDS, so a send
+costs no Redis round-trip while all is well; another worker opening the breaker is
+noticed within that time.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .conf import BREAKER_CACHE_SECONDS, BREAKER_ENABLED, BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS
+from .metrics import increment, registry
+from .redis_client import REDIS_ERRORS, get_redis, mark_down
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# KEYS[1] = breaker hash; ARGV = op ("allow" / "success" / "failure" / "peek"), threshold, open seconds.
+# Returns {state, failures, wait, remaining} (numbers as strings to keep fractions).
+_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local op = ARGV[1]
+local threshold = tonumber(ARGV[2])
+local open_for = tonumber(ARGV[3])
+local s = redis.call('HMGET', KEYS[1], 'state', 'failures', 'until')
+local state = s[1] or 'closed'
+local failures = tonumber(s[2]) or 0
+local deadline = tonumber(s[3]) or 0
+local changed = false
+local wait = 0
+if op == 'allow' then
+    if state ~= 'closed' then
+        if now >= deadline then
+            state = 'half_open'
+            deadline = now + open_for
+            changed = true
+        else
+            wait = deadline - now
+        end
+    end
+elseif op == 'success' then
+    changed = state ~= 'closed' or failures ~= 0
+    state = 'closed'
+    failures = 0
+    deadline = 0
+elseif op == 'failure' then
+    failures = failures + 1
+    if state == 'half_open' or failures >= threshold then
+        state = 'open'
+        deadline = now + open_for
+    end
+    changed = true
+end
+if changed then
+    redis.call('HSET', KEYS[1], 'state', state, 'failures', failures, 'until', deadline)
+end
+return {state, tostring(failures), tostring(wait), tostring(math.max(0, deadline - now))}
+"""
+
+
+class _LocalState:
+    """In-process breaker state with the same transitions as the Lua script."""
+
+    def __init__(self):
+        self.state, self.failures, self.deadline = CLOSED, 0, 0.0
+        self._lock = threading.Lock()
+
+    def apply(self, op: str, threshold: int, open_for: float):
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            if op == "allow":
+                if self.state != CLOSED:
+                    if now >= self.deadline:
+                        self.state, self.deadline = HALF_OPEN, now + open_for
+                    else:
+                        wait = self.deadline - now
+            elif op == "success":
+                self.state, self.failures, self.deadline = CLOSED, 0, 0.0
+            elif op == "failure":
+                self.failures += 1
+                if self.state == HALF_OPEN or self.failures >= threshold:
+                    self.state, self.deadline = OPEN, now + open_for
+            return self.state, self.failures, wait, max(0.0, self.deadline - now)
+
+
+class CircuitBreaker:
+    """One named breaker (see module docstring); `smtp_breaker` guards EMAIL_HOST:EMAIL_PORT."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        enabled: bool = BREAKER_ENABLED,
+        threshold: int = BREAKER_FAILURE_THRESHOLD,
+        open_seconds: float = BREAKER_OPEN_SECONDS,
+        cache_seconds: float = BREAKER_CACHE_SECONDS,
+    ):
+        self.key = f"notify:breaker:{name}"
+        self.enabled = enabled
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.cache_seconds = cache_seconds
+        self._local = _LocalState()
+        self._script = None
+        # last state this process saw (HALF_OPEN right after `allow()` handed it the probe);
+        # _healthy lets record_success() skip the round-trip when all is well
+        self.state = CLOSED
+        self._healthy = True
+        self._checked_at = None  # monotonic time of the last `allow()` that asked the shared state
+        self._defer_until = 0.0  # monotonic time its answer said to defer until
+
+    def _apply(self, op: str):
+        client = get_redis()
+        if client is not None:
+            try:
+                if self._script is None:
+                    self._script = client.register_script(_SCRIPT)
+                state, failures, wait, remaining = self._script(
+                    keys=[self.key], args=[op, self.threshold, self.open_seconds]
+                )
+                state = state.decode() if isinstance(state, bytes) else state
+                return state, int(failures), float(wait), float(remaining)
+            except REDIS_ERRORS as e:
+                mark_down(e)
+        return self._local.apply(op, self.threshold, self.open_seconds)
+
+    def allow(self) -> float:
+        """0.0 if a send may go ahead (possibly as the half-open probe), else seconds to defer it."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        # 1) recent answer still good: closed, or open for a while yet (half-open always asks)
+        if self._checked_at is not None and now - self._checked_at < self.cache_seconds:
+            if self.state == CLOSED:
+                return 0.0
+            if self.state == OPEN and self._defer_until > now:
+                increment("breaker.deferred")
+                return self._defer_until - now
+
+        # 2) ask the shared state
+        state, failures, wait, _ = self._apply("allow")
+        self._checked_at, self._defer_until = now, now + wait
+        self.state = state
+        self._healthy = state == CLOSED and failures == 0
+        if wait:
+            increment("breaker.deferred")
+        return wait
+
+    def record_success(self):
+        if self.enabled and not self._healthy:
+            self._apply("success")
+            self.state = CLOSED
+            self._healthy = True
+
+    def record_failure(self):
+        """Count one connection failure; returns True if the breaker is (now) open."""
+        if not self.enabled:
+            return False
+        state, _, _, _ = self._apply("failure")
+        if state == OPEN and self.state != OPEN:
+            increment("breaker.opened")
+        self.state = state
+        self._healthy = False
+        return state == OPEN
+
+    def snapshot(self) -> dict:
+        """State for metrics and the admin (gauges: open, half_open, failures, retry_in_seconds)."""
+        if not self.enabled:
+            return {"state": CLOSED, "open": 0, "half_open": 0, "failures": 0, "retry_in_seconds": 0.0}
+        state, failures, _, remaining = self._apply("peek")
+        return {
+            "state": state,
+            "open": int(state == OPEN),
+            "half_open": int(state == HALF_OPEN),
+            "failures": failures,
+            "retry_in_seconds": round(remaining, 3),
+        }
+
+
+smtp_breaker = CircuitBreaker(f"{settings.EMAIL_HOST}:{settings.EMAIL_PORT}")
+registry.register_collector("smtp_breaker", smtp_breaker.snapshot)
@@ -3,3 +3,142 @@ from django.conf import settings
 DEFAULT_SEND_TIME = getattr(settings, "NOTIFY_DEFAULT_SEND_TIME", "09:00")
 ALLOW_DATE_ONLY = getattr(settings, "NOTIFY_ALLOW_DATE_ONLY", True)
 ICS_DEFAULT_DURATION_MIN = int(getattr(settings, "NOTIFY_ICS_DEFAULT_DURATION_MIN", 30))
+
+# Per-worker SMTP connection pool (see notifications/smtp_pool.py)
+SMTP_POOL_ENABLED = getattr(settings, "NOTIFY_SMTP_POOL_ENABLED", True)
+SMTP_POOL_SIZE = int(getattr(settings, "NOTIFY_SMTP_POOL_SIZE", 2))
+SMTP_POOL_MAX_MESSAGES = int(getattr(settings, "NOTIFY_SMTP_POOL_MAX_MESSAGES", 100))
+SMTP_POOL_IDLE_TIMEOUT = float(getattr(settings, "NOTIFY_SMTP_POOL_IDLE_TIMEOUT", 30))
+SMTP_POOL_HEALTHCHECK_INTERVAL = float(getattr(settings, "NOTIFY_SMTP_POOL_HEALTHCHECK_INTERVAL", 5))
+
+# Batch delivery (send_notification_batch / dispatch_due_notifications)
+BATCH_SIZE = int(getattr(settings, "NOTIFY_BATCH_SIZE", 200))
+DISPATCH_LIMIT = int(getattr(settings, "NOTIFY_DISPATCH_LIMIT", 5000))
+
+# In-process LRU of compiled subject/body templates (see notifications/template_cache.py)
+TEMPLATE_CACHE_SIZE = int(getattr(settings, "NOTIFY_TEMPLATE_CACHE_SIZE", 256))
+# how long a process trusts its cached template key / priority (edits elsewhere show up after this)
+TEMPLATE_FIELDS_TTL_SECONDS = float(getattr(settings, "NOTIFY_TEMPLATE_FIELDS_TTL_SECONDS", 30))
+
+# In-process LRU of built .ics attachments (see notifications/ics.py); 0 disables it
+ICS_CACHE_SIZE = int(getattr(settings, "NOTIFY_ICS_CACHE_SIZE", 256))
+
+# Send-time leveling (see notifications/leveling.py), both opt-in:
+# - spread ALL_DAY_DATE rows over NOTIFY_SPREAD_WINDOW_SECONDS after the all-day time
+# - NOTIFY_SEND_RATE_TARGET (sends/second): bulk_schedule pushes IMMEDIATE / ALL_DAY_DATE
+#   rows later so no minute exceeds it, by at most NOTIFY_LEVEL_MAX_DELAY_SECONDS
+SPREAD_ALL_DAY = getattr(settings, "NOTIFY_SPREAD_ALL_DAY", False)
+SPREAD_WINDOW_SECONDS = int(getattr(settings, "NOTIFY_SPREAD_WINDOW_SECONDS", 30 * 60))
+SEND_RATE_TARGET = getattr(settings, "NOTIFY_SEND_RATE_TARGET", None)
+LEVEL_MAX_DELAY_SECONDS = getattr(settings, "NOTIFY_LEVEL_MAX_DELAY_SECONDS", 60 * 60)
+
+# Priority lanes: Celery queue per Priority (critical / default / bulk); core/celery.py
+# declares them, run separate workers per lane so campaigns never delay critical mail
+PRIORITY_QUEUES = getattr(
+    settings,
+    "NOTIFY_PRIORITY_QUEUES",
+    {"critical": "notify.critical", "default": "notify.default", "bulk": "notify.bulk"},
+)
+
+# Database-driven dispatch: future rows wait in the DB (not as Celery ETA tasks)
+# until they are due within DISPATCH_WINDOW_SECONDS (see notifications/dispatch.py)
+DB_DISPATCHER = getattr(settings, "NOTIFY_DB_DISPATCHER", False)
+DISPATCH_WINDOW_SECONDS = int(getattr(settings, "NOTIFY_DISPATCH_WINDOW_SECONDS", 60))
+DISPATCH_INTERVAL_SECONDS = float(getattr(settings, "NOTIFY_DISPATCH_INTERVAL_SECONDS", 15))
+
+# Digests (see dispatch.coalesce_digests / tasks.send_digest_batch): the dispatcher sends
+# several due rows for one recipient whose templates are digest_compatible as one
+# email. Rows due up to DIGEST_WINDOW_SECONDS after dispatch join it (they go out
+# that much early); at most DIGEST_MAX_ITEMS per email.
+DIGEST_ENABLED = getattr(settings, "NOTIFY_DIGEST_ENABLED", False)
+DIGEST_WINDOW_SECONDS = int(getattr(settings, "NOTIFY_DIGEST_WINDOW_SECONDS", 15 * 60))
+DIGEST_MAX_ITEMS = int(getattr(settings, "NOTIFY_DIGEST_MAX_ITEMS", 20))
+DIGEST_SUBJECT = getattr(settings, "NOTIFY_DIGEST_SUBJECT", "You have {count} new notifications")
+
+# Suppression list (see notifications/suppression.py): bounced / unsubscribed addresses
+# are skipped when scheduling and canceled at send time. Each process keeps them in
+# memory and picks up changes at most every SUPPRESSION_REFRESH_SECONDS (one query).
+SUPPRESSION_ENABLED = getattr(settings, "NOTIFY_SUPPRESSION_ENABLED", True)
+SUPPRESSION_REFRESH_SECONDS = float(getattr(settings, "NOTIFY_SUPPRESSION_REFRESH_SECONDS", 30))
+
+# Fair share: the dispatcher splits each claim across tenants (rows grouped by
+# NOTIFY_TENANT_FIELD) by weighted round-robin instead of strict send-time order,
+# so one tenant's blast can't hold back everyone else's mail. Weights are keyed by
+# the tenant value as a string (e.g. {"42": 3}); unlisted tenants weigh 1.
+# NOTIFY_TENANT_MAX_IN_FLIGHT caps a tenant's QUEUED rows (None = no cap).
+FAIR_SHARE = getattr(settings, "NOTIFY_FAIR_SHARE", True)
+TENANT_FIELD = getattr(settings, "NOTIFY_TENANT_FIELD", "created_by")
+TENANT_WEIGHTS = getattr(settings, "NOTIFY_TENANT_WEIGHTS", {})
+TENANT_MAX_IN_FLIGHT = getattr(settings, "NOTIFY_TENANT_MAX_IN_FLIGHT", None)
+
+# Optional buffered NotificationLog writes (see notifications/log_buffer.py)
+LOG_BUFFER_ENABLED = getattr(settings, "NOTIFY_LOG_BUFFER_ENABLED", False)
+LOG_BUFFER_SIZE = int(getattr(settings, "NOTIFY_LOG_BUFFER_SIZE", 100))
+LOG_BUFFER_FLUSH_MS = int(getattr(settings, "NOTIFY_LOG_BUFFER_FLUSH_MS", 500))
+
+# Worker leases: an attempt is owned for LEASE_SECONDS; QUEUED rows nobody
+# picked up for STALE_QUEUED_SECONDS are treated as lost and re-enqueued
+LEASE_SECONDS = int(getattr(settings, "NOTIFY_LEASE_SECONDS", 300))
+STALE_QUEUED_SECONDS = int(getattr(settings, "NOTIFY_STALE_QUEUED_SECONDS", 3600))
+
+# Metrics (see notifications/metrics.py). Histograms are aggregated per process:
+# the /notifications/metrics/ endpoint shows the web process, so Celery workers
+# should also list the statsd sink.
+METRICS_SINKS = getattr(settings, "NOTIFY_METRICS_SINKS", ["notifications.metrics.InProcessSink"])
+STATSD_HOST = getattr(settings, "NOTIFY_STATSD_HOST", "127.0.0.1")
+STATSD_PORT = int(getattr(settings, "NOTIFY_STATSD_PORT", 8125))
+STATSD_PREFIX = getattr(settings, "NOTIFY_STATSD_PREFIX", "notifications")
+# the endpoint (tenant ids among its labels) answers staff users, and scrapers sending
+# "Authorization: Bearer <NOTIFY_METRICS_TOKEN>" when one is set; everyone else gets 403
+METRICS_TOKEN = getattr(settings, "NOTIFY_METRICS_TOKEN", None)
+# attempts slower than this keep their per-stage breakdown on NotificationLog.timings
+SLOW_ATTEMPT_MS = float(getattr(settings, "NOTIFY_SLOW_ATTEMPT_MS", 1000))
+
+# Hash for new idempotency keys: "sha256" (historic format) or "blake2b" (faster).
+# Switching only affects rows created afterwards; existing keys stay as they are.
+IDEMPOTENCY_HASH = getattr(settings, "NOTIFY_IDEMPOTENCY_HASH", "sha256")
+
+# Retention (see notifications/retention.py). Days are ages measured from
+# NotificationLog.started_at / ScheduledNotification.updated_at; None (the default for
+# both) keeps forever, so the hourly beat purge deletes nothing until you opt in.
+# Keep NOTIFICATION_RETENTION_DAYS >= LOG_RETENTION_DAYS: compacting a
+# notification also deletes whatever logs it still has (archived with it).
+LOG_RETENTION_DAYS = getattr(settings, "NOTIFY_LOG_RETENTION_DAYS", None)
+NOTIFICATION_RETENTION_DAYS = getattr(settings, "NOTIFY_NOTIFICATION_RETENTION_DAYS", None)
+RETENTION_BATCH_SIZE = int(getattr(settings, "NOTIFY_RETENTION_BATCH_SIZE", 1000))
+# directory for gzipped JSONL exports written before deleting; None = delete without archiving
+RETENTION_ARCHIVE_DIR = getattr(settings, "NOTIFY_RETENTION_ARCHIVE_DIR", None)
+
+# Asyncio sender (`manage.py run_async_sender`, see notifications/async_sender.py):
+# concurrent SMTP sessions per process, and rows claimed per round
+ASYNC_CONCURRENCY = int(getattr(settings, "NOTIFY_ASYNC_CONCURRENCY", 100))
+ASYNC_BATCH_SIZE = int(getattr(settings, "NOTIFY_ASYNC_BATCH_SIZE", 1000))
+
+# Shared state (rate limits, ...) lives in Redis when available; defaults to
+# the Celery broker if that is Redis. None = per-process state only.
+_broker_url = getattr(settings, "CELERY_BROKER_URL", "") or ""
+REDIS_URL = getattr(settings, "NOTIFY_REDIS_URL", _broker_url if _broker_url.startswith(("redis://", "rediss://")) else None)
+
+# Outbound rate limits (see notifications/rate_limit.py), as "N/s", "N/m" or "N/h".
+# RATE_LIMIT_ACCOUNT caps the sending account overall; RATE_LIMIT_DOMAINS caps
+# per recipient domain, e.g. {"gmail.com": "20/s", "outlook.com": "600/m"};
+# RATE_LIMIT_DEFAULT_DOMAIN applies to domains not listed. None = unlimited.
+RATE_LIMIT_ACCOUNT = getattr(settings, "NOTIFY_RATE_LIMIT_ACCOUNT", None)
+RATE_LIMIT_DOMAINS = getattr(settings, "NOTIFY_RATE_LIMIT_DOMAINS", {})
+RATE_LIMIT_DEFAULT_DOMAIN = getattr(settings, "NOTIFY_RATE_LIMIT_DEFAULT_DOMAIN", None)
+
+# Retries (see notifications/retry.py): exponential backoff with full jitter,
+# delay = random(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))).
+# A notification is attempted at most MAX_RETRIES + 1 times; permanent errors fail at once.
+MAX_RETRIES = int(getattr(settings, "NOTIFY_MAX_RETRIES", 3))
+RETRY_BASE_SECONDS = float(getattr(settings, "NOTIFY_RETRY_BASE_SECONDS", 30))
+RETRY_MAX_SECONDS = float(getattr(settings, "NOTIFY_RETRY_MAX_SECONDS", 3600))
+
+# SMTP circuit breaker (see notifications/circuit_breaker.py): after
+# BREAKER_FAILURE_THRESHOLD consecutive connection failures sends are deferred
+# for BREAKER_OPEN_SECONDS, then a single probe send decides whether to close it.
+BREAKER_ENABLED = getattr(settings, "NOTIFY_BREAKER_ENABLED", True)
+BREAKER_FAILURE_THRESHOLD = int(getattr(settings, "NOTIFY_BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_OPEN_SECONDS = float(getattr(settings, "NOTIFY_BREAKER_OPEN_SECONDS", 30))
+# a process re-reads a closed (or open) breaker from Redis at most this often; 0 = every send
+BREAKER_CACHE_SECONDS = float(getattr(settings, "NOTIFY_BREAKER_CACHE_SECONDS", 1.0))
@@ -0,0 +1,277 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .conf import (
+    DIGEST_MAX_ITEMS,
+    DIGEST_WINDOW_SECONDS,
+    DISPATCH_LIMIT,
+    DISPATCH_WINDOW_SECONDS,
+    FAIR_SHARE,
+    TENANT_FIELD,
+    TENANT_MAX_IN_FLIGHT,
+    TENANT_WEIGHTS,
+)
+from .metrics import increment, registry
+from .models import ScheduledNotification
+
+# rows the dispatcher may pick up; QUEUED/RETRYING already have a Celery task
+DISPATCHABLE_STATES = [
+    ScheduledNotification.Status.PENDING,
+    ScheduledNotification.Status.SCHEDULED,
+]
+
+
+def _claim(due, limit: int, now) -> List[Tuple[int, Optional[datetime], Optional[int]]]:
+    """Move up to `limit` rows of the `due` values_list (pk first) to QUEUED; returns the ones this caller won."""
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed = list(due.select_for_update(skip_locked=True)[:limit])
+            ScheduledNotification.objects.filter(pk__in=[row[0] for row in claimed]).update(
+                state=ScheduledNotification.Status.QUEUED, updated_at=now
+            )
+        return claimed
+
+    # Fallback (SQLite): no row locks, so claim the candidates with ONE conditional UPDATE
+    # that stamps a fresh token, then read back which of them carry it (like tasks._claim).
+    # lease_owner is the worker lease, so the token is cleared again before the hand-off:
+    # dispatched rows look exactly like the ones claimed with SKIP LOCKED.
+    candidates = list(due[:limit])
+    if not candidates:
+        return []
+    token = f"dispatch-{uuid.uuid4().hex}"
+    pks = [row[0] for row in candidates]
+    ScheduledNotification.objects.filter(pk__in=pks, canceled=False, state__in=DISPATCHABLE_STATES).update(
+        state=ScheduledNotification.Status.QUEUED, lease_owner=token, updated_at=now
+    )
+    won = set(ScheduledNotification.objects.filter(pk__in=pks, lease_owner=token).values_list("pk", flat=True))
+    ScheduledNotification.objects.filter(pk__in=won, lease_owner=token).update(lease_owner=None)
+    return [row for row in candidates if row[0] in won]
+
+
+def claim_due_notifications(
+    *,
+    window_seconds: int = DISPATCH_WINDOW_SECONDS,
+    limit: int = DISPATCH_LIMIT,
+    now: Optional[datetime] = None,
+    fair: bool = FAIR_SHARE,
+) -> List[Tuple[int, Optional[datetime], Optional[int]]]:
+    """
+    Claim notifications due within the next `window_seconds` by moving them to QUEUED,
+    critical lane first (so a bulk backlog bigger than `limit` can't hold it back).
+    With `fair`, `limit` is first shared out across tenants (see fair_share_quotas).
+
+    Uses the (state, priority, effective_send_at) index. On databases with
+    SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, MySQL 8) concurrent
+    dispatchers skip each other's rows; on SQLite one conditional UPDATE stamps
+    a token on the rows still claimable, so a row is only ever claimed once
+    (the token is cleared before returning).
+
+    Returns [(pk, effective_send_at, priority), ...] for the rows this caller now owns.
+    """
+    now = now or timezone.now()
+    due = (
+        ScheduledNotification.objects.filter(
+            canceled=False,
+            state__in=DISPATCHABLE_STATES,
+            effective_send_at__lte=now + timedelta(seconds=window_seconds),
+        )
+        .order_by("priority", "effective_send_at")
+        .values_list("pk", "effective_send_at", "priority")
+    )
+    if fair:
+        return _claim_fair(due, limit, now)
+    return _claim(due, limit, now)
+
+
+# ---- fair share ----------------------------------------------------------------
+
+# backlog seen by this process's last fair-share pass (for the "fair_share" gauges)
+_last_pass = {"tenants": 0, "backlog": 0, "backlog_max": 0, "capped": 0}
+_last_pass_lock = threading.Lock()
+
+
+def tenant_weight(tenant) -> float:
+    return float(TENANT_WEIGHTS.get(str(tenant), 1))
+
+
+def fair_share_quotas(demand: Dict, limit: int, weights: Dict = None) -> Dict:
+    """
+    Split `limit` claims across tenants by weighted round-robin.
+    `demand` is {tenant: rows it could use}; each round every tenant still short gets
+    its weight's share of what is left (at least one), and what a tenant can't use
+    goes to the others. Smaller backlogs are served first within a round.
+    """
+    weights = weights or {}
+    quotas = {tenant: 0 for tenant in demand}
+    active = sorted((t for t, n in demand.items() if n > 0), key=lambda t: demand[t])
+    remaining = limit
+    while remaining > 0 and active:
+        total = sum(weights.get(t, 1.0) for t in active)
+        handed = 0
+        for tenant in active:
+            share = max(1, int((remaining * weights.get(tenant, 1.0)) // total))
+            share = min(share, demand[tenant] - quotas[tenant], remaining - handed)
+            quotas[tenant] += share
+            handed += share
+            if handed >= remaining:
+                break
+        remaining -= handed
+        active = [t for t in active if quotas[t] < demand[t]]
+    return quotas
+
+
+def _interleave(claims: Dict, weights: Dict) -> list:
+    """Merge per-tenant claim lists round-robin (`weight` rows per turn), so every batch is mixed."""
+    queues = {tenant: list(rows) for tenant, rows in claims.items() if rows}
+    merged = []
+    while queues:
+        for tenant in list(queues):
+            take = max(1, int(weights.get(tenant, 1.0)))
+            rows = queues[tenant]
+            merged.extend(rows[:take])
+            del rows[:take]
+            if not rows:
+                del queues[tenant]
+    return merged
+
+
+def _claim_fair(due, limit: int, now):
+    # 1) backlog per tenant (one GROUP BY over the due rows)
+    backlog = dict(due.order_by().values_list(TENANT_FIELD).annotate(n=Count("pk")).values_list(TENANT_FIELD, "n"))
+    demand = dict(backlog)
+
+    # 2) per-tenant concurrency cap: what is already QUEUED counts against it
+    capped = 0
+    if TENANT_MAX_IN_FLIGHT is not None and backlog:
+        in_flight = dict(
+            ScheduledNotification.objects.filter(state=ScheduledNotification.Status.QUEUED)
+            .order_by()
+            .values_list(TENANT_FIELD)
+            .annotate(n=Count("pk"))
+            .values_list(TENANT_FIELD, "n")
+        )
+        for tenant in demand:
+            room = max(0, TENANT_MAX_IN_FLIGHT - in_flight.get(tenant, 0))
+            if room < demand[tenant]:
+                demand[tenant] = room
+                capped += 1
+
+    with _last_pass_lock:
+        _last_pass.update(
+            tenants=len(backlog),
+            backlog=sum(backlog.values()),
+            backlog_max=max(backlog.values(), default=0),
+            capped=capped,
+        )
+    if not backlog:
+        return []
+    if len(backlog) == 1 and not capped:
+        return _claim(due, limit, now)  # no contention: plain claim
+
+    # 3) weighted round-robin quotas, then one claim per tenant with a share
+    weights = {tenant: tenant_weight(tenant) for tenant in demand}
+    quotas = fair_share_quotas(demand, limit, weights)
+    claims = {}
+    for tenant, quota in quotas.items():
+        if not quota:
+            continue
+        lookup = {f"{TENANT_FIELD}__isnull": True} if tenant is None else {TENANT_FIELD: tenant}
+        claims[tenant] = _claim(due.filter(**lookup), quota, now)
+        increment("dispatch.claimed", len(claims[tenant]), {"tenant": str(tenant)})
+    for tenant in backlog:
+        if quotas.get(tenant, 0) < backlog[tenant]:
+            increment("dispatch.held_back", backlog[tenant] - quotas.get(tenant, 0), {"tenant": str(tenant)})
+    return _interleave(claims, weights)
+
+
+def fair_share_stats() -> dict:
+    with _last_pass_lock:
+        return dict(_last_pass)
+
+
+registry.register_collector("fair_share", fair_share_stats)
+
+
+# ---- digests -------------------------------------------------------------------
+
+
+def coalesce_digests(
+    claimed,
+    now: datetime,
+    *,
+    window_seconds: int = DIGEST_WINDOW_SECONDS,
+    max_items: int = DIGEST_MAX_ITEMS,
+):
+    """
+    Pull the rows of digest-compatible templates out of a dispatcher claim and group
+    them per recipient. For every such recipient, their other digest-compatible rows
+    due within `window_seconds` are claimed too, so they join the digest instead of
+    arriving as separate emails a few minutes later.
+
+    Returns (digests, singles):
+    - digests: [(pks, send_at, priority), ...] with 2..`max_items` rows each; send_at is
+      the earliest constituent's, priority the most urgent one
+    - singles: the claimed (pk, send_at, priority) rows that still go out on their own
+    """
+    if not claimed:
+        return [], list(claimed)
+    rows = {row[0]: row for row in claimed}
+    recipients = dict(
+        ScheduledNotification.objects.filter(pk__in=list(rows), template__digest_compatible=True).values_list(
+            "pk", "to_email"
+        )
+    )
+    if not recipients:
+        return [], list(claimed)
+
+    # 1) same recipients' digest-compatible rows coming up within the window (one claim)
+    upcoming = (
+        ScheduledNotification.objects.filter(
+            canceled=False,
+            state__in=DISPATCHABLE_STATES,
+            template__digest_compatible=True,
+            to_email__in=set(recipients.values()),
+            effective_send_at__lte=now + timedelta(seconds=window_seconds),
+        )
+        .order_by("effective_send_at")
+        .values_list("pk", "effective_send_at", "priority", "to_email")
+    )
+    groups = {}
+    for pk, email in recipients.items():
+        groups.setdefault(email, []).append(rows[pk])
+    for pk, send_at, priority, email in _claim(upcoming, DISPATCH_LIMIT, now):
+        rows[pk] = (pk, send_at, priority)
+        groups.setdefault(email, []).append(rows[pk])
+
+    # 2) one digest per recipient (split at max_items); lone rows stay singles
+    digests, coalesced = [], set()
+    for group in groups.values():
+        group.sort(key=lambda row: (row[1] or now, row[0]))
+        for start in range(0, len(group), max(2, max_items)):
+            chunk = group[start:start + max(2, max_items)]
+            if len(chunk) < 2:
+                continue
+            priorities = [priority for _, _, priority in chunk if priority is not None]
+            digests.append(([pk for pk, _, _ in chunk], chunk[0][1], min(priorities, default=None)))
+            coalesced.update(pk for pk, _, _ in chunk)
+    if coalesced:
+        increment("digest.coalesced", len(coalesced))
+    return digests, [row for pk, row in rows.items() if pk not in coalesced]
+
+
+def claim_for_direct_enqueue(notification) -> bool:
+    """
+    Claim one freshly created row for immediate enqueueing, so the
+    dispatcher doesn't enqueue it a second time.
+    """
+    return bool(
+        ScheduledNotification.objects.filter(
+            pk=notification.pk, canceled=False, state__in=DISPATCHABLE_STATES
+        ).update(state=ScheduledNotification.Status.QUEUED, updated_at=timezone.now())
+    )
@@ -0,0 +1,152 @@
+"""
+.ics attachments for notifications.
+
+- `build_ics()` writes the single-VEVENT calendar this app attaches as plain
+  strings, byte-for-byte what the icalendar object model produces for it
+  (`build_ics_icalendar()`), which it still falls back to for datetimes in a
+  named timezone (those need a TZID parameter).
+- `ics_cache` remembers the bytes per (summary, start, duration, description,
+  location), so retries and recipients that get the identical event reuse them.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from icalendar import Calendar, Event
+
+from .conf import ICS_CACHE_SIZE
+from .metrics import registry
+
+PRODID = "-//Notifications App//"
+_FOLD_AT = 75  # octets per content line (RFC 5545 3.1)
+
+
+def build_ics_icalendar(summary: str, starts_at, duration_min: int, description: str = "", location: str = "") -> bytes:
+    """Create a very small .ics file (bytes) with the icalendar object model."""
+    cal = Calendar()
+    cal.add("prodid", PRODID)
+    cal.add("version", "2.0")
+
+    event = Event()
+    event.add("summary", summary)
+    event.add("dtstart", starts_at)  # aware datetime (UTC is fine)
+    event.add("dtend", starts_at + timedelta(minutes=duration_min))
+    if description:
+        event.add("description", description)
+    if location:
+        event.add("location", location)
+
+    cal.add_component(event)
+    return cal.to_ical()
+
+
+def _escape(text: str) -> str:
+    # TEXT escaping exactly as icalendar.parser.escape_char does it (order matters)
+    return (
+        text.replace(r"\N", "\n")
+        .replace("\\", "\\\\")
+        .replace(";", r"\;")
+        .replace(",", r"\,")
+        .replace("\r\n", r"\n")
+        .replace("\n", r"\n")
+    )
+
+
+def _fold(line: str) -> str:
+    """Split a content line into <75-octet pieces joined by CRLF + space (as icalendar.parser.foldline)."""
+    if line.isascii():
+        if len(line) < _FOLD_AT:
+            return line
+        return "\r\n ".join(line[i:i + _FOLD_AT - 1] for i in range(0, len(line), _FOLD_AT - 1))
+    chars, size = [], 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        size += width
+        if size >= _FOLD_AT:
+            chars.append("\r\n ")
+            size = width
+        chars.append(char)
+    return "".join(chars)
+
+
+def _is_utc(value: datetime) -> bool:
+    return value.tzinfo is dt_timezone.utc or (value.tzinfo is not None and value.tzname() == "UTC")
+
+
+def build_ics(summary: str, starts_at, duration_min: int, description: str = "", location: str = "") -> bytes:
+    """
+    Same output as build_ics_icalendar(), without building Calendar/Event objects.
+    Naive and UTC datetimes are written directly; anything else goes through icalendar.
+    """
+    if not isinstance(starts_at, datetime) or (starts_at.tzinfo is not None and not _is_utc(starts_at)):
+        return build_ics_icalendar(summary, starts_at, duration_min, description, location)
+
+    suffix = "Z" if starts_at.tzinfo is not None else ""
+    ends_at = starts_at + timedelta(minutes=duration_min)
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "BEGIN:VEVENT",
+        _fold(f"SUMMARY:{_escape(summary)}"),
+        f"DTSTART:{starts_at:%Y%m%dT%H%M%S}{suffix}",
+        f"DTEND:{ends_at:%Y%m%dT%H%M%S}{suffix}",
+    ]
+    if description:
+        lines.append(_fold(f"DESCRIPTION:{_escape(description)}"))
+    if location:
+        lines.append(_fold(f"LOCATION:{_escape(location)}"))
+    lines += ["END:VEVENT", "END:VCALENDAR", ""]
+    return "\r\n".join(lines).encode("utf-8")
+
+
+class IcsCache:
+    """
+    Bounded LRU of built .ics payloads keyed by every input of build_ics(),
+    so a hit is always the exact bytes a fresh build would give.
+    """
+
+    def __init__(self, maxsize: int = ICS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, summary: str, starts_at, duration_min: int, description: str = "", location: str = "") -> bytes:
+        """Return the .ics bytes for an event, building and caching them on a miss."""
+        # tzinfo too: equal instants in different zones serialize differently
+        key = (summary, starts_at, getattr(starts_at, "tzinfo", None), duration_min, description, location)
+        with self._lock:
+            payload = self._data.get(key)
+            if payload is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+
+        # build outside the lock; a concurrent miss just builds twice
+        payload = build_ics(summary, starts_at, duration_min, description, location)
+        if self.maxsize <= 0:
+            return payload
+
+        with self._lock:
+            self._data[key] = payload
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+ics_cache = IcsCache()
+registry.register_collector("ics_cache", ics_cache.stats)
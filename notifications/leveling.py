@@ -0,0 +1,150 @@
+"""
+Send-time load leveling.
+
+Date-only (ALL_DAY_DATE) rows all resolve to the same local instant (09:00),
+so every timezone produces one synchronized spike. Two opt-in tools flatten it:
+
+- spreading: `spread_send_at()` moves a row to a deterministic offset inside
+  NOTIFY_SPREAD_WINDOW_SECONDS after that instant, from a hash of its
+  idempotency key (same row -> same offset, so re-runs still de-duplicate).
+- planning: `plan_send_times()` takes a target send rate and pushes instants
+  later (never earlier) until no minute holds more than rate * 60 sends,
+  counting what is already scheduled in the DB (`existing_load()`).
+
+Only instants the user didn't pick (IMMEDIATE and ALL_DAY_DATE) are moved.
+`simulate()` reports peak vs. leveled load for a set of instants.
+"""
+import hashlib
+import statistics
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional
+
+from django.db.models import Count
+from django.db.models.functions import TruncMinute
+
+from .conf import LEVEL_MAX_DELAY_SECONDS, SPREAD_ALL_DAY, SPREAD_WINDOW_SECONDS
+from .models import ScheduledNotification
+
+BUCKET_SECONDS = 60  # the planner's capacity unit
+# scheduling modes whose instant was not chosen by the user, so they may move
+MOVABLE_MODES = (
+    ScheduledNotification.SchedulingMode.IMMEDIATE,
+    ScheduledNotification.SchedulingMode.ALL_DAY_DATE,
+)
+
+
+def spread_offset(key: str, window_seconds: int = SPREAD_WINDOW_SECONDS) -> int:
+    """Deterministic offset in [0, window_seconds) for a key."""
+    if window_seconds <= 0 or not key:
+        return 0
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % window_seconds
+
+
+def spread_send_at(
+    mode: str,
+    send_at: Optional[datetime],
+    key: Optional[str],
+    *,
+    enabled: bool = SPREAD_ALL_DAY,
+    window_seconds: int = SPREAD_WINDOW_SECONDS,
+) -> Optional[datetime]:
+    """`send_at` plus the key's offset for ALL_DAY_DATE rows (when enabled); otherwise unchanged."""
+    if not enabled or mode != ScheduledNotification.SchedulingMode.ALL_DAY_DATE or send_at is None:
+        return send_at
+    return send_at + timedelta(seconds=spread_offset(key, window_seconds))
+
+
+def _bucket(ts: float) -> int:
+    return int(ts // BUCKET_SECONDS) * BUCKET_SECONDS
+
+
+def existing_load(start: datetime, end: datetime) -> Dict[datetime, int]:
+    """Rows already waiting to go out per minute in [start, end] (one GROUP BY query)."""
+    rows = (
+        ScheduledNotification.objects.filter(
+            canceled=False,
+            state__in=[ScheduledNotification.Status.PENDING, ScheduledNotification.Status.SCHEDULED],
+            effective_send_at__gte=start,
+            effective_send_at__lte=end,
+        )
+        .annotate(minute=TruncMinute("effective_send_at"))
+        .order_by()
+        .values_list("minute")
+        .annotate(n=Count("pk"))
+    )
+    return dict(rows)
+
+
+def plan_send_times(
+    instants: List[datetime],
+    rate: float,
+    *,
+    existing: Optional[Dict[datetime, int]] = None,
+    max_delay_seconds: Optional[float] = LEVEL_MAX_DELAY_SECONDS,
+) -> List[datetime]:
+    """
+    Level `instants` (aware datetimes) to at most `rate` sends per second per minute
+    bucket, on top of `existing` load ({minute start: count}).
+
+    Earliest instants are placed first; a row goes to the first minute at or after its
+    own instant with room, paced evenly inside it. Rows that would move more than
+    `max_delay_seconds` stay in the last minute they may use, even if it is full.
+    Returns the new instants in input order.
+    """
+    capacity = max(1, int(rate * BUCKET_SECONDS))
+    used = Counter({_bucket(minute.timestamp()): n for minute, n in (existing or {}).items()})
+    planned: List[Optional[datetime]] = [None] * len(instants)
+    cursor = None  # buckets from the current row's own one up to here are all full
+    for index in sorted(range(len(instants)), key=lambda i: instants[i]):
+        ts = instants[index].timestamp()
+        own = _bucket(ts)
+        bucket = own if cursor is None else max(own, cursor)
+        last = None if max_delay_seconds is None else _bucket(ts + max_delay_seconds)
+        if last is not None:
+            bucket = min(bucket, last)
+        while used[bucket] >= capacity and (last is None or bucket < last):
+            bucket += BUCKET_SECONDS
+        cursor = bucket
+        at = max(ts, bucket + min(used[bucket], capacity - 1) / rate)
+        used[bucket] += 1
+        planned[index] = datetime.fromtimestamp(at, tz=dt_timezone.utc)
+    return planned
+
+
+def load_profile(instants: List[datetime]) -> Counter:
+    """Sends per minute bucket."""
+    return Counter(_bucket(instant.timestamp()) for instant in instants)
+
+
+def simulate(
+    instants: List[datetime],
+    rate: float,
+    *,
+    spread_keys: Optional[List[str]] = None,
+    window_seconds: int = SPREAD_WINDOW_SECONDS,
+    max_delay_seconds: Optional[float] = LEVEL_MAX_DELAY_SECONDS,
+) -> dict:
+    """
+    Peak vs. leveled load for `instants` at a target `rate` (sends per second):
+    as scheduled, with hash spreading (if `spread_keys` are given), and planned.
+    Peaks are sends per minute; delays are how far rows ended up from their scheduled
+    instant, in seconds.
+    """
+    capacity = int(rate * BUCKET_SECONDS)
+    spread = (
+        [instant + timedelta(seconds=spread_offset(key, window_seconds)) for instant, key in zip(instants, spread_keys)]
+        if spread_keys is not None
+        else list(instants)
+    )
+    planned = plan_send_times(spread, rate, max_delay_seconds=max_delay_seconds)
+    delays = [(after - before).total_seconds() for before, after in zip(instants, planned)]
+    report = {"capacity_per_minute": capacity}
+    for name, series in (("scheduled", instants), ("spread", spread), ("planned", planned)):
+        profile = load_profile(series)
+        report[f"{name}_peak_per_minute"] = max(profile.values(), default=0)
+        report[f"{name}_minutes_over_capacity"] = sum(1 for n in profile.values() if n > capacity)
+    report["delay_p50_seconds"] = round(statistics.median(delays), 3) if delays else 0.0
+    report["delay_max_seconds"] = round(max(delays, default=0.0), 3)
+    return report
@@ -0,0 +1,86 @@
+import atexit
+import os
+import threading
+
+from celery.signals import worker_process_shutdown
+from django.db import connection
+
+from .conf import LOG_BUFFER_ENABLED, LOG_BUFFER_SIZE, LOG_BUFFER_FLUSH_MS
+from .models import NotificationLog
+
+
+class NotificationLogBuffer:
+    """
+    Collects NotificationLog rows and inserts them with one bulk_create
+    when `max_size` rows are waiting or `flush_ms` has passed since the first one.
+
+    Trade-off: rows still in the buffer are lost if the process is killed hard
+    (SIGKILL/OOM). Normal worker shutdown flushes them.
+    """
+
+    def __init__(self, *, max_size: int = LOG_BUFFER_SIZE, flush_ms: int = LOG_BUFFER_FLUSH_MS):
+        self.max_size = max_size
+        self.flush_ms = flush_ms
+        self._rows = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, log: NotificationLog):
+        with self._lock:
+            self._rows.append(log)
+            full = len(self._rows) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_ms / 1000.0, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if rows:
+            NotificationLog.objects.bulk_create(rows)
+        return len(rows)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread has its own DB connection; don't leak it
+            connection.close()
+
+
+_buffer = None
+_buffer_pid = None
+
+
+def get_buffer() -> NotificationLogBuffer:
+    global _buffer, _buffer_pid
+    if _buffer is None or _buffer_pid != os.getpid():
+        _buffer = NotificationLogBuffer()
+        _buffer_pid = os.getpid()
+    return _buffer
+
+
+def write_log(log: NotificationLog):
+    """
+    Persist a finished NotificationLog row: buffered when NOTIFY_LOG_BUFFER_ENABLED,
+    otherwise a plain INSERT.
+    """
+    if LOG_BUFFER_ENABLED:
+        get_buffer().add(log)
+    else:
+        log.save(force_insert=True)
+
+
+def flush_logs(**kwargs):
+    if _buffer is not None and _buffer_pid == os.getpid():
+        _buffer.flush()
+
+
+worker_process_shutdown.connect(flush_logs, weak=False)
+atexit.register(flush_logs)
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.benchmarks import SCENARIOS, isolated_environment, reset_database
+
+
+class Command(BaseCommand):
+    help = "Benchmark the notification pipeline (throughput, p50/p99 latency, query counts) on a throwaway DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all). Choices: {', '.join(SCENARIOS)}")
+        parser.add_argument("--count", type=int, nargs="+", default=[1000],
+                            help="Notifications per scenario; several sizes run in turn (e.g. 1000 10000 100000).")
+        parser.add_argument("--json", action="store_true", help="Print one JSON object per result.")
+
+    def handle(self, *args, **options):
+        names = options["scenarios"] or list(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(unknown)}")
+
+        with isolated_environment():
+            for count in options["count"]:
+                for name in names:
+                    reset_database()
+                    result = SCENARIOS[name](count=count)
+                    if options["json"]:
+                        self.stdout.write(json.dumps(result))
+                    else:
+                        self.stdout.write(" ".join(f"{key}={value}" for key, value in result.items()))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from notifications.conf import BATCH_SIZE, DISPATCH_INTERVAL_SECONDS, DISPATCH_LIMIT, DISPATCH_WINDOW_SECONDS
+from notifications.tasks import dispatch_due_notifications
+
+
+class Command(BaseCommand):
+    help = "Poll the database for notifications that are due soon and enqueue them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single dispatch pass and exit.")
+        parser.add_argument("--interval", type=float, default=DISPATCH_INTERVAL_SECONDS,
+                            help="Seconds to sleep between passes.")
+        parser.add_argument("--window", type=int, default=DISPATCH_WINDOW_SECONDS,
+                            help="Claim rows due within this many seconds.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="Notifications per send_notification_batch task.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = dispatch_due_notifications(
+                batch_size=options["batch_size"],
+                window_seconds=options["window"],
+            )
+            if count:
+                self.stdout.write(f"dispatched {count} notifications")
+            if options["once"]:
+                break
+            # a full page means more rows are due; go again without sleeping
+            if count < DISPATCH_LIMIT:
+                time.sleep(options["interval"])
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from notifications.conf import (
+    LOG_RETENTION_DAYS,
+    NOTIFICATION_RETENTION_DAYS,
+    RETENTION_ARCHIVE_DIR,
+    RETENTION_BATCH_SIZE,
+)
+from notifications.retention import compact_notifications, purge_logs
+
+
+class Command(BaseCommand):
+    help = "Delete (optionally archive) old NotificationLog rows and finished notifications in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log-days", type=int, default=LOG_RETENTION_DAYS,
+                            help="Delete logs that started more than this many days ago.")
+        parser.add_argument("--notification-days", type=int, default=NOTIFICATION_RETENTION_DAYS,
+                            help="Delete SENT/FAILED/CANCELED notifications not updated for this many days.")
+        parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE,
+                            help="Rows per DELETE statement.")
+        parser.add_argument("--archive-dir", default=RETENTION_ARCHIVE_DIR,
+                            help="Write deleted rows to gzipped JSONL files in this directory first.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        common = {
+            "batch_size": options["batch_size"],
+            "archive_dir": options["archive_dir"],
+            "dry_run": options["dry_run"],
+        }
+        for label, purge, days in (
+            ("logs", purge_logs, options["log_days"]),
+            ("notifications", compact_notifications, options["notification_days"]),
+        ):
+            if days is None:
+                self.stdout.write(f"{label}: retention disabled")
+                continue
+            result = purge(days=days, **common)
+            if options["dry_run"]:
+                self.stdout.write(f"{label}: {result['matched']} older than {days} days")
+            else:
+                line = f"{label}: deleted {result['deleted']}"
+                if result["archive"]:
+                    line += f" (archived to {result['archive']})"
+                if result.get("cascade_archive"):
+                    line += f" (their logs archived to {result['cascade_archive']})"
+                self.stdout.write(line)
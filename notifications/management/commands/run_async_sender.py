@@ -0,0 +1,40 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from notifications.async_sender import AsyncSender
+from notifications.conf import ASYNC_BATCH_SIZE, ASYNC_CONCURRENCY, DISPATCH_INTERVAL_SECONDS
+
+
+class Command(BaseCommand):
+    help = "Send due notifications from an asyncio loop with many concurrent SMTP sessions (instead of Celery workers)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY,
+                            help="Concurrent SMTP sessions.")
+        parser.add_argument("--batch-size", type=int, default=ASYNC_BATCH_SIZE,
+                            help="Notifications claimed per round.")
+        parser.add_argument("--interval", type=float, default=DISPATCH_INTERVAL_SECONDS,
+                            help="Seconds to sleep when nothing is due.")
+        parser.add_argument("--once", action="store_true", help="Run a single round and exit.")
+
+    def handle(self, *args, **options):
+        sender = AsyncSender(concurrency=options["concurrency"], batch_size=options["batch_size"])
+        asyncio.run(self._main(sender, options))
+
+    async def _main(self, sender, options):
+        if options["once"]:
+            try:
+                counts = await sender.run_once()
+            finally:
+                await sender.close()
+            self.stdout.write(f"sent {counts['sent']}, failed {counts['failed']}")
+            return
+
+        # finish the round in flight on SIGINT/SIGTERM instead of abandoning claimed rows
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await sender.run(interval=options["interval"], stop=stop)
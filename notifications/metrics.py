@@ -0,0 +1,219 @@
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from django.utils.module_loading import import_string
+
+from .conf import METRICS_SINKS, STATSD_HOST, STATSD_PORT, STATSD_PREFIX
+
+# histogram bucket upper bounds, in milliseconds
+BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class Histogram:
+    """Cumulative-bucket histogram of millisecond observations (Prometheus style)."""
+
+    def __init__(self, buckets: List[float] = BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot = +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.sum += value_ms
+
+
+class Registry:
+    """
+    In-process metrics: histograms + counters keyed by (name, sorted tag items),
+    plus "collectors" - callables returning gauges (e.g. SMTP pool stats) at scrape time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.counters: Dict[tuple, float] = {}
+        self.collectors: Dict[str, Callable[[], dict]] = {}
+
+    def observe(self, name: str, value_ms: float, tags: Optional[dict] = None):
+        key = (name, tuple(sorted((tags or {}).items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value_ms)
+
+    def increment(self, name: str, value: float = 1, tags: Optional[dict] = None):
+        key = (name, tuple(sorted((tags or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_collector(self, name: str, collector: Callable[[], dict]):
+        self.collectors[name] = collector
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+registry = Registry()
+
+
+# ---- sinks ------------------------------------------------------------------
+
+class InProcessSink:
+    """Aggregate into this process's registry (scraped via the Prometheus view)."""
+
+    def timing(self, name: str, value_ms: float, tags: Optional[dict] = None):
+        registry.observe(name, value_ms, tags)
+
+    def increment(self, name: str, value: float = 1, tags: Optional[dict] = None):
+        registry.increment(name, value, tags)
+
+
+class StatsdSink:
+    """
+    Fire-and-forget statsd UDP packets: `<prefix>.<name>[.<tag values>]:<value>|ms`.
+    Network errors are swallowed - metrics must never break a send.
+    """
+
+    def __init__(self, host: str = STATSD_HOST, port: int = STATSD_PORT, prefix: str = STATSD_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _metric(self, name: str, tags: Optional[dict]) -> str:
+        parts = [self.prefix, name] + [str(value) for _, value in sorted((tags or {}).items())]
+        return ".".join(part for part in parts if part)
+
+    def _send(self, payload: str):
+        try:
+            self._socket.sendto(payload.encode("ascii", "replace"), self.address)
+        except OSError:
+            pass
+
+    def timing(self, name: str, value_ms: float, tags: Optional[dict] = None):
+        self._send(f"{self._metric(name, tags)}:{value_ms:.3f}|ms")
+
+    def increment(self, name: str, value: float = 1, tags: Optional[dict] = None):
+        self._send(f"{self._metric(name, tags)}:{value:g}|c")
+
+
+_sinks = None
+
+
+def get_sinks():
+    """Instantiate NOTIFY_METRICS_SINKS (dotted paths) once per process."""
+    global _sinks
+    if _sinks is None:
+        _sinks = [import_string(path)() for path in METRICS_SINKS]
+    return _sinks
+
+
+def timing(name: str, value_ms: float, tags: Optional[dict] = None):
+    for sink in get_sinks():
+        sink.timing(name, value_ms, tags)
+
+
+def increment(name: str, value: float = 1, tags: Optional[dict] = None):
+    for sink in get_sinks():
+        sink.increment(name, value, tags)
+
+
+# ---- per-attempt stage timing -------------------------------------------------
+
+class StageTimer:
+    """
+    Collects wall-clock time per stage of one send attempt:
+
+        timer = StageTimer()
+        with timer.stage("render"):
+            ...
+        timer.report("sent")
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._started) * 1000
+
+    def as_dict(self) -> dict:
+        data = {name: round(ms, 3) for name, ms in self.stages.items()}
+        data["total"] = round(self.total_ms, 3)
+        return data
+
+    def report(self, outcome: str):
+        """Send every stage + the total to the configured sinks."""
+        for name, ms in self.stages.items():
+            timing("send.stage", ms, {"stage": name})
+        timing("send.total", self.total_ms, {"outcome": outcome})
+        increment("send.attempts", 1, {"outcome": outcome})
+
+
+# ---- Prometheus text exposition ---------------------------------------------
+
+def _labels(tags) -> str:
+    if not tags:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in tags
+    )
+    return "{" + escaped + "}"
+
+
+def _prom_name(name: str) -> str:
+    return "notify_" + name.replace(".", "_")
+
+
+def render_prometheus() -> str:
+    """This process's registry in Prometheus text format (histograms in seconds)."""
+    lines = []
+    with registry._lock:
+        histograms = sorted(registry.histograms.items())
+        counters = sorted(registry.counters.items())
+
+    seen = set()
+    for (name, tags), histogram in histograms:
+        metric = _prom_name(name) + "_seconds"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} histogram")
+            seen.add(metric)
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+            cumulative += count
+            le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+            lines.append(f"{metric}_bucket{_labels(tags + (('le', le),))} {cumulative}")
+        lines.append(f"{metric}_sum{_labels(tags)} {histogram.sum / 1000:.6f}")
+        lines.append(f"{metric}_count{_labels(tags)} {histogram.count}")
+
+    for (name, tags), value in counters:
+        metric = _prom_name(name) + "_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels(tags)} {value:g}")
+
+    for prefix, collector in sorted(registry.collectors.items()):
+        for key, value in sorted(collector().items()):
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE notify_{prefix}_{key} gauge")
+                lines.append(f"notify_{prefix}_{key} {value:g}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0005_remove_schedulednotification_notificatio_schedul_3e7b9f_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="notificationlog",
+            name="started_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0006_notificationlog_started_at_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="schedulednotification",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="schedulednotification",
+            name="lease_owner",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
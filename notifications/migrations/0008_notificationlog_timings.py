@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0007_schedulednotification_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationlog",
+            name="timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
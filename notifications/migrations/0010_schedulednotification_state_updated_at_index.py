@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_campaign'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(fields=['state', 'updated_at'], name='notificatio_state_7d5b8a_idx'),
+        ),
+    ]
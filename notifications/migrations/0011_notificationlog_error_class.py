@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0010_schedulednotification_state_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationlog',
+            name='error_class',
+            field=models.CharField(blank=True, choices=[('permanent', 'Permanent'), ('transient', 'Transient'), ('connection', 'Connection'), ('template', 'Template')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_priority(apps, schema_editor):
+    # every template starts on the default lane, so existing rows do too
+    ScheduledNotification = apps.get_model("notifications", "ScheduledNotification")
+    ScheduledNotification.objects.filter(priority__isnull=True).update(priority=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0011_notificationlog_error_class'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Critical'), (1, 'Default'), (2, 'Bulk')], default=1),
+        ),
+        migrations.AddField(
+            model_name='schedulednotification',
+            name='priority',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'Critical'), (1, 'Default'), (2, 'Bulk')], null=True),
+        ),
+        migrations.RunPython(backfill_priority, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='schedulednotification',
+            index=models.Index(fields=['state', 'priority', 'effective_send_at'], name='notificatio_state_cbdec9_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0012_priority_lanes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationtemplate',
+            name='digest_compatible',
+            field=models.BooleanField(default=False),
+        ),
+    ]
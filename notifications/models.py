@@ -1,5 +1,13 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+class Priority(models.IntegerChoices):
+    """Delivery lane; lower sorts first (each lane has its own Celery queue, see NOTIFY_PRIORITY_QUEUES)."""
+    CRITICAL = 0, "Critical"  # password resets, one-off transactional mail
+    DEFAULT = 1, "Default"
+    BULK = 2, "Bulk"          # campaigns, digests
+
 
 class NotificationTemplate(models.Model):
 
@@ -7,6 +15,11 @@ class NotificationTemplate(models.Model):
     # users on the frontend will pick by subject (so make it unique)
     subject = models.CharField(max_length=200, unique=True, db_index=True)
     body = models.TextField()
+    # lane for notifications using this template (a notification may override it)
+    priority = models.PositiveSmallIntegerField(choices=Priority.choices, default=Priority.DEFAULT)
+    # several due notifications of digest-compatible templates for one recipient may go
+    # out as a single digest email (NOTIFY_DIGEST_ENABLED, see dispatch.coalesce_digests)
+    digest_compatible = models.BooleanField(default=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -17,6 +30,47 @@ class NotificationTemplate(models.Model):
     def __str__(self):
         return self.subject
 
+
+class Campaign(models.Model):
+    """
+    A group of notifications sent together (e.g. one bulk_schedule call).
+
+    Progress counters are denormalized and bumped with F() updates as rows
+    move through the pipeline (see notifications.campaigns), so reading a
+    campaign's progress never scans ScheduledNotification.
+    """
+    name = models.CharField(max_length=200)
+
+    # progress counters (maintained incrementally; `recount()` rebuilds them)
+    scheduled_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    canceled_count = models.PositiveIntegerField(default=0)
+
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def pending_count(self) -> int:
+        """Rows not yet sent, failed or canceled."""
+        return max(0, self.scheduled_count - self.sent_count - self.failed_count - self.canceled_count)
+
+    @property
+    def progress(self) -> float:
+        """Share of rows that reached a final state, 0.0 - 1.0."""
+        if not self.scheduled_count:
+            return 0.0
+        return min(1.0, (self.scheduled_count - self.pending_count) / self.scheduled_count)
+
 # class ScheduledNotification(models.Model):
 #     class Status(models.TextChoices):
 #         PENDING = "PENDING", "Pending"       # created; send now (no datetime) or waiting for worker
@@ -105,12 +159,24 @@ class ScheduledNotification(models.Model):
         related_name="scheduled_notifications",
     )
 
+    # optional grouping for progress tracking
+    campaign = models.ForeignKey(
+        "notifications.Campaign",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="notifications",
+    )
+
     # optional data for {{ placeholders }} in the template
     context = models.JSONField(default=dict, blank=True)
 
     # should we attach an .ics calendar file? (optional)
     attach_ics = models.BooleanField(default=False)
 
+    # delivery lane; left empty it is copied from the template on create
+    priority = models.PositiveSmallIntegerField(choices=Priority.choices, null=True, blank=True)
+
     # USER INPUTS (intent)
     scheduled_date = models.DateField(null=True, blank=True)
     scheduled_time = models.TimeField(null=True, blank=True)
@@ -145,6 +211,12 @@ class ScheduledNotification(models.Model):
     # allows a quick “cancel” before it’s sent
     canceled = models.BooleanField(default=False)
 
+    # worker lease: which task owns the current attempt, and until when
+    # (an expired lease means the worker died; the row can be claimed again).
+    # bulk_schedule briefly stamps its inserts here too, cleared before it commits
+    lease_owner = models.CharField(max_length=64, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
     # provider + audit fields
     provider_message_id = models.CharField(max_length=128, null=True, blank=True)
     created_by = models.ForeignKey(
@@ -156,9 +228,13 @@ class ScheduledNotification(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=["state", "effective_send_at"]),
+            # dispatcher claims due rows lane by lane
+            models.Index(fields=["state", "priority", "effective_send_at"]),
             models.Index(fields=["effective_send_at"]),
             models.Index(fields=["state"]),
             models.Index(fields=["idempotency_key"]),
+            # retention compaction + stale-lease recovery scan by state and age
+            models.Index(fields=["state", "updated_at"]),
         ]
         constraints = [
             models.UniqueConstraint(
@@ -207,7 +283,7 @@ class ScheduledNotification(models.Model):
 class NotificationLog(models.Model):
     """
     One row = one attempt to send a ScheduledNotification.
-    We create it when the task starts, and update it on success/failure.
+    Written once, when the attempt finishes (success/failure).
     """
     # link back to the scheduled item
     notification = models.ForeignKey(
@@ -236,11 +312,23 @@ class NotificationLog(models.Model):
     # provider identifiers / errors
     provider_message_id = models.CharField(max_length=128, blank=True)
     error_message = models.TextField(blank=True)
+    # why it failed, for retry decisions (see notifications/retry.py)
+    ERROR_CLASS_CHOICES = [
+        ("permanent", "Permanent"),
+        ("transient", "Transient"),
+        ("connection", "Connection"),
+        ("template", "Template"),
+    ]
+    error_class = models.CharField(max_length=20, choices=ERROR_CLASS_CHOICES, blank=True)
 
-    # timing
-    started_at = models.DateTimeField(auto_now_add=True)
+    # timing (set by the task when the attempt starts; the row itself is written when it finishes)
+    started_at = models.DateTimeField(default=timezone.now, editable=False)
     finished_at = models.DateTimeField(null=True, blank=True)
 
+    # per-stage timings in ms ({"render": 1.2, "smtp": 840.0, ..., "total": 900.1});
+    # only stored for attempts slower than NOTIFY_SLOW_ATTEMPT_MS
+    timings = models.JSONField(null=True, blank=True)
+
     class Meta:
         ordering = ["-started_at"]
         indexes = [
@@ -250,3 +338,30 @@ class NotificationLog(models.Model):
 
     def __str__(self):
         return f"Attempt {self.attempt_no} for #{self.notification_id} [{self.status}]"
+
+
+class Suppression(models.Model):
+    """
+    An address we must never send to (hard bounce, spam complaint, unsubscribe).
+    Workers check the list in memory (see notifications.suppression), not per send.
+    """
+    class Reason(models.TextChoices):
+        BOUNCE = "bounce", "Hard bounce"
+        COMPLAINT = "complaint", "Spam complaint"
+        UNSUBSCRIBE = "unsubscribe", "Unsubscribed"
+        MANUAL = "manual", "Manual"
+
+    # stored normalized (stripped + lowercased), like idempotency keys compare addresses
+    email = models.EmailField(unique=True)
+    reason = models.CharField(max_length=20, choices=Reason.choices, default=Reason.MANUAL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def save(self, *args, **kwargs):
+        self.email = (self.email or "").strip().lower()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.email} ({self.reason})"
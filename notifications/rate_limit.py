@@ -0,0 +1,149 @@
+"""
+Token-bucket rate limiting for outbound mail.
+
+Buckets are keyed by sending account (NOTIFY_RATE_LIMIT_ACCOUNT) and by
+account + recipient domain (NOTIFY_RATE_LIMIT_DOMAINS /
+NOTIFY_RATE_LIMIT_DEFAULT_DOMAIN). A limit "N/m" is a bucket of N tokens
+refilled at N per minute.
+
+`acquire(to_email)` takes one token from every bucket that applies, all or
+nothing, and returns 0.0; when any bucket is empty it takes nothing and
+returns how many seconds until it has a token, so callers can delay the send
+by exactly that long instead of failing it.
+
+Buckets live in Redis (one Lua script call, so they are shared by every
+worker) and fall back to in-process buckets when Redis is not available.
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .conf import RATE_LIMIT_ACCOUNT, RATE_LIMIT_DEFAULT_DOMAIN, RATE_LIMIT_DOMAINS
+from .metrics import increment
+from .redis_client import REDIS_ERRORS, get_redis, mark_down
+
+PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+
+# KEYS = bucket keys; ARGV = capacity, rate (tokens/s) per key.
+# Checks every bucket first and only takes tokens when all have one.
+# Returns the wait in seconds as a string (Lua numbers would be truncated to ints).
+_TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local available = tokens[i]
+    if wait == 0 then
+        available = available - 1
+    end
+    redis.call('HSET', key, 'tokens', available, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+def parse_rate(rate: str) -> Tuple[float, float]:
+    """Parse "N/s|m|h" into (capacity, tokens per second): "600/m" -> (600, 10.0)."""
+    count, _, period = str(rate).partition("/")
+    count = float(count)
+    return count, count / PERIODS[(period or "s")[0].lower()]
+
+
+class _LocalBuckets:
+    """In-process buckets with the same semantics as the Lua script."""
+
+    def __init__(self):
+        self._state = {}  # key -> (tokens, monotonic ts)
+        self._lock = threading.Lock()
+
+    def take(self, buckets: List[Tuple[str, float, float]]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait, tokens = 0.0, []
+            for key, capacity, rate in buckets:
+                available, ts = self._state.get(key, (capacity, now))
+                available = min(capacity, available + max(0.0, now - ts) * rate)
+                tokens.append(available)
+                if available < 1:
+                    wait = max(wait, (1 - available) / rate)
+            for (key, _, _), available in zip(buckets, tokens):
+                self._state[key] = (available - 1 if wait == 0 else available, now)
+            return wait
+
+
+class RateLimiter:
+    """Account + per-domain buckets from notifications.conf (see module docstring)."""
+
+    def __init__(
+        self,
+        *,
+        account: Optional[str] = RATE_LIMIT_ACCOUNT,
+        domains: Dict[str, str] = RATE_LIMIT_DOMAINS,
+        default_domain: Optional[str] = RATE_LIMIT_DEFAULT_DOMAIN,
+        account_name: str = None,
+    ):
+        self.account = parse_rate(account) if account else None
+        self.domains = {domain.lower(): parse_rate(rate) for domain, rate in (domains or {}).items()}
+        self.default_domain = parse_rate(default_domain) if default_domain else None
+        self.account_name = account_name or settings.EMAIL_HOST_USER or settings.DEFAULT_FROM_EMAIL
+        self._local = _LocalBuckets()
+        self._script = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.account or self.domains or self.default_domain)
+
+    def buckets_for(self, to_email: str) -> List[Tuple[str, float, float]]:
+        """[(key, capacity, rate), ...] that apply to a recipient."""
+        buckets = []
+        prefix = f"notify:rl:{self.account_name}"
+        if self.account:
+            buckets.append((prefix, *self.account))
+        domain = to_email.rpartition("@")[2].lower()
+        limit = self.domains.get(domain, self.default_domain)
+        if limit:
+            buckets.append((f"{prefix}:{domain}", *limit))
+        return buckets
+
+    def acquire(self, to_email: str) -> float:
+        """Take a token for `to_email`: 0.0 on success, else seconds until one is available."""
+        buckets = self.buckets_for(to_email)
+        if not buckets:
+            return 0.0
+        wait = self._take(buckets)
+        if wait:
+            increment("send.throttled")
+        return wait
+
+    def _take(self, buckets) -> float:
+        client = get_redis()
+        if client is not None:
+            try:
+                if self._script is None:
+                    self._script = client.register_script(_TAKE_SCRIPT)
+                args = [value for _, capacity, rate in buckets for value in (capacity, rate)]
+                return float(self._script(keys=[key for key, _, _ in buckets], args=args))
+            except REDIS_ERRORS as e:
+                mark_down(e)
+        return self._local.take(buckets)
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,48 @@
+"""
+Shared Redis client for cross-worker state (rate limits, ...).
+
+Redis is optional: with no NOTIFY_REDIS_URL (or no `redis` package) callers
+get None and keep their state in-process. After a connection error the client
+is not tried again for RETRY_AFTER seconds, so an unreachable Redis costs one
+short timeout per interval instead of one per send.
+"""
+import logging
+import threading
+import time
+
+from .conf import REDIS_URL
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# exception types that mean "fall back to in-process state"
+REDIS_ERRORS = (redis.RedisError, OSError) if redis is not None else ()
+RETRY_AFTER = 30.0  # seconds to stay on the in-process fallback after an error
+
+_client = None
+_down_until = 0.0
+_lock = threading.Lock()
+
+
+def get_redis():
+    """Return the shared client, or None when Redis is not configured / recently failed."""
+    global _client
+    if redis is None or not REDIS_URL or time.monotonic() < _down_until:
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                # redis-py's pool notices forks and reconnects in the child by itself
+                _client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+    return _client
+
+
+def mark_down(error: Exception):
+    """Callers report connection errors here; Redis is skipped for RETRY_AFTER seconds."""
+    global _down_until
+    _down_until = time.monotonic() + RETRY_AFTER
+    logger.warning("Redis unavailable (%s); using in-process state for %ss", error, RETRY_AFTER)
@@ -0,0 +1,159 @@
+"""
+Retention for NotificationLog and finished ScheduledNotification rows.
+
+Rows are removed in bounded batches: select up to `batch_size` pks, optionally
+append them to a gzipped JSONL archive, then DELETE by pk. Each DELETE is its
+own short statement, so no batch holds locks for long and a run can be
+interrupted and resumed at any point. Rows the DELETE cascades to (a compacted
+notification's logs) are archived too, to their own file.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .conf import (
+    LOG_RETENTION_DAYS,
+    NOTIFICATION_RETENTION_DAYS,
+    RETENTION_ARCHIVE_DIR,
+    RETENTION_BATCH_SIZE,
+)
+from .models import NotificationLog, ScheduledNotification
+
+# only rows nobody will touch again are compacted
+TERMINAL_STATES = [
+    ScheduledNotification.Status.SENT,
+    ScheduledNotification.Status.FAILED,
+    ScheduledNotification.Status.CANCELED,
+]
+
+
+class _Archive:
+    """
+    Append-only gzipped JSONL file, opened lazily on the first batch
+    (so runs that delete nothing leave no empty files behind).
+    """
+
+    def __init__(self, directory: Optional[str], name: str, stamp: datetime):
+        self.path = (
+            os.path.join(directory, f"{name}-{stamp:%Y%m%dT%H%M%S}.jsonl.gz") if directory else None
+        )
+        self._file = None
+
+    def write(self, rows):
+        if self.path is None:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        for row in rows:
+            self._file.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(",", ":")))
+            self._file.write("\n")
+        # flushed before the DELETE, so an archived row is never lost
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _purge(
+    queryset, *, name: str, batch_size: int, archive_dir: Optional[str], dry_run: bool, cascade=None
+) -> dict:
+    """
+    `cascade` = (name, model, fk field) for rows the DELETE takes along; with an archive
+    dir they are written to their own archive before each batch is deleted.
+    """
+    model = queryset.model
+    # .order_by() drops the model's default ordering so each page is an index range scan, not a sort
+    queryset = queryset.order_by()
+    if dry_run:
+        return {"deleted": 0, "matched": queryset.count(), "archive": None}
+
+    now = timezone.now()
+    archive = _Archive(archive_dir, name, now)
+    cascade_archive = _Archive(archive_dir, cascade[0], now) if cascade else None
+    deleted = cascaded = 0
+    try:
+        while True:
+            if archive.path:
+                rows = list(queryset.values()[:batch_size])
+                pks = [row["id"] for row in rows]
+            else:
+                pks = list(queryset.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            if archive.path:
+                archive.write(rows)
+                if cascade:
+                    _, related, field = cascade
+                    dependents = list(related.objects.filter(**{f"{field}__in": pks}).order_by().values())
+                    cascade_archive.write(dependents)
+                    cascaded += len(dependents)
+            model.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            if len(pks) < batch_size:
+                break
+    finally:
+        archive.close()
+        if cascade_archive is not None:
+            cascade_archive.close()
+    result = {"deleted": deleted, "matched": deleted, "archive": archive.path if deleted else None}
+    if cascade:
+        result["cascade_archive"] = cascade_archive.path if cascaded else None
+    return result
+
+
+def purge_logs(
+    *,
+    days: Optional[int] = LOG_RETENTION_DAYS,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    archive_dir: Optional[str] = RETENTION_ARCHIVE_DIR,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Delete NotificationLog rows that started more than `days` ago.
+    Returns {"deleted", "matched", "archive"} (archive = file path or None).
+    """
+    if days is None:
+        return {"deleted": 0, "matched": 0, "archive": None}
+    cutoff = timezone.now() - timedelta(days=days)
+    return _purge(
+        NotificationLog.objects.filter(started_at__lt=cutoff),
+        name="notificationlog",
+        batch_size=batch_size,
+        archive_dir=archive_dir,
+        dry_run=dry_run,
+    )
+
+
+def compact_notifications(
+    *,
+    days: Optional[int] = NOTIFICATION_RETENTION_DAYS,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    archive_dir: Optional[str] = RETENTION_ARCHIVE_DIR,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Delete SENT / FAILED / CANCELED notifications last updated more than `days` ago
+    (their remaining logs go with them via the FK cascade; with an archive dir they
+    are archived first, to their own file: result["cascade_archive"]).
+
+    Campaign counters are left as they are, so a campaign's history survives
+    compaction; don't `campaigns.recount()` a compacted campaign.
+    """
+    if days is None:
+        return {"deleted": 0, "matched": 0, "archive": None}
+    cutoff = timezone.now() - timedelta(days=days)
+    return _purge(
+        ScheduledNotification.objects.filter(state__in=TERMINAL_STATES, updated_at__lt=cutoff),
+        name="schedulednotification",
+        batch_size=batch_size,
+        archive_dir=archive_dir,
+        dry_run=dry_run,
+        cascade=("notificationlog-compacted", NotificationLog, "notification_id"),
+    )
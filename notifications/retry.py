@@ -0,0 +1,75 @@
+"""
+Retry policy: which errors are worth retrying, and when.
+
+Error classes (stored on NotificationLog.error_class):
+- permanent:  the server refused this message for good (5xx) -> FAILED now
+- template:   rendering/building the message failed; a retry builds the same thing -> FAILED now
+- connection: we could not talk to the server (refused, timeout, TLS, 421, auth) -> retry
+- transient:  temporary refusal (4xx) or anything unrecognised -> retry
+"""
+import random
+import smtplib
+from typing import Optional
+
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+
+from .conf import MAX_RETRIES, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+CONNECTION = "connection"
+TEMPLATE = "template"
+ERROR_CLASSES = [PERMANENT, TRANSIENT, CONNECTION, TEMPLATE]
+# classes where another attempt cannot succeed
+FINAL_CLASSES = {PERMANENT, TEMPLATE}
+
+
+class MessageBuildError(Exception):
+    """Wraps an error raised while rendering/building a message (classified as "template")."""
+
+
+def smtp_code(exc: BaseException) -> Optional[int]:
+    """SMTP reply code carried by an exception (smtplib, or async_sender.SMTPResponseError)."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        # one entry per refused recipient; any temporary refusal makes the whole thing worth a retry
+        codes = [code for code, _ in exc.recipients.values()]
+        return min(codes) if codes else None
+    code = getattr(exc, "smtp_code", None)
+    if code is None:
+        code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def classify(exc: BaseException, *, during_send: bool = True) -> str:
+    """
+    One of ERROR_CLASSES for an exception from a send attempt.
+    `during_send=False` means it was raised before anything reached the server.
+    """
+    if not during_send or isinstance(exc, (MessageBuildError, TemplateSyntaxError, TemplateDoesNotExist)):
+        return TEMPLATE
+    # account/session problems, not this message's fault (checked before the reply code)
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError)):
+        return CONNECTION
+    code = smtp_code(exc)
+    if code is not None:
+        if code == 421:  # "service not available, closing channel"
+            return CONNECTION
+        return PERMANENT if 500 <= code < 600 else TRANSIENT
+    # refused / reset / timed out / TLS failures (smtplib errors are OSErrors too, hence last)
+    if isinstance(exc, OSError):
+        return CONNECTION
+    return TRANSIENT
+
+
+def should_give_up(error_class: str, attempts: int) -> bool:
+    """`attempts` = attempts made so far, including the one that just failed."""
+    return error_class in FINAL_CLASSES or attempts > MAX_RETRIES
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    Delay before the next attempt: exponential in the attempts made so far, with
+    full jitter so notifications that failed together don't retry together.
+    """
+    ceiling = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return random.uniform(0, ceiling)
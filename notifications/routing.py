@@ -0,0 +1,18 @@
+"""
+Priority lanes: which Celery queue a notification's send tasks go to.
+
+Each Priority has its own queue (NOTIFY_PRIORITY_QUEUES, declared in
+core/celery.py), so a 100k-row campaign on the bulk lane never sits in front
+of a password reset on the critical one.
+"""
+from typing import Optional
+
+from .conf import PRIORITY_QUEUES
+from .models import Priority
+
+
+def queue_for(priority: Optional[int]) -> str:
+    """Queue name for a Priority value (None = the default lane)."""
+    if priority is None:
+        priority = Priority.DEFAULT
+    return PRIORITY_QUEUES[Priority(priority).name.lower()]
@@ -1,13 +1,34 @@
 import hashlib
 import json
-from typing import Any, Dict, Optional, Tuple
+import uuid
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime, date, time, timedelta, timezone as dt_timezone
 from django.utils import timezone
 from django.conf import settings
-from zoneinfo import ZoneInfo
-
-
-from .tasks import send_notification
+from django.db import transaction
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+from . import campaigns
+from .conf import (
+    BATCH_SIZE,
+    DB_DISPATCHER,
+    DIGEST_ENABLED,
+    DISPATCH_WINDOW_SECONDS,
+    IDEMPOTENCY_HASH,
+    LEVEL_MAX_DELAY_SECONDS,
+    SEND_RATE_TARGET,
+    SPREAD_ALL_DAY,
+)
+from .dispatch import claim_for_direct_enqueue
+from .leveling import MOVABLE_MODES, existing_load, plan_send_times, spread_send_at
+from .metrics import increment
+from .models import NotificationLog, ScheduledNotification, Suppression
+from .routing import queue_for
+from .suppression import normalize, suppression_list
+from .tasks import dispatch_due_notifications, send_notification, send_notification_batch
 
 # Match your model's choice values
 MODE_IMMEDIATE = "IMMEDIATE"
@@ -16,6 +37,19 @@ MODE_TODAY_AT_TIME = "TODAY_AT_TIME"
 MODE_EXACT_DATETIME = "EXACT_DATETIME"
 
 
+# one shared encoder; json.dumps(..., sort_keys=True) builds a new one per call
+_CONTEXT_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def _digest(raw: str, algorithm: str = "sha256") -> str:
+    """Hex digest of the raw fingerprint: sha256 (existing keys) or blake2b (32-byte, faster)."""
+    if algorithm == "sha256":
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=32).hexdigest()
+    raise ValueError(f"Unsupported idempotency hash: {algorithm!r}")
+
+
 def compute_idempotency_key(
     *,
     template_key: str,
@@ -25,6 +59,7 @@ def compute_idempotency_key(
     attach_ics: bool = False,
     scheduling_mode: Optional[str] = None,
     user_timezone: Optional[str] = None,
+    algorithm: str = IDEMPOTENCY_HASH,
 ) -> str:
     """
     Build a stable fingerprint for a scheduled email request (Approach B).
@@ -32,13 +67,55 @@ def compute_idempotency_key(
     """
     email_norm = (to_email or "").strip().lower()
     when_norm = effective_send_at.isoformat() if effective_send_at else "immediate"
-    payload = json.dumps(context or {}, sort_keys=True, separators=(",", ":"))
+    payload = _CONTEXT_ENCODER.encode(context or {})
     ics_flag = "ics" if attach_ics else "no-ics"
     mode = scheduling_mode or ""
     tzname = (user_timezone or "").strip()
 
     raw = f"{template_key}|{email_norm}|{when_norm}|{mode}|{tzname}|{payload}|{ics_flag}"
-    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return _digest(raw, algorithm)
+
+
+def compute_idempotency_keys(
+    rows: Iterable[Dict[str, Any]],
+    *,
+    template_keys: Optional[Dict[int, str]] = None,
+    algorithm: str = IDEMPOTENCY_HASH,
+) -> List[str]:
+    """
+    compute_idempotency_key for many rows; same keys, less work per row.
+
+    Each row is a mapping with the compute_idempotency_key arguments. Instead of
+    "template_key" a row may carry "template_id", looked up in `template_keys`
+    ({template_pk: template.key}) so no template has to be fetched per row.
+    A context object shared by many rows (typical for campaigns) is serialized once.
+    """
+    template_keys = template_keys or {}
+    payloads: Dict[int, Tuple[Any, str]] = {}  # id(context) -> (context, canonical JSON)
+    keys = []
+    for row in rows:
+        template_key = row.get("template_key") or template_keys[row["template_id"]]
+        context = row.get("context") or {}
+        # holding a reference to `context` keeps its id() from being reused during the loop
+        cached = payloads.get(id(context))
+        if cached is None or cached[0] is not context:
+            cached = payloads[id(context)] = (context, _CONTEXT_ENCODER.encode(context))
+        payload = cached[1]
+
+        send_at = row.get("effective_send_at")
+        raw = "|".join(
+            (
+                template_key,
+                (row.get("to_email") or "").strip().lower(),
+                send_at.isoformat() if send_at else "immediate",
+                row.get("scheduling_mode") or "",
+                (row.get("user_timezone") or "").strip(),
+                payload,
+                "ics" if row.get("attach_ics") else "no-ics",
+            )
+        )
+        keys.append(_digest(raw, algorithm))
+    return keys
 # # effective_send_at
 # def compute_idempotency_key(
 #     template_key: str,
@@ -80,10 +157,25 @@ def enqueue_for_delivery(notification):
 
     now = timezone.now()
     eta = notification.effective_send_at
+
+    if DB_DISPATCHER:
+        # Far-future rows stay in the DB; dispatch_due_notifications picks them up
+        if eta and eta > now + timedelta(seconds=DISPATCH_WINDOW_SECONDS):
+            return None
+        # Digest-compatible rows wait for the dispatcher too, so it can coalesce them
+        if DIGEST_ENABLED and notification.template.digest_compatible:
+            return None
+        # Near-term rows go out now, but claim them first so the dispatcher skips them
+        if not claim_for_direct_enqueue(notification):
+            return None
+
+    queue = queue_for(notification.priority)
     if eta and eta > now:
-        return send_notification.apply_async(args=[notification.id], eta=eta)
+        return send_notification.apply_async(
+            args=[notification.id], eta=eta, task_id=eta_task_id(notification.id), queue=queue
+        )
     else:
-        return send_notification.delay(notification.id)
+        return send_notification.apply_async(args=[notification.id], queue=queue)
 
 # def enqueue_for_delivery(notification):
 #     """
@@ -135,8 +227,111 @@ def cancel_notification(notification):
     notification.canceled = True
     notification.state = notification.Status.CANCELED
     notification.save(update_fields=["canceled", "state", "updated_at"])
+    campaigns.increment(notification.campaign_id, "canceled")
     return True
 
+FINAL_STATES = (
+    ScheduledNotification.Status.SENT,
+    ScheduledNotification.Status.CANCELED,
+    ScheduledNotification.Status.FAILED,
+)
+
+# revoke() ids are broadcast to every worker; keep each message small
+REVOKE_BATCH_SIZE = 1000
+
+
+def eta_task_id(pk: int) -> str:
+    """
+    Task id for a notification's delayed (ETA) send, derived from its pk so
+    cancel_many can revoke it without us storing task ids anywhere.
+    """
+    return f"notification-{pk}"
+
+
+def cancel_many(queryset_or_filter, *, revoke: bool = False) -> Dict[str, int]:
+    """
+    Cancel every non-final notification matching a queryset or a filter dict,
+    without touching the rows one by one.
+
+    - One locking SELECT resolves the matching rows to pks, then one UPDATE per
+      BATCH_SIZE of the non-final ones.
+    - One CANCELED NotificationLog per canceled row, bulk inserted.
+    - revoke=True also revokes the rows' ETA tasks, REVOKE_BATCH_SIZE ids per
+      broadcast. Batch/dispatcher tasks can't be revoked per row; they skip
+      canceled rows when they claim them anyway.
+
+    Returns {"matched", "canceled", "revoked"}.
+    """
+    if isinstance(queryset_or_filter, dict):
+        queryset = ScheduledNotification.objects.filter(**queryset_or_filter)
+    else:
+        queryset = queryset_or_filter
+
+    stamp = timezone.now()
+
+    with transaction.atomic():
+        # 1) Resolve the queryset to concrete rows once, locked: a filter on state would match
+        #    nothing if it were evaluated again after the UPDATE
+        matching = list(
+            ScheduledNotification.objects.select_for_update()
+            .filter(pk__in=queryset.values("pk"))
+            .values_list("pk", "state", "attempts", "to_email", "campaign_id")
+        )
+        rows = [row for row in matching if row[1] not in FINAL_STATES]
+
+        # 2) Cancel exactly those rows, then log and count them
+        canceled = 0
+        for start in range(0, len(rows), BATCH_SIZE):
+            canceled += ScheduledNotification.objects.filter(
+                pk__in=[row[0] for row in rows[start:start + BATCH_SIZE]]
+            ).exclude(state__in=FINAL_STATES).update(
+                canceled=True,
+                state=ScheduledNotification.Status.CANCELED,
+                lease_owner=None,
+                lease_expires_at=None,
+                updated_at=stamp,
+            )
+        NotificationLog.objects.bulk_create(
+            [
+                NotificationLog(
+                    notification_id=pk,
+                    attempt_no=attempts,
+                    status="CANCELED",
+                    to_email=to_email,
+                    started_at=stamp,
+                    finished_at=stamp,
+                )
+                for pk, _, attempts, to_email, _ in rows
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        campaigns.increment_many(Counter((campaign_id, "canceled") for *_, campaign_id in rows))
+
+    revoked = 0
+    if revoke and rows:
+        control = send_notification.app.control
+        for start in range(0, len(rows), REVOKE_BATCH_SIZE):
+            chunk = [eta_task_id(row[0]) for row in rows[start:start + REVOKE_BATCH_SIZE]]
+            control.revoke(chunk)
+            revoked += len(chunk)
+
+    return {"matched": len(matching), "canceled": canceled, "revoked": revoked}
+
+
+@lru_cache(maxsize=1024)
+def resolve_timezone(name: str) -> Optional[ZoneInfo]:
+    """
+    Memoized ZoneInfo lookup. Invalid names are cached too (as None), so a
+    bad timezone repeated across a big import only costs one failed lookup.
+    Names of tzdata directories ("America") or too long for the filesystem
+    raise OSError and count as invalid too.
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError, OSError):
+        return None
+
+
 def pick_timezone(user_tz: Optional[str]) -> Tuple[ZoneInfo, str]:
     """
     Pick an IANA timezone to use.
@@ -154,11 +349,11 @@ def pick_timezone(user_tz: Optional[str]) -> Tuple[ZoneInfo, str]:
         or getattr(settings, "TIME_ZONE", None)
         or "UTC"
     )
-    try:
-        return ZoneInfo(candidate), candidate
-    except Exception:
+    tz = resolve_timezone(candidate)
+    if tz is None:
         # Fallback to UTC if the name is invalid
-        return ZoneInfo("UTC"), "UTC"
+        return resolve_timezone("UTC"), "UTC"
+    return tz, candidate
 
 
 def to_local(dt_date: date, dt_time: time, tz: ZoneInfo) -> datetime:
@@ -195,8 +390,22 @@ def compute_schedule(
     """
     tz, tzname = pick_timezone(user_timezone)
     now_utc = now_utc or timezone.now()
-    now_local = now_utc.astimezone(tz)
+    return _schedule_in_zone(
+        scheduled_date, scheduled_time, tz, tzname, now_utc, now_utc.astimezone(tz), all_day_hour, all_day_minute
+    )
 
+
+def _schedule_in_zone(
+    scheduled_date: Optional[date],
+    scheduled_time: Optional[time],
+    tz: ZoneInfo,
+    tzname: str,
+    now_utc: datetime,
+    now_local: datetime,
+    all_day_hour: int,
+    all_day_minute: int,
+) -> Tuple[str, datetime, str]:
+    """compute_schedule's rules, with the timezone and local 'now' already resolved."""
     # 1) Neither date nor time: send now
     if scheduled_date is None and scheduled_time is None:
         return MODE_IMMEDIATE, now_utc, tzname
@@ -219,4 +428,270 @@ def compute_schedule(
 
     # 4) Both date and time: exact instant
     local_dt = to_local(scheduled_date, scheduled_time, tz)
-    return MODE_EXACT_DATETIME, local_dt.astimezone(dt_timezone.utc), tzname
\ No newline at end of file
+    return MODE_EXACT_DATETIME, local_dt.astimezone(dt_timezone.utc), tzname
+
+
+def compute_schedule_many(
+    rows: Iterable[Dict[str, Any]],
+    *,
+    all_day_hour: int = 9,
+    all_day_minute: int = 0,
+    now_utc: Optional[datetime] = None,
+) -> List[Tuple[str, datetime, str]]:
+    """
+    compute_schedule for many rows at once (CSV imports, campaigns).
+
+    Each row is a mapping with optional "scheduled_date", "scheduled_time", "user_timezone".
+    Rows are grouped by timezone so each zone and its local "now" is resolved once,
+    and identical (date, time) inputs inside a zone are computed once.
+    Results come back in input order, same shape as compute_schedule.
+    """
+    rows = list(rows)
+    now_utc = now_utc or timezone.now()
+
+    by_zone: Dict[Optional[str], List[int]] = {}
+    for index, row in enumerate(rows):
+        by_zone.setdefault(row.get("user_timezone"), []).append(index)
+
+    results: List[Optional[Tuple[str, datetime, str]]] = [None] * len(rows)
+    for user_tz, indexes in by_zone.items():
+        tz, tzname = pick_timezone(user_tz)
+        now_local = now_utc.astimezone(tz)
+        seen: Dict[Tuple[Optional[date], Optional[time]], Tuple[str, datetime, str]] = {}
+        for index in indexes:
+            inputs = (rows[index].get("scheduled_date"), rows[index].get("scheduled_time"))
+            resolved = seen.get(inputs)
+            if resolved is None:
+                resolved = seen[inputs] = _schedule_in_zone(
+                    inputs[0], inputs[1], tz, tzname, now_utc, now_local, all_day_hour, all_day_minute
+                )
+            results[index] = resolved
+    return results
+
+
+def enqueue_many_for_delivery(rows: List[Tuple[int, Optional[datetime]]], priority: Optional[int] = None) -> None:
+    """
+    Enqueue many saved notifications at once.
+    `rows` is [(pk, effective_send_at), ...], all on the `priority` lane.
+
+    - DB dispatcher on: one dispatcher kick if anything is due soon; the
+      dispatcher claims and batches the rows itself.
+    - Otherwise: due rows go out as send_notification_batch chunks, future
+      rows as ETA tasks, all published over one broker connection.
+    """
+    if not rows:
+        return
+
+    now = timezone.now()
+    if DB_DISPATCHER:
+        horizon = now + timedelta(seconds=DISPATCH_WINDOW_SECONDS)
+        if any(eta is None or eta <= horizon for _, eta in rows):
+            dispatch_due_notifications.delay()
+        return
+
+    due_ids = [pk for pk, eta in rows if not eta or eta <= now]
+    queue = queue_for(priority)
+    with send_notification.app.producer_or_acquire() as producer:
+        for start in range(0, len(due_ids), BATCH_SIZE):
+            send_notification_batch.apply_async(
+                args=[due_ids[start:start + BATCH_SIZE]], queue=queue, producer=producer
+            )
+        for pk, eta in rows:
+            if eta and eta > now:
+                send_notification.apply_async(
+                    args=[pk], eta=eta, task_id=eta_task_id(pk), queue=queue, producer=producer
+                )
+
+
+def _level_send_times(objs: List[ScheduledNotification], now_utc: datetime, *, spread: bool, send_rate: Optional[float]):
+    """
+    Move new rows' effective_send_at (idempotency keys are already set from the
+    unmoved instants): hash-spread ALL_DAY_DATE rows, then fit IMMEDIATE /
+    ALL_DAY_DATE rows under `send_rate` on top of what is already scheduled.
+    """
+    if spread:
+        for obj in objs:
+            obj.effective_send_at = spread_send_at(
+                obj.scheduling_mode, obj.effective_send_at, obj.idempotency_key, enabled=True
+            )
+    movable = [obj for obj in objs if obj.scheduling_mode in MOVABLE_MODES] if send_rate else []
+    if movable:
+        instants = [obj.effective_send_at for obj in movable]
+        existing = existing_load(
+            min(instants), max(instants) + timedelta(seconds=LEVEL_MAX_DELAY_SECONDS or 0)
+        )
+        for obj, send_at in zip(movable, plan_send_times(instants, send_rate, existing=existing)):
+            obj.effective_send_at = send_at
+    if spread or movable:
+        for obj in objs:
+            obj.state = (
+                ScheduledNotification.Status.SCHEDULED
+                if obj.effective_send_at > now_utc
+                else ScheduledNotification.Status.PENDING
+            )
+
+
+def bulk_schedule(
+    *,
+    template,
+    recipients: Iterable[Union[str, Dict[str, Any]]],
+    scheduled_date: Optional[date] = None,
+    scheduled_time: Optional[time] = None,
+    user_timezone: Optional[str] = None,
+    attach_ics: bool = False,
+    created_by=None,
+    campaign=None,
+    priority: Optional[int] = None,
+    spread: bool = SPREAD_ALL_DAY,
+    send_rate: Optional[float] = SEND_RATE_TARGET,
+    batch_size: int = 1000,
+) -> List[int]:
+    """
+    Schedule one template for many recipients without per-row save() signals.
+
+    Each recipient is either an email string or a dict with "to_email" and any of
+    "context", "scheduled_date", "scheduled_time", "user_timezone", "attach_ics"
+    (falling back to the keyword arguments above).
+
+    - Resolves schedules and idempotency keys in batch (same key as the pre_save signal).
+    - Inserts with bulk_create(ignore_conflicts=True) against uniq_nonnull_idempotency_key,
+      so re-running a campaign never duplicates rows; only rows this call inserted are
+      counted and enqueued, even when a concurrent call inserts the same keys.
+    - Enqueues every created row in one batched publish after commit.
+    - With `campaign`, attaches every row to it and bumps its scheduled_count once.
+    - `priority` (a models.Priority) picks the delivery lane; defaults to the template's.
+    - `spread` / `send_rate` level the send times of new rows (see notifications.leveling).
+    - Skips recipients on the suppression list (see notifications.suppression).
+    - Tells its rows from a concurrent call's by an insert token in lease_owner, cleared
+      again inside the same transaction: committed rows never carry it.
+
+    Returns the pks of the rows that were actually created.
+    """
+    now_utc = timezone.now()
+    if priority is None:
+        priority = template.priority
+
+    # 1) Resolve every schedule in one pass (minus suppressed recipients), then the idempotency keys
+    inputs = []
+    suppressed = 0
+    for recipient in recipients:
+        if isinstance(recipient, str):
+            recipient = {"to_email": recipient}
+        if recipient["to_email"] in suppression_list:
+            suppressed += 1
+            continue
+        inputs.append(
+            {
+                **recipient,
+                "scheduled_date": recipient.get("scheduled_date", scheduled_date),
+                "scheduled_time": recipient.get("scheduled_time", scheduled_time),
+                "user_timezone": recipient.get("user_timezone", user_timezone),
+            }
+        )
+    if suppressed:
+        increment("schedule.suppressed", suppressed)
+    schedules = compute_schedule_many(inputs, now_utc=now_utc)
+
+    objs = []
+    for recipient, (mode, send_at_utc, tzname) in zip(inputs, schedules):
+        sd = recipient["scheduled_date"]
+        st = recipient["scheduled_time"]
+        objs.append(
+            ScheduledNotification(
+                template=template,
+                to_email=recipient["to_email"],
+                context=recipient.get("context") or {},
+                attach_ics=recipient.get("attach_ics", attach_ics),
+                # intent fields must match mode for the DB check constraints
+                scheduled_date=sd if mode in (MODE_ALL_DAY_DATE, MODE_EXACT_DATETIME) else None,
+                scheduled_time=st if mode in (MODE_TODAY_AT_TIME, MODE_EXACT_DATETIME) else None,
+                user_timezone=tzname,
+                scheduling_mode=mode,
+                effective_send_at=send_at_utc,
+                state=(
+                    ScheduledNotification.Status.SCHEDULED
+                    if send_at_utc > now_utc
+                    else ScheduledNotification.Status.PENDING
+                ),
+                created_by=created_by,
+                campaign=campaign,
+                priority=priority,
+            )
+        )
+
+    # same fields as the pre_save signal, so keys match rows created via save()
+    keys = compute_idempotency_keys(
+        {
+            "template_key": template.key,
+            "to_email": obj.to_email,
+            "effective_send_at": obj.effective_send_at,
+            "context": obj.context,
+            "attach_ics": obj.attach_ics,
+        }
+        for obj in objs
+    )
+    rows = {}
+    for obj, key in zip(objs, keys):
+        obj.idempotency_key = key
+        rows[key] = obj
+
+    # 2) Insert only what isn't there yet
+    keys = list(rows)
+    lookup_chunk = 500  # stay under SQLite's bound-parameter limit
+    with transaction.atomic():
+        existing = set()
+        for start in range(0, len(keys), lookup_chunk):
+            existing.update(
+                ScheduledNotification.objects.filter(
+                    idempotency_key__in=keys[start:start + lookup_chunk]
+                ).values_list("idempotency_key", flat=True)
+            )
+        new_keys = [k for k in keys if k not in existing]
+        _level_send_times([rows[k] for k in new_keys], now_utc, spread=spread, send_rate=send_rate)
+        # stamp this call's rows: a concurrent call may insert some of the same keys between
+        # the lookup above and this insert, and those rows are not ours to count or enqueue
+        token = f"schedule-{uuid.uuid4().hex}"
+        for key in new_keys:
+            rows[key].lease_owner = token
+        ScheduledNotification.objects.bulk_create(
+            [rows[k] for k in new_keys], batch_size=batch_size, ignore_conflicts=True
+        )
+
+        # ignore_conflicts leaves pks unset, so read them back by key + stamp, then clear it
+        # before commit (lease_owner is the worker lease; no worker may ever see the token)
+        created = []
+        for start in range(0, len(new_keys), lookup_chunk):
+            mine = list(
+                ScheduledNotification.objects.filter(
+                    idempotency_key__in=new_keys[start:start + lookup_chunk], lease_owner=token
+                ).values_list("pk", "effective_send_at")
+            )
+            ScheduledNotification.objects.filter(pk__in=[pk for pk, _ in mine]).update(lease_owner=None)
+            created.extend(mine)
+        if campaign is not None:
+            campaigns.increment(campaign.pk, "scheduled", len(created))
+
+        # 3) One batched enqueue once the rows are visible to workers
+        transaction.on_commit(lambda: enqueue_many_for_delivery(created, priority))
+
+    return [pk for pk, _ in created]
+
+
+def suppress(emails: Iterable[str], reason: str = Suppression.Reason.MANUAL) -> None:
+    """
+    Add addresses to the suppression list (already-listed ones keep their reason).
+    Takes effect in this process at once and in the others within NOTIFY_SUPPRESSION_REFRESH_SECONDS;
+    rows already scheduled for them are canceled when a worker picks them up.
+    """
+    emails = {normalize(email) for email in emails if email}
+    Suppression.objects.bulk_create(
+        [Suppression(email=email, reason=reason) for email in emails], batch_size=1000, ignore_conflicts=True
+    )
+    suppression_list.add(emails)
+
+
+def unsuppress(emails: Iterable[str]) -> int:
+    """Remove addresses from the suppression list; returns how many were listed."""
+    deleted, _ = Suppression.objects.filter(email__in={normalize(email) for email in emails}).delete()
+    suppression_list.refresh(full=True)
+    return deleted
@@ -1,39 +1,77 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.db import transaction
 
-from .models import ScheduledNotification
+from . import campaigns
+from .models import NotificationTemplate, ScheduledNotification
+from .leveling import spread_send_at
 from .services import compute_idempotency_key, enqueue_for_delivery
+from .suppression import suppression_list
+from .template_cache import template_cache
 
 @receiver(pre_save, sender=ScheduledNotification)
 def scheduled_notification_pre_save(sender, instance: ScheduledNotification, **kwargs):
     """
     Runs just before a ScheduledNotification is saved.
     - Fills idempotency_key if it's empty.
-    - Sets initial state on create (PENDING or SCHEDULED).
+    - Copies the template's priority if none was given.
+    - On create, spreads ALL_DAY_DATE send times when NOTIFY_SPREAD_ALL_DAY is on.
+    - Sets initial state on create (PENDING or SCHEDULED, or CANCELED for a suppressed recipient).
     """
 
     # 1) Fill idempotency_key (only if blank and we have enough info)
     if not instance.idempotency_key and instance.template_id and instance.to_email:
+        # use the template if it's already loaded; otherwise the cached key (no extra query)
+        if ScheduledNotification.template.is_cached(instance):
+            template_key = instance.template.key
+        else:
+            template_key = template_cache.template_key(instance.template_id)
         instance.idempotency_key = compute_idempotency_key(
-            template_key=instance.template.key,
+            template_key=template_key,
             to_email=instance.to_email,
             effective_send_at=instance.effective_send_at,   # UTC or None
             context=instance.context,
             attach_ics=instance.attach_ics,
         )
 
-    # 2) Set initial state on create
+    # 2) Inherit the template's delivery lane (cached, like the key above)
+    if instance.priority is None and instance.template_id:
+        if ScheduledNotification.template.is_cached(instance):
+            instance.priority = instance.template.priority
+        else:
+            instance.priority = template_cache.template_priority(instance.template_id)
+
+    # 3) Set initial state on create (after spreading, which may push the row into the future)
     if instance.pk is None:  # creating (not updating)
+        instance.effective_send_at = spread_send_at(
+            instance.scheduling_mode, instance.effective_send_at, instance.idempotency_key
+        )
         if instance.effective_send_at and instance.effective_send_at > timezone.now():
             instance.state = ScheduledNotification.Status.SCHEDULED
         else:
             instance.state = ScheduledNotification.Status.PENDING
 
+        # 4) Suppressed recipient (bounced / unsubscribed): keep the row, canceled, so nothing is enqueued
+        if instance.to_email in suppression_list:
+            instance.canceled = True
+            instance.state = ScheduledNotification.Status.CANCELED
+            instance.last_error = "Recipient is on the suppression list."
+
 @receiver(post_save, sender=ScheduledNotification)
 def scheduled_notification_post_save(sender, instance: ScheduledNotification, created: bool, **kwargs):
-    if not created or instance.canceled:
+    if not created:
+        return
+    campaigns.increment(instance.campaign_id, "scheduled")
+    if instance.canceled:
+        campaigns.increment(instance.campaign_id, "canceled")
         return
     # Delegate enqueue logic to services (single source of truth)
     transaction.on_commit(lambda: enqueue_for_delivery(instance))
+
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def notification_template_changed(sender, instance: NotificationTemplate, **kwargs):
+    # Drop compiled subject/body (and the cached key) so the next use sees the new source
+    template_cache.invalidate(instance.pk)
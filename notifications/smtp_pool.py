@@ -0,0 +1,222 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import worker_process_shutdown
+from django.core.mail import get_connection
+
+from .conf import (
+    SMTP_POOL_ENABLED,
+    SMTP_POOL_SIZE,
+    SMTP_POOL_MAX_MESSAGES,
+    SMTP_POOL_IDLE_TIMEOUT,
+    SMTP_POOL_HEALTHCHECK_INTERVAL,
+)
+from .metrics import registry
+
+
+class _PooledConnection:
+    """
+    One open email backend connection + the bookkeeping we need to recycle it.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            # closing a dead socket can raise; we are throwing it away anyway
+            pass
+
+
+class Lease:
+    """
+    What callers get from `pool.lease()`.
+    Use `.connection` as the EmailMessage connection and call `.record(n)`
+    after sending so the pool knows when to recycle.
+    """
+
+    def __init__(self, pooled: _PooledConnection):
+        self._pooled = pooled
+        self.connection = pooled.connection
+
+    def record(self, count: int = 1):
+        self._pooled.messages_sent += count
+
+
+class SMTPConnectionPool:
+    """
+    Small per-process pool of open email backend connections.
+
+    - Connections are opened lazily on first use.
+    - Idle connections are health-checked (SMTP NOOP) before reuse.
+    - A connection is recycled after `max_messages` sends or `idle_timeout` seconds idle.
+    - Any exception while a connection is leased discards it.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int = SMTP_POOL_SIZE,
+        max_messages: int = SMTP_POOL_MAX_MESSAGES,
+        idle_timeout: float = SMTP_POOL_IDLE_TIMEOUT,
+        healthcheck_interval: float = SMTP_POOL_HEALTHCHECK_INTERVAL,
+    ):
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._idle = []
+        self._lock = threading.Lock()
+        self._counters = {"opened": 0, "reused": 0, "recycled": 0, "unhealthy": 0, "discarded": 0}
+
+    # ---- checkout / checkin -------------------------------------------------
+
+    def _is_healthy(self, pooled: _PooledConnection, now: float) -> bool:
+        if now - pooled.last_used < self.healthcheck_interval:
+            return True
+        # Only the SMTP backend has a socket to check; other backends (locmem, console) are always fine.
+        if not hasattr(pooled.connection, "connection"):
+            return True
+        smtp = pooled.connection.connection
+        if smtp is None:
+            return False
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _checkout(self) -> _PooledConnection:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                break
+
+            if now - pooled.last_used > self.idle_timeout or pooled.messages_sent >= self.max_messages:
+                self._count("recycled")
+                pooled.close()
+                continue
+            if not self._is_healthy(pooled, now):
+                self._count("unhealthy")
+                pooled.close()
+                continue
+
+            self._count("reused")
+            return pooled
+
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        self._count("opened")
+        return _PooledConnection(connection)
+
+    def _checkin(self, pooled: _PooledConnection):
+        pooled.last_used = time.monotonic()
+        if pooled.messages_sent >= self.max_messages:
+            self._count("recycled")
+            pooled.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(pooled)
+                return
+        pooled.close()
+
+    @contextmanager
+    def lease(self):
+        """
+        Borrow a connection for the duration of the `with` block.
+        """
+        pooled = self._checkout()
+        try:
+            yield Lease(pooled)
+        except BaseException:
+            self._count("discarded")
+            pooled.close()
+            raise
+        else:
+            self._checkin(pooled)
+
+    # ---- lifecycle + metrics ------------------------------------------------
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        """
+        Counters since process start, plus reuse_rate = reused / checkouts.
+        """
+        with self._lock:
+            data = dict(self._counters)
+            data["idle"] = len(self._idle)
+        checkouts = data["reused"] + data["opened"]
+        data["reuse_rate"] = (data["reused"] / checkouts) if checkouts else 0.0
+        return data
+
+
+class _UnpooledConnections:
+    """
+    Same interface as SMTPConnectionPool but opens/closes per lease
+    (NOTIFY_SMTP_POOL_ENABLED = False).
+    """
+
+    @contextmanager
+    def lease(self):
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        pooled = _PooledConnection(connection)
+        try:
+            yield Lease(pooled)
+        finally:
+            pooled.close()
+
+    def close_all(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return this process's pool, creating it lazily.
+    Celery prefork workers fork after import, so we key the pool by PID
+    and never share sockets across processes.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = SMTPConnectionPool() if SMTP_POOL_ENABLED else _UnpooledConnections()
+                _pool_pid = pid
+    return _pool
+
+
+def close_pool(**kwargs):
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close_all()
+
+
+worker_process_shutdown.connect(close_pool, weak=False)
+atexit.register(close_pool)
+registry.register_collector("smtp_pool", lambda: get_pool().stats())
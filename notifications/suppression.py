@@ -0,0 +1,135 @@
+"""
+Suppression list: addresses we never send to (models.Suppression).
+
+Every process keeps the list in memory as a sorted array of 64-bit blake2b hashes
+of the normalized addresses (8 bytes each, ~8 MB per million) plus a small set of
+recent additions, so a lookup is a set probe and one binary search - no DB query.
+
+Refreshes are incremental, with the highest Suppression pk seen as the version:
+at most every NOTIFY_SUPPRESSION_REFRESH_SECONDS a lookup runs one aggregate query
+(max pk, count) and loads only rows above that pk. A count that doesn't add up
+(rows were deleted, or committed out of pk order) triggers a full reload.
+Two addresses sharing a hash would both read as suppressed; with 64 bits that is
+~n / 2**64 per lookup.
+"""
+import hashlib
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+from django.db.models import Count, Max
+
+from .conf import SUPPRESSION_ENABLED, SUPPRESSION_REFRESH_SECONDS
+from .metrics import registry
+from .models import Suppression
+
+_MERGE_AT = 4096  # recent additions folded into the sorted array past this many
+
+
+def normalize(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+def email_hash(email: str) -> int:
+    """64-bit hash of a normalized address."""
+    return int.from_bytes(hashlib.blake2b(normalize(email).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class SuppressionList:
+    """In-process view of models.Suppression (see module docstring); `suppression_list` is the shared one."""
+
+    def __init__(self, *, enabled: bool = SUPPRESSION_ENABLED, refresh_seconds: float = SUPPRESSION_REFRESH_SECONDS):
+        self.enabled = enabled
+        self.refresh_seconds = refresh_seconds
+        self._hashes = array("Q")  # sorted
+        self._recent = set()
+        self.version = 0  # highest Suppression pk loaded
+        self.count = 0  # Suppression rows loaded
+        self._checked_at = None  # monotonic time of the last refresh query
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.reloads = 0
+
+    def __contains__(self, email: str) -> bool:
+        if not self.enabled:
+            return False
+        self.refresh()
+        value = email_hash(email)
+        return value in self._recent or self._in_sorted(self._hashes, value)
+
+    @staticmethod
+    def _in_sorted(hashes: array, value: int) -> bool:
+        index = bisect_left(hashes, value)
+        return index < len(hashes) and hashes[index] == value
+
+    def add(self, emails: Iterable[str]):
+        """Make addresses count as suppressed in this process right away (the next refresh loads their rows)."""
+        with self._lock:
+            self._recent.update(email_hash(email) for email in emails)
+            self._merge()
+
+    def _merge(self):
+        if len(self._recent) > _MERGE_AT:
+            fresh = sorted(value for value in self._recent if not self._in_sorted(self._hashes, value))
+            # two sorted runs: sorted() merges them in linear time; readers see the old or the new array
+            self._hashes = array("Q", sorted(self._hashes + array("Q", fresh)))
+            self._recent = set()
+
+    def refresh(self, force: bool = False, *, full: bool = False):
+        """
+        Pick up rows added / removed since the last refresh (at most every refresh_seconds
+        unless `force`). `full` rebuilds from the table even if nothing seems to have changed,
+        dropping what `add()` put in locally (after removals made in this process).
+        """
+        now = time.monotonic()
+        if not (force or full) and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if not (force or full) and self._checked_at is not None and now - self._checked_at < self.refresh_seconds:
+                return  # another thread just did it
+            self._checked_at = now
+            self.refreshes += 1
+            totals = Suppression.objects.aggregate(version=Max("pk"), count=Count("pk"))
+            version, count = totals["version"] or 0, totals["count"]
+            if not full and version == self.version and count == self.count:
+                return
+
+            # 1) new rows only
+            new = []
+            if not full and version > self.version:
+                new = list(
+                    Suppression.objects.filter(pk__gt=self.version, pk__lte=version).values_list("email", flat=True)
+                )
+            if not full and self.count and self.count + len(new) == count:
+                self._recent.update(email_hash(email) for email in new)
+                self._merge()
+            else:
+                # 2) rows were deleted (or appeared below the version): rebuild from scratch
+                self._recent = set()
+                self._hashes = array(
+                    "Q",
+                    sorted(
+                        email_hash(email)
+                        for email in Suppression.objects.filter(pk__lte=version)
+                        .values_list("email", flat=True)
+                        .iterator(chunk_size=10000)
+                    ),
+                )
+                self.reloads += 1
+            self.version, self.count = version, count
+
+    def stats(self) -> dict:
+        return {
+            "enabled": int(self.enabled),
+            "size": len(self._hashes) + len(self._recent),
+            "version": self.version,
+            "bytes": self._hashes.itemsize * len(self._hashes),
+            "refreshes": self.refreshes,
+            "reloads": self.reloads,
+        }
+
+
+suppression_list = SuppressionList()
+registry.register_collector("suppression", suppression_list.stats)
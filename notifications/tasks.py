@@ -1,140 +1,874 @@
 from celery import shared_task
-from celery.exceptions import MaxRetriesExceededError
+from django.conf import settings
 from django.core.mail import EmailMessage
-from django.template import Template, Context
+from django.core.mail.utils import DNS_NAME
+from django.template import Context
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import F, Q
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, nullcontext
 from datetime import timedelta
-from icalendar import Calendar, Event
 
+from . import campaigns
+from .circuit_breaker import smtp_breaker
 from .models import ScheduledNotification, NotificationLog
-from .conf import ICS_DEFAULT_DURATION_MIN
+from .conf import (
+    ICS_DEFAULT_DURATION_MIN,
+    BATCH_SIZE,
+    DIGEST_ENABLED,
+    DIGEST_SUBJECT,
+    DISPATCH_LIMIT,
+    DISPATCH_WINDOW_SECONDS,
+    LEASE_SECONDS,
+    SLOW_ATTEMPT_MS,
+    STALE_QUEUED_SECONDS,
+)
+from .dispatch import claim_due_notifications, coalesce_digests
+from .ics import ics_cache
+from .log_buffer import write_log
+from .metrics import StageTimer, increment
+from .rate_limit import rate_limiter
+from .retention import compact_notifications, purge_logs
+from .retry import CONNECTION, MessageBuildError, backoff_seconds, classify, should_give_up
+from .routing import queue_for
+from .smtp_pool import get_pool
+from .suppression import suppression_list
+from .template_cache import template_cache
 
+# states a worker is allowed to (re)send from
+SENDABLE_STATES = [
+    ScheduledNotification.Status.PENDING,
+    ScheduledNotification.Status.SCHEDULED,
+    ScheduledNotification.Status.RETRYING,
+    ScheduledNotification.Status.QUEUED,
+]
+SUPPRESSED_ERROR = "Recipient is on the suppression list."
 
-def _build_ics(summary: str, starts_at, duration_min: int, description: str = "", location: str = "") -> bytes:
-    """Create a very small .ics file (bytes) for calendar attachment."""
-    cal = Calendar()
-    cal.add("prodid", "-//Notifications App//")
-    cal.add("version", "2.0")
 
-    event = Event()
-    event.add("summary", summary)
-    event.add("dtstart", starts_at)  # aware datetime (UTC is fine)
-    event.add("dtend", starts_at + timedelta(minutes=duration_min))
-    if description:
-        event.add("description", description)
-    if location:
-        event.add("location", location)
+def _claim(notification_ids, owner: str, now, attempts: int = None):
+    """
+    Take the lease on every sendable row in `notification_ids` with ONE conditional UPDATE.
+    A row is claimable when it is not canceled, in a sendable state, and nobody holds
+    an unexpired lease on it - so exactly one worker wins each attempt.
+    `attempts` (single-row claims) additionally requires the row's current attempt count.
 
-    cal.add_component(event)
-    return cal.to_ical()
+    Returns the number of rows this `owner` now holds.
+    """
+    rows = ScheduledNotification.objects.filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now),
+        pk__in=notification_ids,
+        canceled=False,
+        state__in=SENDABLE_STATES,
+    )
+    if attempts is not None:
+        rows = rows.filter(attempts=attempts)
+    return rows.update(
+        attempts=F("attempts") + 1,
+        state=ScheduledNotification.Status.QUEUED,
+        lease_owner=owner,
+        lease_expires_at=now + timedelta(seconds=LEASE_SECONDS),
+        updated_at=now,
+    )
 
 
-@shared_task(bind=True)
-def send_notification(self, notification_id: int):
+def _unclaim(notification_id: int, owner: str) -> int:
+    """Undo a _claim that sent nothing: back to QUEUED, no lease, the attempt not counted."""
+    return ScheduledNotification.objects.filter(pk=notification_id, lease_owner=owner).update(
+        attempts=F("attempts") - 1,
+        state=ScheduledNotification.Status.QUEUED,
+        lease_owner=None,
+        lease_expires_at=None,
+        updated_at=timezone.now(),
+    )
+
+
+class _BatchLease:
     """
-    Send a ScheduledNotification email.
-    - Respects cancel flag.
-    - Creates a NotificationLog row per attempt.
-    - Attaches .ics if requested.
-    - Retries on error (simple backoff).
+    The lease a batch holds on the rows it claimed, kept alive while it sends.
+
+    Senders ask `holds(pk)` before each message. Once a third of LEASE_SECONDS has passed
+    since the claim (or the last renewal) that runs one conditional UPDATE extending the
+    lease and re-reads which rows `owner` still holds; a row canceled or recovered by
+    recover_stale_leases meanwhile is dropped and not sent. No queries otherwise.
     """
-    # 1) Load fresh copy
-    try:
-        sn = ScheduledNotification.objects.select_related("template").get(pk=notification_id)
-    except ScheduledNotification.DoesNotExist:
-        return "missing"
 
-    # 2) Safety checks
-    if sn.canceled or sn.state not in [
-        ScheduledNotification.Status.PENDING,
-        ScheduledNotification.Status.SCHEDULED,
-        ScheduledNotification.Status.RETRYING,
-        ScheduledNotification.Status.QUEUED,
-    ]:
-        return f"skip:{sn.state}"
+    def __init__(self, owner: str, notifications, claimed_at):
+        self.owner = owner
+        self.held = {sn.pk for sn in notifications}
+        self._renew_at = claimed_at + timedelta(seconds=LEASE_SECONDS / 3)
 
-    # 3) Mark attempt start
-    sn.attempts += 1
-    sn.state = ScheduledNotification.Status.QUEUED
-    sn.save(update_fields=["attempts", "state", "updated_at"])
+    def due(self) -> bool:
+        return timezone.now() >= self._renew_at
 
-    log = NotificationLog.objects.create(
-        notification=sn,
-        attempt_no=sn.attempts,
-        status="STARTED",
-        to_email=sn.to_email,
-        subject_snapshot="",  # fill after rendering
+    def renew(self):
+        if not self.due():
+            return  # another session just did it
+        now = timezone.now()
+        rows = ScheduledNotification.objects.filter(pk__in=self.held, lease_owner=self.owner, canceled=False)
+        rows.update(lease_expires_at=now + timedelta(seconds=LEASE_SECONDS))
+        self.held = set(rows.values_list("pk", flat=True))
+        self._renew_at = now + timedelta(seconds=LEASE_SECONDS / 3)
+
+    def holds(self, pk) -> bool:
+        self.renew()
+        return pk in self.held
+
+
+def _cancel_suppressed(notifications) -> list:
+    """
+    Cancel the rows whose recipient is on the suppression list (one UPDATE, no send,
+    no retries) and return the others. The lookups themselves are in memory.
+    """
+    if not suppression_list.enabled:
+        return notifications
+    suppressed = [sn for sn in notifications if sn.to_email in suppression_list]
+    if not suppressed:
+        return notifications
+    ScheduledNotification.objects.filter(pk__in=[sn.pk for sn in suppressed], state__in=SENDABLE_STATES).update(
+        canceled=True,
+        state=ScheduledNotification.Status.CANCELED,
+        last_error=SUPPRESSED_ERROR,
+        lease_owner=None,
+        lease_expires_at=None,
+        updated_at=timezone.now(),
     )
+    campaigns.increment_many(Counter((sn.campaign_id, "canceled") for sn in suppressed))
+    increment("send.suppressed", len(suppressed))
+    suppressed_pks = {sn.pk for sn in suppressed}
+    return [sn for sn in notifications if sn.pk not in suppressed_pks]
+
 
-    # 4) Render subject + body
+def _render(sn: ScheduledNotification):
+    """Render (subject, body) for a notification from its template + context."""
+    subject_tpl, body_tpl = template_cache.get(sn.template)
     ctx = Context(sn.context or {})
-    subject = Template(sn.template.subject).render(ctx)
-    body = Template(sn.template.body).render(ctx)
+    subject = subject_tpl.render(ctx)
+    body = body_tpl.render(ctx)
+    return subject, body
+
+
+class PrebuiltEmailMessage(EmailMessage):
+    """
+    EmailMessage that builds its MIME tree once.
+    Backends call .message() again inside send(); we hand them the same object
+    instead of re-encoding the body and attachments.
+    """
+
+    _prebuilt = None
 
-    # update log with subject we tried
-    log.subject_snapshot = subject
-    log.save(update_fields=["subject_snapshot"])
+    def message(self):
+        if self._prebuilt is None:
+            self._prebuilt = super().message()
+        return self._prebuilt
 
-    # 5) Build email
-    email = EmailMessage(
+
+def _message_domain() -> str:
+    sender = settings.DEFAULT_FROM_EMAIL or ""
+    return sender.rpartition("@")[2].strip(" >") if "@" in sender else str(DNS_NAME)
+
+
+def _message_id(sn: ScheduledNotification) -> str:
+    """
+    Deterministic Message-ID per (notification, attempt), e.g. <notification-42.1@example.com>.
+    A redelivered task reuses the same id, so providers can de-duplicate it.
+    """
+    return f"<notification-{sn.pk}.{sn.attempts}@{_message_domain()}>"
+
+
+def _ics_attachment(sn: ScheduledNotification, subject: str, body: str, timer: StageTimer = None) -> bytes:
+    """The .ics bytes for a notification with attach_ics (cached per identical event)."""
+    start_dt = sn.effective_send_at or timezone.now()
+    with timer.stage("ics") if timer else nullcontext():
+        return ics_cache.get(
+            summary=subject,
+            starts_at=start_dt,
+            duration_min=ICS_DEFAULT_DURATION_MIN,
+            description=body,
+            location=(sn.context or {}).get("location", ""),
+        )
+
+
+def _build_email(sn: ScheduledNotification, subject: str, body: str, timer: StageTimer = None) -> EmailMessage:
+    """Build the EmailMessage for a notification, attaching an .ics if requested."""
+    email = PrebuiltEmailMessage(
         subject=subject,
         body=body,
         from_email=None,         # uses DEFAULT_FROM_EMAIL from settings
         to=[sn.to_email],
+        headers={"Message-ID": _message_id(sn)},
     )
 
     # Optional .ics attachment
     if sn.attach_ics:
-        start_dt = sn.effective_send_at or timezone.now()
-        ics_bytes = _build_ics(
-            summary=subject,
-            starts_at=start_dt,
-            duration_min=ICS_DEFAULT_DURATION_MIN,
-            description=body,
-            location=(sn.context or {}).get("location", ""),
-        )
-        email.attach("invite.ics", ics_bytes, "text/calendar")
+        email.attach("invite.ics", _ics_attachment(sn, subject, body, timer), "text/calendar")
+    return email
+
+
+def _build_digest_email(items) -> EmailMessage:
+    """
+    One email for several notifications to the same recipient: `items` is
+    [(sn, subject, body), ...]; each becomes a section under its own subject,
+    and every .ics the constituents asked for is attached (invite-1.ics, ...).
+    The Message-ID is derived from the first constituent's (pk, attempt).
+    """
+    first = items[0][0]
+    sections = [f"{subject}\n{'-' * len(subject)}\n{body}" for _, subject, body in items]
+    email = PrebuiltEmailMessage(
+        subject=DIGEST_SUBJECT.format(count=len(items)),
+        body="\n\n".join(sections),
+        from_email=None,
+        to=[first.to_email],
+        headers={"Message-ID": f"<digest-{first.pk}.{first.attempts}@{_message_domain()}>"},
+    )
+    invites = [(sn, subject, body) for sn, subject, body in items if sn.attach_ics]
+    for number, (sn, subject, body) in enumerate(invites, start=1):
+        email.attach(f"invite-{number}.ics", _ics_attachment(sn, subject, body), "text/calendar")
+    return email
+
+
+def _attach_slow_timings(log: NotificationLog, timer: StageTimer):
+    """Keep the stage breakdown on the log row, but only for slow attempts."""
+    if timer.total_ms >= SLOW_ATTEMPT_MS:
+        log.timings = timer.as_dict()
+
+
+def _defer(task, args, check, release=None) -> float:
+    """
+    Re-publish `task` with `args` for when `check()` (a rate limiter / breaker call
+    returning seconds to wait) allows it, on the queue it came from (like a retry).
+    `release()`, if given, runs first (e.g. to hand back a claim the new run will need).
+    Eager tasks (tests, benchmarks) have no broker to delay through, so they sleep
+    until it does and return 0.0.
+    """
+    wait = check()
+    while wait and task.request.is_eager:
+        time.sleep(wait)
+        wait = check()
+    if wait:
+        if release is not None:
+            release()
+        task.signature_from_request(args=args, countdown=wait, retries=task.request.retries).apply_async()
+    return wait
+
+
+@shared_task(bind=True)
+def send_notification(self, notification_id: int):
+    """
+    Send a ScheduledNotification email.
+    - Respects cancel flag.
+    - While the SMTP circuit breaker is open, re-publishes itself for when it half-opens
+      without touching the DB (notifications.circuit_breaker).
+    - Claims the attempt atomically; writes one NotificationLog row per attempt with its final data.
+    - Then takes a rate-limit token (notifications.rate_limit); without one it hands the claim
+      back and re-publishes itself with a countdown.
+    - Attaches .ics if requested.
+    - Sends over this worker's pooled SMTP connection.
+    - Classifies errors (notifications.retry): permanent/template errors fail at once, the
+      rest retry with exponential backoff + full jitter until MAX_RETRIES.
+    - Times each stage (load, claim, render, ics, mime, smtp, persist) into notifications.metrics.
+    - Cancels the row instead if its recipient is on the suppression list (checked in memory).
+    - Writes the final state only while it still holds the lease: a row canceled or recovered
+      meanwhile keeps its state and is neither counted for its campaign nor retried.
+    """
+    # 0) SMTP server known to be down: defer before doing any work
+    if smtp_breaker.enabled and _defer(self, [notification_id], smtp_breaker.allow):
+        return "deferred"
+
+    started_at = timezone.now()
+    timer = StageTimer()
+
+    # 1) Load the row (the recipient decides which rate limits apply)
+    with timer.stage("load"):
+        sn = ScheduledNotification.objects.select_related("template").filter(pk=notification_id).first()
+    if sn is None:
+        return "missing"
+    if sn.canceled or sn.state not in SENDABLE_STATES:
+        return f"skip:{sn.state}"
+    if sn.lease_expires_at and sn.lease_expires_at >= started_at:
+        return "skip:leased"  # another worker is sending it right now
+    if not _cancel_suppressed([sn]):
+        return "suppressed"  # bounced / unsubscribed: canceled, never retried
+
+    # 2) Claim the attempt (lease + attempts bump in one conditional UPDATE);
+    #    matching on attempts means nobody touched the row since we loaded it
+    owner = uuid.uuid4().hex
+    with timer.stage("claim"):
+        claimed = _claim([notification_id], owner, started_at, attempts=sn.attempts)
+    if not claimed:
+        return "skip:raced"  # claimed, canceled or finished by someone else meanwhile
+
+    # 3) Respect outbound rate limits - only now, so losing the claim race costs no token:
+    #    hand the claim back and re-publish the task for exactly when a token is free
+    if rate_limiter.enabled and _defer(
+        self, [notification_id], lambda: rate_limiter.acquire(sn.to_email), release=lambda: _unclaim(sn.pk, owner)
+    ):
+        return "throttled"
+    sn.attempts += 1  # what the claim just wrote
+    log = NotificationLog(
+        notification=sn,
+        attempt_no=sn.attempts,
+        to_email=sn.to_email,
+        started_at=started_at,
+    )
 
-    # 6) Send
     try:
-        # Build MIME to read generated Message-ID for tracing
-        mime = email.message()
-        message_id = mime.get("Message-ID") or ""
+        # 4) Render subject + body
+        with timer.stage("render"):
+            subject, body = _render(sn)
+        log.subject_snapshot = subject
+
+        # 5) Build email (+ optional .ics attachment, timed as its own stage)
+        with timer.stage("build"):
+            email = _build_email(sn, subject, body, timer=timer)
 
-        email.send(fail_silently=False)
+        # Build the MIME message once; send() below reuses it
+        message_id = email.extra_headers["Message-ID"]
+        with timer.stage("mime"):
+            email.message()
 
-        sn.state = ScheduledNotification.Status.SENT
-        sn.last_error = ""
+        # 6) Send - reuse this worker's open SMTP session instead of a new TLS handshake per email
+        with timer.stage("smtp"):
+            with get_pool().lease() as lease:
+                email.connection = lease.connection
+                email.send(fail_silently=False)
+                lease.record()
+        smtp_breaker.record_success()
+
+    except Exception as e:
+        # Permanent error or out of attempts -> FAILED now; otherwise RETRYING with jittered backoff
+        # (anything raised before the smtp stage is a build/template problem)
+        error_class = classify(e, during_send="smtp" in timer.stages)
+        if error_class == CONNECTION:
+            smtp_breaker.record_failure()
+        give_up = should_give_up(error_class, sn.attempts)
+        state = ScheduledNotification.Status.FAILED if give_up else ScheduledNotification.Status.RETRYING
+        with timer.stage("persist"):
+            held = ScheduledNotification.objects.filter(pk=sn.pk, lease_owner=owner).update(
+                state=state, last_error=str(e), lease_owner=None, lease_expires_at=None, updated_at=timezone.now()
+            )
+            if not held:
+                # canceled or recovered while we were sending: its new owner decides what happens next
+                give_up = True
+                increment("send.lost_lease")
+            elif give_up:
+                campaigns.increment(sn.campaign_id, "failed")
+
+            log.status = "FAILED" if give_up else "RETRYING"
+            log.error_message = str(e)
+            log.error_class = error_class
+            log.finished_at = timezone.now()
+            _attach_slow_timings(log, timer)
+            write_log(log)
+        timer.report(log.status.lower())
+
+        if not held:
+            return "failed:lost_lease"
+        if give_up:
+            return "failed"
+        # the attempt budget is sn.attempts (shared with the batch path), not Celery's retry counter
+        raise self.retry(exc=e, countdown=backoff_seconds(sn.attempts), max_retries=None)
+
+    # 7) Record success: one UPDATE + one log INSERT (or a buffered insert)
+    with timer.stage("persist"):
+        updates = {
+            "state": ScheduledNotification.Status.SENT,
+            "last_error": "",
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "updated_at": timezone.now(),
+        }
         if message_id:
-            sn.provider_message_id = message_id
-        sn.save(update_fields=["state", "last_error", "provider_message_id", "updated_at"])
+            updates["provider_message_id"] = message_id
+        # the message is out either way; the row and its campaign only count it while we hold the lease
+        held = ScheduledNotification.objects.filter(pk=sn.pk, lease_owner=owner).update(**updates)
+        if held:
+            campaigns.increment(sn.campaign_id, "sent")
+        else:
+            increment("send.lost_lease")
 
         log.status = "SENT"
         log.provider_message_id = message_id
         log.finished_at = timezone.now()
-        log.save(update_fields=["status", "provider_message_id", "finished_at"])
+        _attach_slow_timings(log, timer)
+        write_log(log)
+    timer.report("sent")
 
-        return "sent"
+    return "sent" if held else "sent:lost_lease"
 
-    except Exception as e:
-        # Mark retrying and record error
-        sn.state = ScheduledNotification.Status.RETRYING
-        sn.last_error = str(e)
-        sn.save(update_fields=["state", "last_error", "updated_at"])
 
-        log.status = "RETRYING"
-        log.error_message = str(e)
-        log.finished_at = timezone.now()
-        log.save(update_fields=["status", "error_message", "finished_at"])
+def _claim_and_load(notification_ids, owner: str, now):
+    """
+    Claim every sendable row with one conditional UPDATE, then load exactly the ones `owner`
+    holds in one query. Rows for suppressed recipients are canceled instead of returned.
+    """
+    if not _claim(notification_ids, owner, now):
+        return []
+    return _cancel_suppressed(
+        list(
+            ScheduledNotification.objects.select_related("template").filter(
+                pk__in=notification_ids, lease_owner=owner
+            )
+        )
+    )
+
+
+def _prepare_batch(notification_ids, owner: str, now):
+    """
+    Claim, load and build a batch (shared by send_notification_batch and the
+    asyncio sender).
+
+    Returns (notifications, results, outgoing):
+    - notifications: the rows `owner` now holds
+    - results: pk -> (subject, message_id, error) for rows that already failed to build
+    - outgoing: [(sn, email, subject, message_id), ...] ready to send
+    """
+    # 1) Claim the whole batch with one conditional UPDATE, 2) load the rows we own
+    notifications = _claim_and_load(notification_ids, owner, now)
+    if not notifications:
+        return [], {}, []
 
-        # Ask Celery to retry (60s). If we exceed retry limit, mark as FAILED.
+    # 3) Render + build every message up front
+    results = {}  # pk -> (subject, message_id, error)
+    outgoing = []
+    for sn in notifications:
         try:
-            raise self.retry(exc=e, countdown=60, max_retries=3)
-        except MaxRetriesExceededError:
-            sn.state = ScheduledNotification.Status.FAILED
-            sn.save(update_fields=["state", "updated_at"])
+            subject, body = _render(sn)
+            email = _build_email(sn, subject, body)
+            email.message()
+            message_id = email.extra_headers["Message-ID"]
+        except Exception as e:
+            results[sn.pk] = ("", "", MessageBuildError(e))
+            continue
+        outgoing.append((sn, email, subject, message_id))
+    return notifications, results, outgoing
 
-            log.status = "FAILED"
-            log.save(update_fields=["status"])
 
-            return "failed"
+def _record_batch(notifications, results, started_at, owner: str, unsent=()):
+    """
+    Persist per-message outcomes of a batch: one locking SELECT + one bulk_update + one log
+    bulk_create (+ one campaign counter UPDATE per campaign).
+    Rows in `unsent` (throttled, or deferred by the circuit breaker) were never sent: they go back to QUEUED without a lease,
+    the attempt is not counted and no log is written.
+    Only rows `owner` still holds are written: one canceled or recovered by recover_stale_leases
+    meanwhile keeps its state, isn't counted for its campaign and isn't retried (a message
+    that did go out still gets its log row).
+
+    Returns (retries, lost): [(pk, countdown), ...] for the rows to retry (now RETRYING),
+    and the pks `owner` no longer held.
+    """
+    finished = timezone.now()
+    logs, retries, updated = [], [], []
+    campaign_events = Counter()  # (campaign_id, "sent"/"failed") -> n
+    with transaction.atomic():
+        held = set(
+            ScheduledNotification.objects.select_for_update()
+            .filter(pk__in=[sn.pk for sn in notifications], lease_owner=owner)
+            .values_list("pk", flat=True)
+        )
+        for sn in notifications:
+            outcome = results.get(sn.pk)
+            if sn.pk not in held:
+                if outcome is not None:
+                    subject, message_id, error = outcome
+                    logs.append(
+                        NotificationLog(
+                            notification=sn,
+                            attempt_no=sn.attempts,
+                            to_email=sn.to_email,
+                            subject_snapshot=subject,
+                            status="FAILED" if error is not None else "SENT",
+                            provider_message_id=message_id,
+                            error_message=str(error or ""),
+                            error_class=classify(error) if error is not None else "",
+                            started_at=started_at,
+                            finished_at=finished,
+                        )
+                    )
+                continue
+            updated.append(sn)
+            if sn.pk in unsent or outcome is None:
+                sn.state = ScheduledNotification.Status.QUEUED
+                sn.attempts -= 1
+                sn.lease_owner = None
+                sn.lease_expires_at = None
+                sn.updated_at = finished
+                continue
+            subject, message_id, error = outcome
+            log = NotificationLog(
+                notification=sn,
+                attempt_no=sn.attempts,
+                to_email=sn.to_email,
+                subject_snapshot=subject,
+                started_at=started_at,
+                finished_at=finished,
+            )
+            if error is None:
+                sn.state = ScheduledNotification.Status.SENT
+                sn.last_error = ""
+                if message_id:
+                    sn.provider_message_id = message_id
+                log.status = "SENT"
+                log.provider_message_id = message_id
+                campaign_events[sn.campaign_id, "sent"] += 1
+            else:
+                sn.last_error = str(error)
+                log.error_message = str(error)
+                log.error_class = classify(error)
+                if should_give_up(log.error_class, sn.attempts):
+                    sn.state = ScheduledNotification.Status.FAILED
+                    log.status = "FAILED"
+                    campaign_events[sn.campaign_id, "failed"] += 1
+                else:
+                    sn.state = ScheduledNotification.Status.RETRYING
+                    log.status = "RETRYING"
+                    retries.append((sn.pk, backoff_seconds(sn.attempts)))
+            sn.lease_owner = None
+            sn.lease_expires_at = None
+            sn.updated_at = finished
+            logs.append(log)
+
+        ScheduledNotification.objects.filter(lease_owner=owner).bulk_update(
+            updated,
+            ["state", "attempts", "last_error", "provider_message_id", "lease_owner", "lease_expires_at", "updated_at"],
+        )
+        NotificationLog.objects.bulk_create(logs)
+        campaigns.increment_many(campaign_events)
+
+    lost = {sn.pk for sn in notifications} - held
+    if lost:
+        increment("send.lost_lease", len(lost))
+    return retries, lost
+
+
+@shared_task(bind=True)
+def send_notification_batch(self, notification_ids):
+    """
+    Send many ScheduledNotifications over one SMTP session.
+    - Claims every row with one conditional UPDATE and loads them with one select_related query;
+      rows for suppressed recipients are canceled there, not sent.
+    - Renders each row; a bad template only fails that row.
+    - Pushes all messages through one pooled connection.
+    - Rows over a rate limit are released unsent and re-published for when their token is free.
+    - While the SMTP circuit breaker is open the whole batch is re-published unclaimed; if it
+      opens mid-batch, the rest of the batch is released unsent for when it half-opens.
+      A refused connection counts as a failed send (and for the breaker) like any other.
+    - Keeps its lease alive while it sends and skips rows canceled or recovered meanwhile (_BatchLease).
+    - Records per-message results with one bulk_update + one bulk_create, for the rows it still holds.
+    - Failed rows are classified like in send_notification; retryable ones go back to it with backoff.
+    """
+    # SMTP server known to be down: hand the whole batch back before claiming anything
+    if smtp_breaker.enabled and _defer(self, [notification_ids], smtp_breaker.allow):
+        return {"sent": 0, "failed": 0, "throttled": 0, "deferred": len(notification_ids)}
+
+    now = timezone.now()
+    owner = uuid.uuid4().hex
+    notifications, results, outgoing = _prepare_batch(notification_ids, owner, now)
+    if not notifications:
+        return {"sent": 0, "failed": 0, "throttled": 0, "deferred": 0}
+    claim = _BatchLease(owner, notifications, now)
+
+    # 4) Send them all over one SMTP session; rows without a rate-limit token wait for it,
+    #    and once the breaker opens the rest wait for it to half-open
+    throttled = {}  # pk -> seconds until a token is free
+    deferred = {}  # pk -> seconds until the breaker lets sends through again
+    breaker_wait = 0.0
+    if outgoing:
+        # the pooled connection is opened by the first send, inside its try: a refused connection
+        # fails that message and counts for the breaker like any send error, then the next one retries
+        with ExitStack() as session:
+            lease = None
+            for sn, email, subject, message_id in outgoing:
+                if not claim.holds(sn.pk):
+                    continue  # canceled or recovered since the claim
+                if breaker_wait:
+                    deferred[sn.pk] = breaker_wait
+                    continue
+                if rate_limiter.enabled:
+                    wait = rate_limiter.acquire(sn.to_email)
+                    if wait:
+                        throttled[sn.pk] = wait
+                        continue
+                try:
+                    lease = lease or session.enter_context(get_pool().lease())
+                    lease.connection.send_messages([email])
+                    lease.record()
+                    results[sn.pk] = (subject, message_id, None)
+                    smtp_breaker.record_success()
+                except Exception as e:
+                    results[sn.pk] = (subject, "", e)
+                    # drop a possibly broken socket; the backend reopens on the next send
+                    if lease is not None:
+                        lease.connection.close()
+                    if classify(e) == CONNECTION and smtp_breaker.record_failure():
+                        breaker_wait = smtp_breaker.allow()
+
+    # 5) Record per-message outcomes in bulk
+    unsent = {**throttled, **deferred}
+    retries, lost = _record_batch(notifications, results, now, owner, unsent)
+
+    # 6) Failed rows retry one by one like any other notification (on their own lane);
+    #    unsent ones when their token / the breaker is due
+    queues = {sn.pk: queue_for(sn.priority) for sn in notifications}
+    for pk, countdown in [*retries, *unsent.items()]:
+        if pk not in lost:
+            send_notification.apply_async(args=[pk], countdown=countdown, queue=queues[pk])
+
+    failed = sum(1 for pk, (_, _, error) in results.items() if error is not None and pk not in lost)
+    return {
+        "sent": sum(1 for pk, (_, _, error) in results.items() if error is None and pk not in lost),
+        "failed": failed,
+        "throttled": len(throttled),
+        "deferred": len(deferred),
+    }
+
+
+def _digest_email(items):
+    """(email, message_id) for one recipient's rendered items; a lone item goes out as its normal email."""
+    email = _build_email(*items[0]) if len(items) == 1 else _build_digest_email(items)
+    email.message()
+    return email, email.extra_headers["Message-ID"]
+
+
+@shared_task(bind=True)
+def send_digest_batch(self, groups, to_email: str = None):
+    """
+    Send digests: every group in `groups` is a list of notification pks for one recipient
+    (built by the dispatcher, see dispatch.coalesce_digests) and goes out as ONE email.
+    - Claims all rows with one conditional UPDATE and loads them with one query.
+    - Renders each row; a broken template only fails its own row, the rest of its
+      digest still goes out (a lone survivor as its normal email).
+    - One rate-limit token and one SMTP transaction per digest, all over one pooled session.
+      Every constituent is marked SENT with the digest's shared provider_message_id and
+      keeps its own NotificationLog row (with its own subject).
+    - A group with a single claimable row left (the others were canceled or sent
+      meanwhile) hands it to send_notification.
+    - Breaker / rate-limit deferrals and retries re-publish the affected digests as a whole;
+      a throttled digest comes back with its `to_email` and waits for that token before claiming.
+    - Keeps its lease alive like send_notification_batch; a digest goes out without the rows
+      canceled or recovered meanwhile (rebuilt from the rest), or not at all if none are left.
+    - Records everything with one bulk_update + one bulk_create, like send_notification_batch.
+    """
+    total = sum(len(group) for group in groups)
+    if smtp_breaker.enabled and _defer(self, [groups], smtp_breaker.allow):
+        return {"digests": 0, "sent": 0, "failed": 0, "throttled": 0, "deferred": total}
+    if to_email and rate_limiter.enabled and _defer(self, [groups, to_email], lambda: rate_limiter.acquire(to_email)):
+        return {"digests": 0, "sent": 0, "failed": 0, "throttled": total, "deferred": 0}
+
+    # 1) Claim + load every row at once
+    now = timezone.now()
+    owner = uuid.uuid4().hex
+    notifications = _claim_and_load([pk for group in groups for pk in group], owner, now)
+    by_pk = {sn.pk: sn for sn in notifications}
+    claim = _BatchLease(owner, notifications, now)
+
+    # 2) Render each group's rows and build its email
+    results = {}  # pk -> (subject, message_id, error)
+    singles = []  # rows whose digest shrank to one before rendering
+    outgoing = []  # [(members, items, email, message_id), ...]
+    for group in groups:
+        members = sorted((by_pk[pk] for pk in group if pk in by_pk), key=lambda sn: (sn.effective_send_at or now, sn.pk))
+        if len(members) < 2:
+            singles.extend(members)
+            continue
+        items = []
+        for sn in members:
+            try:
+                items.append((sn, *_render(sn)))
+            except Exception as e:
+                results[sn.pk] = ("", "", MessageBuildError(e))
+        if not items:
+            continue
+        try:
+            email, message_id = _digest_email(items)
+        except Exception as e:
+            for sn, subject, _ in items:
+                results[sn.pk] = (subject, "", MessageBuildError(e))
+            continue
+        outgoing.append((members, items, email, message_id))
+
+    # 3) Send one email per digest over one SMTP session
+    unsent = {sn.pk: 0 for sn in singles}  # pk -> seconds until it may go out
+    waiting = []  # [(pks, wait, to_email), ...] digests to re-publish as a whole
+    held = Counter()  # "throttled" / "deferred" -> rows
+    breaker_wait = 0.0
+    digests = 0
+    if outgoing:
+        # opened by the first send, like in send_notification_batch
+        with ExitStack() as session:
+            lease = None
+            for members, items, email, message_id in outgoing:
+                still_held = [item for item in items if claim.holds(item[0].pk)]
+                if not still_held:
+                    continue
+                if len(still_held) < len(items):
+                    # some rows were canceled or recovered since the claim: send the rest without them
+                    items = still_held
+                    try:
+                        email, message_id = _digest_email(items)
+                    except Exception as e:
+                        for sn, subject, _ in items:
+                            results[sn.pk] = (subject, "", MessageBuildError(e))
+                        continue
+                wait = breaker_wait
+                if not wait and rate_limiter.enabled and not to_email:  # a re-published digest holds its token
+                    wait = rate_limiter.acquire(members[0].to_email)
+                if wait:
+                    # release the rows that would have gone out; failed renders are recorded as usual
+                    pks = [sn.pk for sn, _, _ in items]
+                    unsent.update(dict.fromkeys(pks, wait))
+                    waiting.append((pks, wait, None if breaker_wait else members[0].to_email))
+                    held["deferred" if breaker_wait else "throttled"] += len(pks)
+                    continue
+                try:
+                    lease = lease or session.enter_context(get_pool().lease())
+                    lease.connection.send_messages([email])
+                    lease.record()
+                    outcome = (message_id, None)
+                    digests += 1
+                    smtp_breaker.record_success()
+                except Exception as e:
+                    outcome = ("", e)
+                    if lease is not None:
+                        lease.connection.close()
+                    if classify(e) == CONNECTION and smtp_breaker.record_failure():
+                        breaker_wait = smtp_breaker.allow()
+                for sn, subject, _ in items:
+                    results[sn.pk] = (subject, *outcome)
+
+    # 4) Record per-row outcomes in bulk
+    retries, lost = _record_batch(notifications, results, now, owner, unsent)
+    retries = dict(retries)
+
+    # 5) Re-publish: lone rows through send_notification, everything else as digests again
+    for sn in singles:
+        if sn.pk not in lost:
+            send_notification.apply_async(args=[sn.pk], queue=queue_for(sn.priority))
+    for members, _, _, _ in outgoing:
+        pks = [sn.pk for sn in members if sn.pk in retries]
+        if pks:
+            waiting.append((pks, max(retries[pk] for pk in pks), None))
+    for pks, countdown, email in waiting:
+        pks = [pk for pk in pks if pk not in lost]
+        if not pks:
+            continue
+        priorities = [by_pk[pk].priority for pk in pks if by_pk[pk].priority is not None]
+        send_digest_batch.apply_async(
+            args=[[pks], email], countdown=countdown, queue=queue_for(min(priorities, default=None))
+        )
+
+    if digests:
+        increment("digest.sent", digests)
+    failed = sum(1 for pk, (_, _, error) in results.items() if error is not None and pk not in lost)
+    return {
+        "digests": digests,
+        "sent": sum(1 for pk, (_, _, error) in results.items() if error is None and pk not in lost),
+        "failed": failed,
+        "throttled": held["throttled"],
+        "deferred": held["deferred"],
+    }
+
+
+@shared_task
+def dispatch_due_notifications(batch_size: int = None, window_seconds: int = None, digest: bool = None):
+    """
+    Periodic dispatcher (Celery beat or `manage.py dispatch_notifications`).
+    - Claims rows due within the next window, shared fairly across tenants
+      (see dispatch.claim_due_notifications).
+    - With `digest` (NOTIFY_DIGEST_ENABLED), rows of digest-compatible templates for the
+      same recipient go out as one email each, through send_digest_batch (see
+      dispatch.coalesce_digests).
+    - Groups the rest by (effective_send_at, priority) and hands each group to
+      send_notification_batch in chunks of `batch_size` (NOTIFY_BATCH_SIZE) on the
+      priority's queue, with a short ETA for rows that are not due yet.
+
+    Returns the number of notifications dispatched.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    if window_seconds is None:
+        window_seconds = DISPATCH_WINDOW_SECONDS
+    if digest is None:
+        digest = DIGEST_ENABLED
+
+    now = timezone.now()
+    claimed = claim_due_notifications(window_seconds=window_seconds, now=now)
+
+    # digests: one send_digest_batch per (ETA, lane), up to `batch_size` rows each
+    digests = []
+    if digest:
+        digests, claimed = coalesce_digests(claimed, now)
+    digest_groups = {}
+    for ids, send_at, priority in digests:
+        eta = send_at if send_at and send_at > now else None
+        digest_groups.setdefault((eta, priority), []).append(ids)
+    for (eta, priority), recipients in digest_groups.items():
+        batch, rows = [], 0
+        for ids in recipients:
+            if batch and rows + len(ids) > batch_size:
+                send_digest_batch.apply_async(args=[batch], eta=eta, queue=queue_for(priority))
+                batch, rows = [], 0
+            batch.append(ids)
+            rows += len(ids)
+        send_digest_batch.apply_async(args=[batch], eta=eta, queue=queue_for(priority))
+
+    # group by send instant and lane so every chunk can share one ETA and queue
+    # (claims come critical lane first, so those chunks are published first too)
+    groups = {}
+    for pk, send_at, priority in claimed:
+        eta = send_at if send_at and send_at > now else None
+        groups.setdefault((eta, priority), []).append(pk)
+
+    for (eta, priority), ids in groups.items():
+        queue = queue_for(priority)
+        for start in range(0, len(ids), batch_size):
+            send_notification_batch.apply_async(args=[ids[start:start + batch_size]], eta=eta, queue=queue)
+    return len(claimed) + sum(len(ids) for ids, _, _ in digests)
+
+
+@shared_task
+def recover_stale_leases():
+    """
+    Put notifications whose worker died back in the queue.
+    - QUEUED with an expired lease: the worker crashed mid-attempt.
+    - QUEUED with no lease for STALE_QUEUED_SECONDS: the task never reached a worker.
+    Both go back to RETRYING and get a fresh send_notification task.
+
+    Returns the number of notifications recovered.
+    """
+    now = timezone.now()
+    stale = ScheduledNotification.objects.filter(
+        Q(lease_expires_at__lt=now)
+        | Q(lease_expires_at__isnull=True, updated_at__lt=now - timedelta(seconds=STALE_QUEUED_SECONDS)),
+        state=ScheduledNotification.Status.QUEUED,
+        canceled=False,
+    )
+    rows = list(stale.values_list("pk", "priority")[:DISPATCH_LIMIT])
+    if not rows:
+        return 0
+    ids = [pk for pk, _ in rows]
+
+    # same conditions in the UPDATE: a row a worker claimed meanwhile is left alone
+    # (its extra send_notification task will just return "skip:leased")
+    recovered = stale.filter(pk__in=ids).update(
+        state=ScheduledNotification.Status.RETRYING,
+        lease_owner=None,
+        lease_expires_at=None,
+        updated_at=now,
+    )
+    for pk, priority in rows:
+        send_notification.apply_async(args=[pk], queue=queue_for(priority))
+    return recovered
+
+
+@shared_task
+def purge_old_notifications():
+    """
+    Periodic retention pass with the NOTIFY_*_RETENTION_* settings
+    (see notifications.retention). Returns the deleted counts.
+    """
+    return {
+        "logs": purge_logs()["deleted"],
+        "notifications": compact_notifications()["deleted"],
+    }
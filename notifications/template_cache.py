@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.template import Template
+
+from .conf import TEMPLATE_CACHE_SIZE, TEMPLATE_FIELDS_TTL_SECONDS
+from .metrics import registry
+from .models import NotificationTemplate
+
+
+class CompiledTemplateCache:
+    """
+    Bounded LRU of compiled (subject, body) Templates for NotificationTemplate rows.
+
+    Keyed by (template.pk, template.updated_at), so an edited template never
+    hits a stale entry even in processes that missed the invalidation signal.
+    Template key / priority by pk (no row at hand to compare updated_at) is a second
+    LRU of the same size whose entries expire after `fields_ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = TEMPLATE_CACHE_SIZE, fields_ttl: float = TEMPLATE_FIELDS_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.fields_ttl = fields_ttl
+        self._data = OrderedDict()
+        self._keys = OrderedDict()  # template pk -> (expires at (monotonic), template.key, template.priority)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template):
+        """
+        Return (subject_template, body_template) for a NotificationTemplate,
+        compiling and caching them on a miss.
+        """
+        key = (template.pk, template.updated_at)
+        with self._lock:
+            compiled = self._data.get(key)
+            if compiled is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # compile outside the lock; a concurrent miss just compiles twice
+        compiled = (Template(template.subject), Template(template.body))
+        if self.maxsize <= 0:
+            return compiled
+
+        with self._lock:
+            self._data[key] = compiled
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return compiled
+
+    def _template_fields(self, template_pk):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(template_pk)
+            if entry is not None and entry[0] > now:
+                self._keys.move_to_end(template_pk)
+                return entry[1:]
+
+        fields = NotificationTemplate.objects.values_list("key", "priority").get(pk=template_pk)
+        if self.maxsize > 0:
+            with self._lock:
+                self._keys[template_pk] = (now + self.fields_ttl, *fields)
+                self._keys.move_to_end(template_pk)
+                while len(self._keys) > self.maxsize:
+                    self._keys.popitem(last=False)
+        return fields
+
+    def template_key(self, template_pk) -> str:
+        """
+        NotificationTemplate.key for a pk, fetched at most once per `fields_ttl`
+        (the pre_save signal needs it for every new ScheduledNotification).
+        """
+        return self._template_fields(template_pk)[0]
+
+    def template_priority(self, template_pk) -> int:
+        """NotificationTemplate.priority for a pk, fetched along with the key."""
+        return self._template_fields(template_pk)[1]
+
+    def invalidate(self, template_pk):
+        """Drop every cached version of one template (compiled templates, key and priority)."""
+        with self._lock:
+            for key in [k for k in self._data if k[0] == template_pk]:
+                del self._data[key]
+            self._keys.pop(template_pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "fields_size": len(self._keys),
+            }
+
+
+template_cache = CompiledTemplateCache()
+registry.register_collector("template_cache", template_cache.stats)
@@ -1,3 +1,25 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+from .conf import METRICS_TOKEN
+from .metrics import render_prometheus
+
+
+def _may_scrape(request) -> bool:
+    """Staff users, or a bearer token matching NOTIFY_METRICS_TOKEN (if one is set)."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    if not METRICS_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+
+def metrics(request):
+    """Prometheus scrape endpoint for this process's notification metrics (staff / token only)."""
+    if not _may_scrape(request):
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")